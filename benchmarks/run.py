@@ -0,0 +1,331 @@
+''' Benchmarks for the stages that limit sample throughput, on synthetic data.
+
+    python -m benchmarks.run [--save] [--threshold 0.3] [stage ...]
+
+    Each stage reports its rate (samples, frames or calls per second) and the
+    latency per call. With a stored baseline, a stage whose rate drops by more
+    than the threshold fails the run with exit code 1. --save stores the
+    current results as the new baseline.
+'''
+import argparse
+import atexit
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from libs import decimate, fake_api, hires, ppklog
+from libs.decoder import decode_average, decode_trigger
+from libs.filters import RunningMedian
+from libs.framer import Framer, stuff
+from libs.regionindex import RegionIndex
+from libs.ringbuffer import RingBuffer
+from libs.stats import RunningStats
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_THRESHOLD = 0.3
+DEFAULT_REPEAT = 3
+
+RESISTORS = fake_api.RESISTORS
+AVG_FRAMES = 20000
+TRIG_FRAMES = 200
+TRIG_WINDOW = 512
+READ_CHUNK = 4096
+LOG_SAMPLES = 2000000
+HIRES_SECONDS = 2.0
+
+BENCHMARKS = []
+_work_dir = []
+
+
+def benchmark(unit):
+    ''' Register a stage. The function does its setup and returns a callable
+        that runs the stage once and returns (items, calls).
+    '''
+    def register(func):
+        BENCHMARKS.append((func.__name__, unit, func))
+        return func
+    return register
+
+
+def avg_frames(n=AVG_FRAMES):
+    values = np.random.RandomState(1).uniform(1.0, 5000.0, n).astype('<f4')
+    return [struct.pack('<f', v) for v in values]
+
+
+def trig_frames(n=TRIG_FRAMES, window=TRIG_WINDOW):
+    api = fake_api.API(resistors=RESISTORS)
+    current = fake_api.Waveform(period=window * 13e-6)(np.arange(n * window) * 13e-6)
+    return [api.trigger_words(current[i * window:(i + 1) * window]) for i in range(n)]
+
+
+def stream(chunk=READ_CHUNK):
+    ''' Stuffed frames as rtt_read would return them '''
+    frames = avg_frames() + trig_frames()
+    data = b''.join(stuff(f) for f in frames)
+    return len(frames), [data[i:i + chunk] for i in range(0, len(data), chunk)]
+
+
+@benchmark('frames')
+def framer():
+    count, chunks = stream()
+
+    def run():
+        f = Framer()
+        found = 0
+        for chunk in chunks:
+            found += len(f.feed(chunk))
+        assert found == count
+        return found, len(chunks)
+    return run
+
+
+@benchmark('frames')
+def rtt_read_pipeline():
+    ''' rtt read and process threads against the simulated PPK at full speed '''
+    import libs.rtt as rtt
+    frames = 50000
+
+    def run():
+        done = threading.Event()
+        seen = [0]
+
+        def callback(frame):
+            seen[0] += 1
+            if seen[0] == frames:
+                done.set()
+        r = rtt.rtt(callback, api=lambda: fake_api.API(speed=None))
+        r.start()
+        r.nrfjprog.rtt_write(0, stuff([rtt.RTT_COMMANDS.RTT_CMD_RUN]), encoding=None)
+        r.nrfjprog.write_u32(rtt.NRF_EGU0_BASE + rtt.TASKS_TRIGGER0_OFFSET, 1, 0)
+        ok = done.wait(60)
+        r.alive = False
+        r.read_thread.join()
+        assert ok, "pipeline stalled after %d frames" % seen[0]
+        return frames, frames
+    return run
+
+
+@benchmark('samples')
+def decode_avg():
+    ''' The rtt_handler average path: decode, ring buffer and running stats '''
+    frames = avg_frames()
+
+    def run():
+        ring = RingBuffer(AVG_FRAMES // 2)
+        stats = RunningStats(ring)
+        for frame in frames:
+            sample = decode_average(frame) / 1e6
+            evicted = ring.latest(ring.size)[0]
+            ring.append(sample)
+            stats.append(sample, evicted)
+        return len(frames), len(frames)
+    return run
+
+
+@benchmark('samples')
+def decode_trig():
+    ''' The rtt_handler trigger path with the switch filter on '''
+    frames = trig_frames()
+
+    def run():
+        ring = RingBuffer(TRIG_WINDOW)
+        for frame in frames:
+            samples, ranges = decode_trigger(frame, RESISTORS[0], RESISTORS[1], RESISTORS[2], 1e-7, True)
+            ring.extend(samples)
+        return len(frames) * TRIG_WINDOW, len(frames)
+    return run
+
+
+@benchmark('calls')
+def write_stuffed():
+    import libs.rtt as rtt
+    r = rtt.rtt(lambda frame: None, api=lambda: fake_api.API(speed=None))
+    cmd = [rtt.RTT_COMMANDS.RTT_CMD_TRIGGER_SET, 0x00, 0x09, 0xC4]
+    calls = 50
+
+    def run():
+        for i in range(calls):
+            r.write_stuffed(cmd).result()
+        return calls, calls
+    return run
+
+
+@benchmark('calls')
+def status_stats():
+    ''' The statistics behind SettingsWindow.update_status: window values and
+        two cursor regions, as refreshed every 200 ms, with the samples that
+        arrive in between. Qt is not involved, widget updates are not timed.
+    '''
+    size = int(10 / 130e-6)
+    ring = RingBuffer(size)
+    ring.extend(np.random.RandomState(2).uniform(0, 1e-3, size))
+    stats = RunningStats(ring)
+    index = RegionIndex(ring)
+    new = np.random.RandomState(3).uniform(0, 1e-3, 1500)
+    calls = 50
+
+    def run():
+        for i in range(calls):
+            for sample in new:
+                evicted = ring.latest(ring.size)[0]
+                ring.append(sample)
+                stats.append(sample, evicted)
+            stats.max, stats.mean, stats.rms
+            index.region(size // 4, size // 2)
+            index.region(0, size)
+        return calls, calls
+    return run
+
+
+@benchmark('samples')
+def running_median():
+    x = np.random.RandomState(4).uniform(0, 1e-3, 100000)
+
+    def run():
+        RunningMedian(9).filter(x)
+        return len(x), len(x)
+    return run
+
+
+def work_dir():
+    ''' Scratch directory for logs, removed on exit '''
+    if not _work_dir:
+        _work_dir.append(tempfile.mkdtemp(prefix='ppkbench'))
+        atexit.register(shutil.rmtree, _work_dir[0], True)
+    return _work_dir[0]
+
+
+def write_log(path, n=LOG_SAMPLES):
+    samples = np.random.RandomState(5).uniform(0, 1e-3, n).astype(ppklog.SAMPLE_DTYPE)
+    with open(path, 'wb') as f:
+        ppklog.write_header(f, {'stream': 'average', 'interval': 130e-6, 'dtype': ppklog.SAMPLE_DTYPE})
+        f.write(samples.tobytes())
+
+
+def show_log(path):
+    ''' The data side of LogViewer.do_log on open: pyramid, then the envelope
+        of the first full view. Plotting is not timed.
+    '''
+    meta, levels = decimate.load_pyramid(path)
+    n = len(levels[0][1])
+    step, data = decimate.select_level(levels, 0, n, 4000)
+    decimate.envelope_xy(step, data, 0, n, meta['interval'])
+    return n
+
+
+@benchmark('samples')
+def log_pyramid_cold():
+    path = os.path.join(work_dir(), 'cold.ppk')
+    write_log(path)
+
+    def run():
+        if os.path.exists(path + decimate.PYRAMID_SUFFIX):
+            os.remove(path + decimate.PYRAMID_SUFFIX)
+        return show_log(path), 1
+    return run
+
+
+@benchmark('samples')
+def log_pyramid_cached():
+    path = os.path.join(work_dir(), 'cached.ppk')
+    write_log(path)
+    show_log(path)
+
+    def run():
+        return show_log(path), 1
+    return run
+
+
+@benchmark('samples')
+def hires_realtime():
+    ''' Full resolution capture from the simulator in real time. Windows
+        follow each other, so the store must not break up into one segment
+        per window.
+    '''
+    directory = os.path.join(work_dir(), 'hires')
+    env = dict(os.environ, PPK_SIMULATE='1')
+
+    def run():
+        shutil.rmtree(directory, True)
+        subprocess.check_call([sys.executable, '-m', 'libs.capture', '--seconds', str(HIRES_SECONDS),
+                               '--out', directory + '.ppk', '--hires', directory, '--no-offset-calibration'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+        store = hires.HiresStore(directory)
+        longest = max(stop - first for first, stop, start_time in store.segment_bounds())
+        assert longest > hires.WINDOW, "every window is a segment of its own, %d samples" % longest
+        expected = HIRES_SECONDS / hires.SAMPLE_INTERVAL
+        assert len(store) > 0.9 * expected, "stored %d of about %d samples" % (len(store), expected)
+        return len(store), 1
+    return run
+
+
+def measure(setup, repeat):
+    run = setup()
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        items, calls = run()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, items, calls)
+    elapsed, items, calls = best
+    return {'rate': items / elapsed, 'latency': elapsed / calls}
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description='Hot path benchmarks')
+    parser.add_argument('stages', nargs='*', help='stages to run, default all')
+    parser.add_argument('--save', action='store_true', help='store results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed relative drop in rate before a stage fails')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline(args.baseline)
+    results = {}
+    failed = []
+    print("%-18s %14s %-10s %12s %10s" % ('stage', 'rate', 'unit/s', 'latency', 'baseline'))
+    for name, unit, setup in BENCHMARKS:
+        if args.stages and name not in args.stages:
+            continue
+        result = measure(setup, args.repeat)
+        results[name] = dict(result, unit=unit)
+        compare = ''
+        if name in baseline:
+            change = result['rate'] / baseline[name]['rate'] - 1.0
+            compare = '%+.0f%%' % (change * 100)
+            if change < -args.threshold:
+                failed.append(name)
+                compare += ' FAIL'
+        print("%-18s %14.0f %-10s %10.1f us %10s" % (name, result['rate'], unit, result['latency'] * 1e6, compare))
+        sys.stdout.flush()
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print("Baseline saved to %s" % args.baseline)
+    if failed:
+        print("Regressed past %.0f%%: %s" % (args.threshold * 100, ', '.join(failed)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
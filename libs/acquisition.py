@@ -0,0 +1,186 @@
+''' RTT reading and decoding in a child process.
+
+    The child owns the debugger connection. It decodes frames as they arrive
+    and publishes the samples in shared memory rings: averages in A without
+    the offset, trigger samples in A, and the range of each trigger sample.
+    AcquisitionProcess is the GUI side. It stands in for libs.rtt.rtt,
+    forwards commands and decoder settings to the child, and poll() returns
+    the samples published since the last poll.
+'''
+import multiprocessing
+import queue
+import numpy as np
+from concurrent.futures import Future
+import libs.rtt as rtt
+from libs.decoder import MEAS_RANGE_NONE, decode_average, decode_trigger
+from libs.shmring import SharedRing
+
+AVG_RING_SIZE = 1 << 20
+TRIG_RING_SIZE = 1 << 21
+STATS_INTERVAL = 0.2
+STOP_TIMEOUT = 3.0
+
+
+def run_child(snr, avg_name, trig_name, range_name, commands, events):
+    ''' Entry point of the acquisition process '''
+    avg_ring = SharedRing(AVG_RING_SIZE, np.float64, avg_name)
+    trig_ring = SharedRing(TRIG_RING_SIZE, np.float64, trig_name)
+    range_ring = SharedRing(TRIG_RING_SIZE, np.uint8, range_name)
+    decoder = {'resistors': None, 'offset': 0.0, 'switch_filter': True}
+
+    def handle_frame(data):
+        if len(data) == 4:
+            avg_ring.append(decode_average(data) / 1e6)
+        elif decoder['resistors'] is not None:
+            res_lo, res_mid, res_hi = decoder['resistors']
+            samples, ranges = decode_trigger(data, res_lo, res_mid, res_hi,
+                                             decoder['offset'], decoder['switch_filter'])
+            if (ranges == MEAS_RANGE_NONE).any():
+                print("Range not detected")
+            # Ranges first, the reader goes by the sample count
+            range_ring.extend(ranges)
+            trig_ring.extend(samples)
+
+    try:
+        link = rtt.rtt(handle_frame, snr=snr)
+    except Exception as e:
+        events.put(('error', str(e)))
+        return
+    link.start()
+    events.put(('started',))
+
+    def ack(command_id):
+        def done(future):
+            error = future.exception()
+            events.put(('ack', command_id, None if error is None else str(error)))
+        return done
+
+    while True:
+        try:
+            message = commands.get(timeout=STATS_INTERVAL)
+        except queue.Empty:
+            message = None
+        if message is not None:
+            if message[0] == 'cmd':
+                link.write_stuffed(message[2]).add_done_callback(ack(message[1]))
+            elif message[0] == 'decoder':
+                decoder.update(message[1])
+            elif message[0] == 'stop':
+                break
+        events.put(('stats', dict(link.frame_stats(), alive=link.alive)))
+
+    link.flush(STOP_TIMEOUT)
+    link.alive = False
+    for ring in (avg_ring, trig_ring, range_ring):
+        ring.close()
+
+
+class AcquisitionProcess(object):
+    ''' GUI side of the acquisition process, used in place of an rtt instance '''
+    def __init__(self, snr=None):
+        self.snr = snr
+        self.avg_ring = SharedRing(AVG_RING_SIZE, np.float64, readonly=True)
+        self.trig_ring = SharedRing(TRIG_RING_SIZE, np.float64, readonly=True)
+        self.range_ring = SharedRing(TRIG_RING_SIZE, np.uint8, readonly=True)
+        self.avg_read = 0
+        self.trig_read = 0
+        self.lost_samples = 0
+        self.stats = {'depth': 0, 'high_watermark': 0, 'dropped': 0,
+                      'bytes_per_second': 0.0, 'read_size': 0}
+        self.decoder = None
+        self.futures = {}
+        self.next_id = 0
+        self.process = None
+        self.failed = False
+        self.closed = False
+
+        # Spawn, the child must not inherit the GUI's Qt state
+        context = multiprocessing.get_context('spawn')
+        self.commands = context.Queue()
+        self.events = context.Queue()
+        self.process = context.Process(target=run_child,
+                                       args=(self.snr, self.avg_ring.name, self.trig_ring.name,
+                                             self.range_ring.name, self.commands, self.events))
+        self.process.daemon = True
+
+    def start(self):
+        self.process.start()
+
+    @property
+    def alive(self):
+        if self.closed or self.failed:
+            return False
+        return self.process.pid is None or self.process.is_alive()
+
+    @alive.setter
+    def alive(self, value):
+        if not value:
+            self.close()
+
+    @property
+    def dropped_frames(self):
+        return self.stats['dropped']
+
+    def frame_stats(self):
+        return dict(self.stats, lost_samples=self.lost_samples)
+
+    def write_stuffed(self, cmd):
+        future = Future()
+        self.futures[self.next_id] = future
+        self.commands.put(('cmd', self.next_id, list(cmd)))
+        self.next_id += 1
+        return future
+
+    def set_decoder(self, res_lo, res_mid, res_hi, offset, switch_filter):
+        ''' Trigger decoding settings, only sent when they change '''
+        decoder = {'resistors': (res_lo, res_mid, res_hi), 'offset': offset, 'switch_filter': switch_filter}
+        if decoder != self.decoder:
+            self.decoder = decoder
+            self.commands.put(('decoder', decoder))
+
+    def handle_events(self):
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return
+            if event[0] == 'stats':
+                self.stats = event[1]
+            elif event[0] == 'ack':
+                future = self.futures.pop(event[1], None)
+                if future is None:
+                    continue
+                if event[2] is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(rtt.CommandError(event[2]))
+            elif event[0] == 'error':
+                print("Acquisition process failed: %s" % event[1])
+                self.failed = True
+
+    def poll(self):
+        ''' Returns (averages, (trigger samples, ranges)) published since the last poll '''
+        if self.closed:
+            empty = np.zeros(0)
+            return empty, (empty, np.zeros(0, dtype=np.uint8))
+        self.handle_events()
+        averages, self.avg_read, lost = self.avg_ring.read(self.avg_read)
+        self.lost_samples += lost
+        stop = self.trig_ring.count
+        samples, stop, lost = self.trig_ring.read(self.trig_read, stop)
+        ranges = self.range_ring.read(stop - len(samples), stop)[0]
+        self.trig_read = stop
+        self.lost_samples += lost
+        return averages, (samples, ranges)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.process.pid is not None:
+            self.commands.put(('stop',))
+            self.process.join(STOP_TIMEOUT)
+            if self.process.is_alive():
+                self.process.terminate()
+        for ring in (self.avg_ring, self.trig_ring, self.range_ring):
+            ring.close()
@@ -0,0 +1,207 @@
+''' Statistics of logs of any length, in one pass over chunks of samples.
+
+    python ppk.py analyze capture.ppk [--threshold UA] [--percentile P ...] [--json]
+
+    Works on binary logs (average, trigger or software trigger captures) and
+    full resolution capture directories. Memory use does not depend on the
+    log length: sums are added up per chunk in compensated sums, extremes
+    and the samples above the threshold are counted per chunk, and the
+    percentiles come from a fixed histogram with log spaced bins.
+'''
+import argparse
+import json
+import math
+import os
+import sys
+import numpy as np
+from libs.charge import CompensatedSum
+from libs.ppklog import open_log
+
+CHUNK_SAMPLES = 1 << 22
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+# Histogram bins: magnitudes from 100 pA to 10 A, 100 bins per decade (about
+# 2.3 % wide), for both signs, and one bin for everything closer to zero.
+HIST_MIN_DECADE = -10
+HIST_DECADES = 11
+HIST_PER_DECADE = 100
+HIST_HALF = HIST_DECADES * HIST_PER_DECADE
+HIST_ZERO = HIST_HALF
+
+
+def histogram_edges():
+    ''' Edges of all bins in A, 2 * HIST_HALF + 2 of them '''
+    magnitudes = 10.0 ** (HIST_MIN_DECADE + np.arange(HIST_HALF + 1) / float(HIST_PER_DECADE))
+    return np.concatenate((-magnitudes[::-1], magnitudes))
+
+
+class Analysis(object):
+    ''' Accumulates statistics over chunks of samples in A, interval apart.
+
+        threshold (A) sets what counts as active for time above threshold,
+        pulse count and duty cycle. NaN samples, from the switch filter, are
+        left out of everything but the duration.
+    '''
+    def __init__(self, interval, threshold=None):
+        self.interval = float(interval)
+        self.threshold = threshold
+        self.samples = 0            # Including NaN
+        self.count = 0
+        self.total = CompensatedSum()
+        self.total_sq = CompensatedSum()
+        self.min = math.inf
+        self.max = -math.inf
+        self.max_index = None
+        self.above = 0
+        self.pulses = 0
+        self.was_above = False
+        self.histogram = np.zeros(2 * HIST_HALF + 1, dtype=np.int64)
+
+    def update(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        first = self.samples
+        self.samples += len(samples)
+        valid = samples[~np.isnan(samples)]
+        if not len(valid):
+            return
+        self.count += len(valid)
+        self.total.add(float(np.sum(valid)))
+        self.total_sq.add(float(np.dot(valid, valid)))
+        self.min = min(self.min, float(valid.min()))
+        peak = int(np.nanargmax(samples))
+        if samples[peak] > self.max:
+            self.max = float(samples[peak])
+            self.max_index = first + peak
+        self.histogram += np.bincount(self._bins(valid), minlength=len(self.histogram))
+
+        if self.threshold is not None:
+            above = samples > self.threshold
+            self.above += int(np.count_nonzero(above))
+            # Rising edges, the state carries over from the last chunk
+            rising = np.count_nonzero(above[1:] & ~above[:-1])
+            self.pulses += int(rising) + int(above[0] and not self.was_above)
+            self.was_above = bool(above[-1])
+
+    def _bins(self, values):
+        magnitude = np.abs(values)
+        with np.errstate(divide='ignore'):
+            steps = np.floor((np.log10(magnitude) - HIST_MIN_DECADE) * HIST_PER_DECADE)
+        # Bin 0 on each side starts at 10^HIST_MIN_DECADE, below that is the zero bin
+        steps = np.clip(steps, -1, HIST_HALF - 1).astype(np.int64) + 1
+        return HIST_ZERO + np.where(values < 0, -steps, steps)
+
+    def percentile(self, p):
+        ''' Estimate of the p-th percentile, the middle of the bin it falls in '''
+        if not self.count:
+            return math.nan
+        cumulative = np.cumsum(self.histogram)
+        index = int(np.searchsorted(cumulative, p / 100.0 * self.count))
+        index = min(index, len(self.histogram) - 1)
+        if index == HIST_ZERO:
+            return 0.0
+        step = abs(index - HIST_ZERO) - 1
+        middle = 10.0 ** (HIST_MIN_DECADE + (step + 0.5) / HIST_PER_DECADE)
+        value = middle if index > HIST_ZERO else -middle
+        # The bins at the ends are open, the extremes are known exactly
+        return min(max(value, self.min), self.max)
+
+    def nonzero_histogram(self):
+        ''' (lower edge, upper edge, count) of every bin with samples '''
+        edges = histogram_edges()
+        # The zero bin sits between the two halves of the edges
+        lower = np.concatenate((edges[:HIST_HALF], [-edges[HIST_HALF + 1]], edges[HIST_HALF + 1:-1]))
+        upper = np.concatenate((edges[1:HIST_HALF + 1], [edges[HIST_HALF + 1]], edges[HIST_HALF + 2:]))
+        used = np.flatnonzero(self.histogram)
+        return [(float(lower[i]), float(upper[i]), int(self.histogram[i])) for i in used]
+
+    def result(self, percentiles=PERCENTILES):
+        count = max(self.count, 1)
+        result = {'samples': self.samples,
+                  'interval': self.interval,
+                  'duration': self.samples * self.interval,
+                  'charge': self.total.value * self.interval,
+                  'mean': self.total.value / count,
+                  'rms': math.sqrt(max(self.total_sq.value, 0.0) / count),
+                  'min': self.min if self.count else math.nan,
+                  'max': self.max if self.count else math.nan,
+                  'max_time': self.max_index * self.interval if self.max_index is not None else None,
+                  'percentiles': dict(('%g' % p, self.percentile(p)) for p in percentiles)}
+        if self.threshold is not None:
+            result.update({'threshold': self.threshold,
+                           'time_above': self.above * self.interval,
+                           'duty_cycle': self.above / float(count),
+                           'pulses': self.pulses,
+                           'mean_pulse_width': self.above * self.interval / self.pulses if self.pulses else 0.0})
+        return result
+
+
+def chunks(path, chunk=CHUNK_SAMPLES):
+    ''' Returns (interval, iterator over sample chunks in A) for a log or a
+        full resolution capture directory
+    '''
+    if os.path.isdir(path):
+        from libs.hires import HiresStore
+        store = HiresStore(path)
+
+        def read():
+            for start in range(0, len(store), chunk):
+                yield store.read(start, start + chunk)[0]
+        return store.meta['sample_interval'], read()
+
+    meta, samples = open_log(path)
+
+    def read():
+        for start in range(0, len(samples), chunk):
+            yield samples[start:start + chunk]
+    return meta['interval'], read()
+
+
+def analyze(path, threshold=None, percentiles=PERCENTILES, chunk=CHUNK_SAMPLES):
+    ''' Statistics of a whole log, see Analysis.result() '''
+    interval, data = chunks(path, chunk)
+    analysis = Analysis(interval, threshold)
+    for samples in data:
+        analysis.update(samples)
+    return analysis
+
+
+def print_result(result):
+    print("%d samples, %.3f s" % (result['samples'], result['duration']))
+    print("charge  %.6g C" % result['charge'])
+    for name in ('mean', 'rms', 'min', 'max'):
+        print("%-7s %.6g A" % (name, result[name]))
+    for p, value in sorted(result['percentiles'].items(), key=lambda item: float(item[0])):
+        print("p%-6s %.6g A" % (p, value))
+    if 'threshold' in result:
+        print("above %.6g A for %.6g s, duty cycle %.3f %%, %d pulses of %.6g s on average"
+              % (result['threshold'], result['time_above'], result['duty_cycle'] * 100,
+                 result['pulses'], result['mean_pulse_width']))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='ppk.py analyze', description='Statistics of a binary log')
+    parser.add_argument('log', help='binary log or full resolution capture directory')
+    parser.add_argument('--threshold', type=float, metavar='UA',
+                        help='level in uA for time above, pulse count and duty cycle')
+    parser.add_argument('--percentile', type=float, action='append', help='percentile to report, repeatable')
+    parser.add_argument('--histogram', metavar='CSV', help='write the histogram to a CSV file')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    args = parser.parse_args(argv)
+
+    threshold = args.threshold / 1e6 if args.threshold is not None else None
+    analysis = analyze(args.log, threshold)
+    result = analysis.result(args.percentile or PERCENTILES)
+    if args.json:
+        print(json.dumps(result, indent=1))
+    else:
+        print_result(result)
+    if args.histogram:
+        with open(args.histogram, 'w') as f:
+            f.write('lower[A],upper[A],count\n')
+            for lower, upper, count in analysis.nonzero_histogram():
+                f.write('%.6g,%.6g,%d\n' % (lower, upper, count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,153 @@
+''' Parsing of the startup banner the PPK firmware prints on RTT channel 0.
+
+    The banner holds the firmware version, the production calibration
+    resistors and board id, optionally user set resistors, and the
+    reference voltages, e.g.
+    "... R1:510.0 R2:28.0 R3:1.8 Board ID 1234 USER SET R1:... Refs VDD: 3000 HI: 1234 LO: 5678"
+
+    Parsed values are cached per board id. For a board that has been seen
+    before, reading stops as soon as the board id is in, sampling starts on
+    the cached values and revalidate() checks them once the rest of the
+    banner arrives.
+'''
+import json
+import os
+import re
+
+SUPPORTED_FW = ['1.0.0', 'ED R1', '1.1.0']
+
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.ppk', 'calibration.json')
+
+_NUM = r'([-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)'
+RES_RE = re.compile(r'R1:\s*' + _NUM + r'\s*R2:\s*' + _NUM + r'\s*R3:\s*' + _NUM)
+BOARD_RE = re.compile(r'Board ID\s*(.*?)\s*(?:USER SET|Refs)')
+USER_RE = re.compile(r'USER SET\s*(.*?)Refs', re.S)
+REFS_RE = re.compile(r'Refs\s*VDD:\s*(-?\d+)\s*HI:\s*(-?\d+)\s*LO:\s*(-?\d+)')
+
+
+def parse_version(data):
+    return data[8:13]
+
+
+def parse_resistors(text):
+    ''' Returns (R1, R2, R3), low, mid and high range resistors '''
+    match = RES_RE.search(text)
+    if match is None:
+        raise ValueError("No calibration resistors found")
+    return tuple(float(v) for v in match.groups())
+
+
+def parse_board_id(data):
+    match = BOARD_RE.search(data)
+    if match is None:
+        raise ValueError("No board id found")
+    return match.group(1)
+
+
+def parse_production(data):
+    ''' Returns (R1, R2, R3, board_id) as set in production '''
+    prod_data = data.split("USER SET ")[0]
+    r1, r2, r3 = parse_resistors(prod_data)
+    return r1, r2, r3, parse_board_id(data)
+
+
+def parse_user(data):
+    ''' Returns (R1, R2, R3) set by the user, or None if not set '''
+    match = USER_RE.search(data)
+    if match is None:
+        return None
+    return parse_resistors(match.group(1))
+
+
+def parse_refs(data):
+    ''' Returns (vdd, vref_hi, vref_lo) as the strings the firmware sent '''
+    match = REFS_RE.search(data)
+    if match is None:
+        raise ValueError("No reference values found")
+    return match.groups()
+
+
+def parse_banner(data):
+    ''' Parse the whole banner, raises ValueError if any part is missing '''
+    r1, r2, r3, board_id = parse_production(data)
+    cal = {'version': parse_version(data),
+           'board_id': board_id,
+           'CAL_MEAS_RES_LO': r1,
+           'CAL_MEAS_RES_MID': r2,
+           'CAL_MEAS_RES_HI': r3}
+    user = parse_user(data)
+    if user is not None:
+        r1, r2, r3 = user
+    cal['MEAS_RES_LO'] = r1
+    cal['MEAS_RES_MID'] = r2
+    cal['MEAS_RES_HI'] = r3
+    cal['vdd'], cal['vref_hi'], cal['vref_lo'] = parse_refs(data)
+    return cal
+
+
+def banner_complete(data):
+    try:
+        parse_banner(data)
+        return True
+    except ValueError:
+        return False
+
+
+def board_cached(data):
+    ''' True once the board id is in and its calibration is cached '''
+    try:
+        return parse_board_id(data) in load_cache()
+    except ValueError:
+        return False
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_cache(cal):
+    cache = load_cache()
+    cache[cal['board_id']] = cal
+    try:
+        if not os.path.isdir(os.path.dirname(CACHE_FILE)):
+            os.makedirs(os.path.dirname(CACHE_FILE))
+        with open(CACHE_FILE, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+    except (IOError, OSError) as e:
+        print("Unable to cache calibration: %s" % str(e))
+
+
+def from_banner(data):
+    ''' Parse the banner and update the cache for this board. If the banner
+        is incomplete, fall back to the cached values for its board id.
+    '''
+    try:
+        cal = parse_banner(data)
+    except ValueError:
+        cached = load_cache().get(parse_board_id(data))
+        if cached is None:
+            raise
+        cal = dict(cached, version=parse_version(data))
+        return cal
+    save_cache(cal)
+    return cal
+
+
+def revalidate(cal, data):
+    ''' Check calibration taken from the cache against the whole banner and
+        update the cache. Returns the calibration from the banner if it
+        differs from cal, otherwise None.
+    '''
+    try:
+        banner = parse_banner(data)
+    except ValueError:
+        print("Startup banner incomplete, keeping the cached calibration")
+        return None
+    save_cache(banner)
+    if all(cal.get(key) == value for key, value in banner.items()):
+        return None
+    return banner
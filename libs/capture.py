@@ -0,0 +1,308 @@
+''' Headless capture, records to a binary log without Qt or pyqtgraph.
+
+    python ppk.py capture --seconds 60 --out capture.ppk [--trigger] [--snr N]
+                          [--soft-trigger UA --pre MS --post MS] [--hires DIR]
+'''
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+import libs.rtt as rtt
+from libs import calibration
+from libs import hires
+from libs.charge import ChargeCounter
+from libs.decoder import SAMPLE_INTERVAL, decode_average, decode_trigger
+from libs.ppklog import ENCODING_RAW, TRIGGER_FORMATS, LogWriter
+from libs.rtt import RTT_COMMANDS
+from libs.softtrigger import EDGES, RISING, SoftTrigger, save_capture
+
+# Offset calibration, same as the GUI: DUT off, average this many samples
+CALIBRATION_SAMPLES = 10000
+CALIBRATION_SKIP = 1000
+CALIBRATION_USE = 7000
+
+DEFAULT_AVG_SAMPLES = 10
+DEFAULT_TRIG_WINDOW = 512
+DEFAULT_TRIGGER_UA = 2500
+STOP_TIMEOUT = 2.0
+# Average samples handed to the software trigger at a time
+SOFT_TRIGGER_BLOCK = 1024
+
+
+def print_status(status):
+    print("%d avg samples, %d trigger samples, %.0f B/s, %d frames dropped, %.6f C, %.6f J"
+          % (status['avg_samples'], status['trig_samples'], status['bytes_per_second'], status['dropped'],
+             status['charge'], status['energy']))
+    sys.stdout.flush()
+
+
+def print_json_status(status):
+    ''' One JSON object per line, read by libs.multi '''
+    print(json.dumps(status))
+    sys.stdout.flush()
+
+
+class Capture(object):
+    def __init__(self, out, log_trigger=False, offset_calibration=True, avg_samples=DEFAULT_AVG_SAMPLES, snr=None,
+                 trigger_format=ENCODING_RAW):
+        self.out = out
+        self.snr = snr
+        self.log_trigger = log_trigger
+        self.trigger_format = trigger_format
+        self.avg_samples = avg_samples
+        self.global_offset = 0.0
+        self.switch_filter = True
+        self.logger = None
+        self.avg_count = 0
+        self.trig_count = 0
+        self.calibrating = offset_calibration
+        self.calibration_samples = []
+        self.soft_trigger = None
+        self.soft_source = 'average'
+        self.soft_pending = []
+        self.hires_dir = None
+        self.hires_compress = False
+        self.hires = None
+        self.hires_dropped = 0
+        self.charge = ChargeCounter()
+
+    def connect(self):
+        ''' Connect to the PPK and read calibration from the startup banner '''
+        self.rtt = rtt.rtt(self.handle_frame, snr=self.snr)
+        data = self.rtt.read_banner(calibration.banner_complete, early=calibration.board_cached)
+        self.cal = calibration.from_banner(data)
+        if self.cal['version'] not in calibration.SUPPORTED_FW:
+            raise ValueError("No supported PPK firmware found on board (version '%s')" % self.cal['version'])
+        self.vdd = float(self.cal['vdd']) / 1000.0
+        # Reading may have stopped early on cached values, the rest of the
+        # banner is checked before the first frame is handled
+        self.rtt.watch_banner(data, calibration.banner_complete, self.recheck_calibration)
+
+    def recheck_calibration(self, data):
+        cal = calibration.revalidate(self.cal, data)
+        if cal is None:
+            return
+        print("Calibration of board %s changed, using the values from the banner" % cal['board_id'])
+        self.cal = cal
+        self.vdd = float(cal['vdd']) / 1000.0
+        if self.logger is not None:
+            self.logger.update_meta(**self.meta())
+
+    @property
+    def avg_interval(self):
+        return SAMPLE_INTERVAL * self.avg_samples
+
+    def meta(self):
+        return {'board_id': self.cal['board_id'],
+                'MEAS_RES_LO': self.cal['MEAS_RES_LO'],
+                'MEAS_RES_MID': self.cal['MEAS_RES_MID'],
+                'MEAS_RES_HI': self.cal['MEAS_RES_HI'],
+                'avg_interval': self.avg_interval,
+                'trig_interval': SAMPLE_INTERVAL,
+                'sample_interval': SAMPLE_INTERVAL,
+                'vdd': self.cal['vdd'],
+                'offset': self.global_offset,
+                'switch_filter': self.switch_filter}
+
+    def set_soft_trigger(self, directory, level, edge=RISING, duration=0.0, pre=0.0, post=0.0, source='average'):
+        ''' Save a capture to directory every time the software trigger fires,
+            level in A and times in seconds as for SoftTrigger
+        '''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        interval = self.avg_interval if source == 'average' else SAMPLE_INTERVAL
+        self.soft_source = source
+        self.soft_trigger = SoftTrigger(interval, level, edge, duration, pre, post,
+                                        on_capture=lambda capture: save_capture(directory, capture, self.meta()))
+
+    def set_hires(self, directory, compress=False):
+        ''' Store every sample at full resolution in directory, see libs.hires '''
+        self.hires_dir = directory
+        self.hires_compress = compress
+
+    def start_hires(self):
+        self.hires = hires.HiresWriter(self.hires_dir, self.meta(), self.hires_compress)
+        self.hires_dropped = self.rtt.dropped_frames
+
+    def soft_trigger_average(self, sample, flush=False):
+        if self.soft_trigger is None or self.soft_source != 'average':
+            return
+        if sample is not None:
+            self.soft_pending.append(sample)
+        if self.soft_pending and (flush or len(self.soft_pending) >= SOFT_TRIGGER_BLOCK):
+            self.soft_trigger.process(self.soft_pending)
+            self.soft_pending = []
+
+    def handle_frame(self, data):
+        if len(data) == 4:
+            sample = decode_average(data) / 1e6
+            if self.calibrating:
+                self.calibration_samples.append(sample)
+                if len(self.calibration_samples) >= CALIBRATION_SAMPLES:
+                    used = self.calibration_samples[CALIBRATION_SKIP:CALIBRATION_SKIP + CALIBRATION_USE]
+                    self.global_offset = float(np.average(used))
+                    self.calibration_samples = []
+                    self.calibrating = False
+                    self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_DUT, 1])
+                    self.logger.update_meta(offset=self.global_offset)
+                    if self.hires_dir is not None:
+                        self.start_hires()
+                return
+            self.logger.add_average(sample - self.global_offset)
+            self.charge.add(sample - self.global_offset, self.avg_interval, self.vdd)
+            self.soft_trigger_average(sample - self.global_offset)
+            self.avg_count += 1
+            if self.hires is not None:
+                self.hires.add_average()
+        elif not self.calibrating:
+            if self.hires is not None:
+                if self.rtt.dropped_frames != self.hires_dropped:
+                    self.hires_dropped = self.rtt.dropped_frames
+                    self.hires.mark_gap()
+                self.hires.add_frame(data)
+            samples, ranges = decode_trigger(data,
+                                             self.cal['MEAS_RES_LO'],
+                                             self.cal['MEAS_RES_MID'],
+                                             self.cal['MEAS_RES_HI'],
+                                             self.global_offset,
+                                             self.switch_filter)
+            self.logger.add_trigger_words(data)
+            self.logger.add_trigger(samples)
+            if self.soft_trigger is not None and self.soft_source == 'trigger':
+                self.soft_trigger.process(samples)
+            self.trig_count += len(samples)
+
+    def start(self, trig_window=DEFAULT_TRIG_WINDOW, trigger_ua=DEFAULT_TRIGGER_UA):
+        self.logger = LogWriter(self.out, self.meta(), self.log_trigger, self.trigger_format)
+        self.rtt.start()
+        if self.avg_samples != DEFAULT_AVG_SAMPLES:
+            value = self.avg_samples // 10
+            self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_AVG_NUM_SET, value >> 8, value & 0xFF])
+        if self.hires_dir is not None:
+            # Level 0, a new window starts as soon as the last one is sent
+            self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_TRIG_WINDOW_SET, hires.WINDOW >> 8, hires.WINDOW & 0xFF])
+            self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_TRIGGER_SET, 0, 0, 0])
+            if not self.calibrating:
+                self.start_hires()
+        elif self.log_trigger:
+            self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_TRIG_WINDOW_SET, trig_window >> 8, trig_window & 0xFF])
+            self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_TRIGGER_SET,
+                                    (trigger_ua >> 16) & 0xFF, (trigger_ua >> 8) & 0xFF, trigger_ua & 0xFF])
+        else:
+            self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_TRIG_STOP])
+        if self.calibrating:
+            self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_DUT, 0])
+        self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_RUN])
+
+    def stop(self):
+        try:
+            self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_STOP])
+            self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_TRIG_STOP])
+            self.rtt.flush(STOP_TIMEOUT)
+        finally:
+            # The writers are closed only after the last queued frame reached them
+            self.rtt.join()
+            self.soft_trigger_average(None, flush=True)
+            if self.logger is not None:
+                self.logger.close()
+            if self.hires is not None:
+                self.hires.close()
+
+    def status(self):
+        stats = self.rtt.frame_stats()
+        charge, energy, seconds = self.charge.total()
+        interval_charge, interval_energy, interval_seconds = self.charge.lap()
+        return {'snr': self.snr,
+                'board_id': self.cal['board_id'],
+                'avg_samples': self.avg_count,
+                'trig_samples': self.trig_count,
+                'bytes_per_second': stats['bytes_per_second'],
+                'dropped': stats['dropped'],
+                'hires_samples': self.hires.samples if self.hires is not None else 0,
+                'hires_gaps': self.hires.gaps if self.hires is not None else 0,
+                'charge': charge,
+                'energy': energy,
+                'seconds': seconds,
+                'interval_charge': interval_charge,
+                'interval_seconds': interval_seconds,
+                'soft_triggers': self.soft_trigger.captures if self.soft_trigger is not None else 0,
+                'calibrating': self.calibrating,
+                'alive': self.rtt.alive}
+
+    def run(self, seconds, report=print_status):
+        ''' Capture for the given number of seconds once offset calibration is
+            done, report(status) is called about once a second.
+        '''
+        try:
+            while self.calibrating and self.rtt.alive:
+                time.sleep(0.1)
+            end = time.time() + seconds
+            while time.time() < end and self.rtt.alive:
+                time.sleep(min(1.0, max(end - time.time(), 0)))
+                if report:
+                    report(self.status())
+        except KeyboardInterrupt:
+            print("Capture interrupted")
+        finally:
+            self.stop()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='ppk.py capture', description='Record PPK samples without the GUI')
+    parser.add_argument('--seconds', type=float, required=True, help='capture length')
+    parser.add_argument('--out', required=True, help='binary log file to write')
+    parser.add_argument('--trigger', action='store_true', help='also log trigger samples to <out>.trig')
+    parser.add_argument('--trigger-level', type=int, default=DEFAULT_TRIGGER_UA, help='trigger level in uA')
+    parser.add_argument('--avg-samples', type=int, default=DEFAULT_AVG_SAMPLES,
+                        help='samples per average, multiple of 10')
+    parser.add_argument('--no-offset-calibration', action='store_true',
+                        help='skip measuring the offset with the DUT off')
+    parser.add_argument('--snr', type=int, help='J-Link serial number of the PPK, default any')
+    parser.add_argument('--status-json', action='store_true', help='report status as JSON lines')
+    parser.add_argument('--soft-trigger', type=float, metavar='UA',
+                        help='save a capture every time the current crosses this level in uA')
+    parser.add_argument('--soft-edge', choices=EDGES, default=RISING, help='crossing direction')
+    parser.add_argument('--soft-duration', type=float, default=0.0, metavar='MS',
+                        help='only trigger when the current stays past the level this long')
+    parser.add_argument('--pre', type=float, default=10.0, metavar='MS', help='capture length before the trigger')
+    parser.add_argument('--post', type=float, default=100.0, metavar='MS', help='capture length after the trigger')
+    parser.add_argument('--soft-source', choices=('average', 'trigger'), default='average',
+                        help='stream to trigger on, trigger windows are joined as they arrive (needs --trigger)')
+    parser.add_argument('--soft-dir', help='directory for the captures, default <out>.triggers')
+    parser.add_argument('--trigger-format', choices=TRIGGER_FORMATS, default=ENCODING_RAW,
+                        help='trigger log as samples in A (float), raw words (raw) or compressed raw words')
+    parser.add_argument('--hires', metavar='DIR',
+                        help='also store every sample at full resolution in DIR, as back to back trigger windows')
+    parser.add_argument('--compress', action='store_true', help='compress the full resolution store')
+    args = parser.parse_args(argv)
+
+    capture = Capture(args.out, args.trigger, not args.no_offset_calibration, args.avg_samples, args.snr,
+                      args.trigger_format)
+    try:
+        capture.connect()
+    except Exception as e:
+        print("Unable to connect to the PPK, check debugger connection and make sure the ppk is flashed.")
+        print(str(e))
+        return 1
+    print("Board ID %s, FW %s, capturing %.1f s to %s" % (capture.cal['board_id'], capture.cal['version'],
+                                                          args.seconds, args.out))
+    if args.hires:
+        capture.set_hires(args.hires, args.compress)
+    if args.soft_trigger is not None:
+        capture.set_soft_trigger(args.soft_dir or args.out + '.triggers', args.soft_trigger / 1e6, args.soft_edge,
+                                 args.soft_duration / 1e3, args.pre / 1e3, args.post / 1e3, args.soft_source)
+    capture.start(trigger_ua=args.trigger_level)
+    capture.run(args.seconds, print_json_status if args.status_json else print_status)
+    print("Wrote %d average samples" % capture.logger.samples_written['average'])
+    if capture.soft_trigger is not None:
+        print("Saved %d software trigger captures" % capture.soft_trigger.captures)
+    if capture.hires is not None:
+        print("Stored %d full resolution samples in %d segments"
+              % (capture.hires.samples_written, len(capture.hires.segments)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
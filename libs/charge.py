@@ -0,0 +1,105 @@
+import math
+import threading
+
+
+class CompensatedSum(object):
+    ''' Running sum with Neumaier's compensation, the rounding error of every
+        addition is kept apart so long sums of small values stay exact to
+        about the last bit.
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.total = 0.0
+        self.error = 0.0
+
+    def add(self, value):
+        total = self.total + value
+        if abs(self.total) >= abs(value):
+            self.error += (self.total - total) + value
+        else:
+            self.error += (value - total) + self.total
+        self.total = total
+
+    @property
+    def value(self):
+        return self.total + self.error
+
+
+class Integral(object):
+    ''' Charge, energy and time added up since start or the last reset '''
+    def __init__(self):
+        self.charge = CompensatedSum()      # C
+        self.energy = CompensatedSum()      # J
+        self.seconds = CompensatedSum()
+        self.samples = 0
+
+    def reset(self):
+        self.charge.reset()
+        self.energy.reset()
+        self.seconds.reset()
+        self.samples = 0
+
+    def add(self, charge, energy, seconds, samples):
+        self.charge.add(charge)
+        self.energy.add(energy)
+        self.seconds.add(seconds)
+        self.samples += samples
+
+    def values(self):
+        ''' (charge in C, energy in J, seconds) '''
+        return (self.charge.value, self.energy.value, self.seconds.value)
+
+
+class ChargeCounter(object):
+    ''' Integrates every average sample into charge and energy.
+
+        add() takes a sample in A, the interval it covers in s and the supply
+        voltage in V, so interval and VDD changes while running are accounted
+        for. Totals count from the start, the since-reset values from the
+        last reset(), and lap() returns what came in since the last lap. Each
+        has its own compensated sums, nothing is kept per sample, so a run
+        can go on for days.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = Integral()
+        self.since = Integral()
+        self.laps = Integral()
+
+    def _add(self, charge, vdd, seconds, samples):
+        energy = charge * vdd
+        with self.lock:
+            for integral in (self.totals, self.since, self.laps):
+                integral.add(charge, energy, seconds, samples)
+
+    def add(self, current, interval, vdd):
+        self._add(current * interval, vdd, interval, 1)
+
+    def add_block(self, currents, interval, vdd):
+        ''' Add a block of samples taken at the same interval and VDD '''
+        if len(currents):
+            self._add(math.fsum(currents) * interval, vdd, interval * len(currents), len(currents))
+
+    def reset(self):
+        ''' Start the since-reset values from zero, totals keep counting '''
+        with self.lock:
+            self.since.reset()
+
+    def total(self):
+        ''' (charge, energy, seconds) since start '''
+        with self.lock:
+            return self.totals.values()
+
+    def since_reset(self):
+        ''' (charge, energy, seconds) since the last reset '''
+        with self.lock:
+            return self.since.values()
+
+    def lap(self):
+        ''' (charge, energy, seconds) since the last lap '''
+        with self.lock:
+            values = self.laps.values()
+            self.laps.reset()
+        return values
@@ -0,0 +1,250 @@
+''' Convert CSV logs from older versions to binary logs.
+
+    python ppk.py convert log.csv [more.csv ...] [--jobs N] [--unit A|uA]
+
+    Older versions logged 'Time[s],Current[uA]' rows, one per average
+    sample. The current column holds avg_y, so despite the heading it is in
+    A; --unit uA is there for files that really are in uA. The file is split
+    in chunks at line boundaries and the chunks are parsed in a process pool.
+    Each chunk goes to a part file next to the output and is recorded in a
+    progress file, so an interrupted conversion picks up where it stopped.
+    The parts are then joined to a binary log (see libs.ppklog) and the
+    pyramid cache for the log viewer is built.
+
+    The binary log has a fixed sample interval. If the time column is not
+    evenly spaced, because the average interval was changed while logging,
+    the time column is kept in a second log with TIME_SUFFIX appended.
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from libs import decimate, ppklog
+
+CHUNK_BYTES = 64 << 20
+PARTS_SUFFIX = '.parts'
+PROGRESS_FILE = 'progress.json'
+TIME_SUFFIX = '.time'
+TIME_DTYPE = '<f8'
+# Times are written with 6 decimals, steps differing by more are not even
+TIME_RESOLUTION = 2.5e-6
+UNITS = {'A': 1.0, 'uA': 1e-6}
+
+
+def header_length(path):
+    ''' Bytes taken by the heading line, 0 if the file starts with a row '''
+    with open(path, 'rb') as f:
+        first = f.readline()
+    try:
+        float(first.split(b',')[0])
+        return 0
+    except ValueError:
+        return len(first)
+
+
+def split_chunks(path, chunk_bytes=CHUNK_BYTES):
+    ''' (start, stop) byte ranges of about chunk_bytes that end after a newline '''
+    size = os.path.getsize(path)
+    start = header_length(path)
+    chunks = []
+    with open(path, 'rb') as f:
+        while start < size:
+            stop = min(start + chunk_bytes, size)
+            if stop < size:
+                f.seek(stop)
+                stop += len(f.readline())
+            chunks.append((start, stop))
+            start = stop
+    return chunks
+
+
+def parse_rows(data):
+    ''' Time and current columns of CSV rows as float64 arrays '''
+    rows = data.count(b',')
+    text = data.replace(b'\r', b'').replace(b',', b'\n').decode('ascii')
+    with warnings.catch_warnings():
+        # numpy only warns when it stops at something that is not a number
+        warnings.simplefilter('error')
+        try:
+            values = np.fromstring(text, sep='\n')
+        except (ValueError, DeprecationWarning):
+            values = None
+    if values is None or len(values) != 2 * rows:
+        raise ValueError("found rows that are not 'time,current'")
+    values = values.reshape(-1, 2)
+    return values[:, 0], values[:, 1]
+
+
+def convert_chunk(path, start, stop, part, scale):
+    ''' Parse one chunk and write its columns to part files, runs in a worker.
+        Returns what the joining step needs to know about the chunk.
+    '''
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    try:
+        times, currents = parse_rows(data)
+    except ValueError as e:
+        raise ValueError("%s between bytes %d and %d" % (str(e), start, stop))
+    (currents * scale).astype(ppklog.SAMPLE_DTYPE).tofile(part + '.current')
+    times.astype(TIME_DTYPE).tofile(part + '.time')
+    steps = np.diff(times)
+    return {'rows': len(times),
+            'first': float(times[0]) if len(times) else None,
+            'last': float(times[-1]) if len(times) else None,
+            'min_step': float(steps.min()) if len(steps) else None,
+            'max_step': float(steps.max()) if len(steps) else None}
+
+
+def source_signature(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime': int(st.st_mtime)}
+
+
+class Converter(object):
+    ''' Converts one CSV file to out, keeping progress in out + PARTS_SUFFIX '''
+    def __init__(self, path, out=None, jobs=None, chunk_bytes=CHUNK_BYTES, unit='A', report=print):
+        self.path = path
+        self.out = out or os.path.splitext(path)[0] + '.ppk'
+        self.jobs = jobs
+        self.chunk_bytes = chunk_bytes
+        self.scale = UNITS[unit]
+        self.report = report
+        self.parts_dir = self.out + PARTS_SUFFIX
+        self.progress_path = os.path.join(self.parts_dir, PROGRESS_FILE)
+
+    def load_progress(self):
+        ''' Chunks done by an earlier run, if it was converting the same file the same way '''
+        signature = dict(source_signature(self.path), chunk_bytes=self.chunk_bytes, scale=self.scale)
+        try:
+            with open(self.progress_path) as f:
+                progress = json.load(f)
+            if progress.get('source') == signature:
+                return progress
+        except (IOError, ValueError):
+            pass
+        if os.path.isdir(self.parts_dir):
+            shutil.rmtree(self.parts_dir)
+        os.makedirs(self.parts_dir)
+        return {'source': signature, 'done': {}}
+
+    def save_progress(self, progress):
+        with open(self.progress_path + '.tmp', 'w') as f:
+            json.dump(progress, f)
+        os.replace(self.progress_path + '.tmp', self.progress_path)
+
+    def part(self, number):
+        return os.path.join(self.parts_dir, '%06d' % number)
+
+    def run(self):
+        chunks = split_chunks(self.path, self.chunk_bytes)
+        progress = self.load_progress()
+        todo = [i for i in range(len(chunks)) if str(i) not in progress['done']]
+        if len(todo) < len(chunks):
+            self.report("%s: resuming, %d of %d chunks done" % (self.path, len(chunks) - len(todo), len(chunks)))
+
+        started = time.time()
+        rows = 0
+        parsed = 0
+        pool = ProcessPoolExecutor(self.jobs)
+        futures = {}
+        try:
+            for i in todo:
+                futures[pool.submit(convert_chunk, self.path, chunks[i][0], chunks[i][1], self.part(i),
+                                    self.scale)] = i
+            for future in as_completed(futures):
+                number = futures[future]
+                result = future.result()
+                progress['done'][str(number)] = result
+                self.save_progress(progress)
+                rows += result['rows']
+                parsed += chunks[number][1] - chunks[number][0]
+                elapsed = max(time.time() - started, 1e-9)
+                self.report("%s: %d/%d chunks, %d rows, %.0f rows/s, %.1f MB/s"
+                            % (self.path, len(progress['done']), len(chunks), rows,
+                               rows / elapsed, parsed / elapsed / 1e6))
+        except BaseException:
+            # Interrupted or failed, the chunks done so far are kept for the next run
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+            raise
+        pool.shutdown()
+
+        self.join([progress['done'][str(i)] for i in range(len(chunks))])
+        shutil.rmtree(self.parts_dir)
+        decimate.load_pyramid(self.out)
+        return self.out
+
+    def join(self, results):
+        ''' Join the part files to the binary log, and the time log if needed '''
+        total = sum(r['rows'] for r in results)
+        filled = [r for r in results if r['rows']]
+        steps = [r['min_step'] for r in filled if r['min_step'] is not None]
+        steps += [r['max_step'] for r in filled if r['max_step'] is not None]
+        # Steps across chunk boundaries count as well
+        steps += [b['first'] - a['last'] for a, b in zip(filled, filled[1:])]
+        if total > 1:
+            interval = (filled[-1]['last'] - filled[0]['first']) / (total - 1)
+        else:
+            interval = steps[0] if steps else 0.0
+        even = not steps or max(steps) - min(steps) <= TIME_RESOLUTION
+
+        meta = {'stream': 'average', 'interval': interval, 'avg_interval': interval,
+                'dtype': ppklog.SAMPLE_DTYPE, 'unit': 'A', 'converted_from': os.path.basename(self.path),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        if not even:
+            meta['time_log'] = os.path.basename(self.out) + TIME_SUFFIX
+        self._join_column(self.out, meta, '.current', len(results))
+        if not even:
+            time_meta = dict(meta, stream='time', dtype=TIME_DTYPE, unit='s')
+            self._join_column(self.out + TIME_SUFFIX, time_meta, '.time', len(results))
+            self.report("%s: time steps from %g to %g s, kept the time column in %s"
+                        % (self.path, min(steps), max(steps), meta['time_log']))
+
+    def _join_column(self, path, meta, suffix, count):
+        with open(path + '.tmp', 'wb') as out:
+            ppklog.write_header(out, meta)
+            for number in range(count):
+                with open(self.part(number) + suffix, 'rb') as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+        os.replace(path + '.tmp', path)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='ppk.py convert', description='Convert CSV logs to binary logs')
+    parser.add_argument('csv', nargs='+', help='CSV logs to convert, each to a .ppk next to it')
+    parser.add_argument('--out', help='output file, only with a single CSV log')
+    parser.add_argument('--jobs', type=int, help='worker processes, default one per CPU')
+    parser.add_argument('--chunk-mb', type=float, default=CHUNK_BYTES >> 20, help='chunk size in MB')
+    parser.add_argument('--unit', choices=sorted(UNITS), default='A',
+                        help='unit of the current column, A for logs from this program')
+    args = parser.parse_args(argv)
+    if args.out and len(args.csv) > 1:
+        parser.error("--out only works with a single CSV log")
+
+    for path in args.csv:
+        started = time.time()
+        converter = Converter(path, args.out, args.jobs, int(args.chunk_mb * (1 << 20)), args.unit)
+        try:
+            out = converter.run()
+        except (IOError, ValueError) as e:
+            print("%s: conversion failed, %s" % (path, str(e)))
+            return 1
+        except KeyboardInterrupt:
+            print("%s: conversion interrupted, run again to continue" % path)
+            return 1
+        meta, samples = ppklog.open_log(out)
+        elapsed = max(time.time() - started, 1e-9)
+        print("%s: wrote %d samples to %s in %.1f s, %.0f rows/s"
+              % (path, len(samples), out, elapsed, len(samples) / elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
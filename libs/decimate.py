@@ -0,0 +1,154 @@
+import os
+import numpy as np
+from libs import ppklog
+
+PYRAMID_SUFFIX = '.pyr'
+PYRAMID_FACTOR = 8          # Samples (or entries) per entry of the next level
+PYRAMID_MIN_ENTRIES = 4096  # Stop adding levels when a level gets this small
+PYRAMID_CHUNK = 1 << 22     # Entries processed per step while building
+PYRAMID_DTYPE = '<f4'
+
+
+def minmax_blocks(y, factor):
+    ''' Min and max of every block of factor samples, the last block may be shorter.
+        y is 1D samples or an (n, 2) array of (min, max) pairs from a finer level.
+        NaN samples are ignored unless a whole block is NaN.
+    '''
+    if y.ndim == 1:
+        lo = hi = y
+    else:
+        lo = y[:, 0]
+        hi = y[:, 1]
+    full = (len(lo) // factor) * factor
+    mins = np.fmin.reduce(lo[:full].reshape(-1, factor), axis=1)
+    maxs = np.fmax.reduce(hi[:full].reshape(-1, factor), axis=1)
+    if full < len(lo):
+        mins = np.append(mins, np.fmin.reduce(lo[full:]))
+        maxs = np.append(maxs, np.fmax.reduce(hi[full:]))
+    return mins, maxs
+
+
+def minmax_envelope(x, y, bins):
+    ''' Reduce x, y to a min/max pair per bin, for at most 2 * bins points.
+
+        Data that already fits is returned unchanged. Each bin is drawn as a
+        vertical segment at the x of its first sample, so spikes shorter than
+        a pixel stay visible.
+    '''
+    bins = max(int(bins), 1)
+    n = min(len(x), len(y))
+    if n <= 2 * bins:
+        return x, y
+    factor = -(-n // bins)
+    mins, maxs = minmax_blocks(np.asarray(y[:n]), factor)
+    xs = np.asarray(x[:n:factor])
+    return np.repeat(xs, 2), np.column_stack((mins, maxs)).ravel()
+
+
+def pyramid_counts(n, factor=PYRAMID_FACTOR, min_entries=PYRAMID_MIN_ENTRIES):
+    ''' Number of entries in each level above the raw samples '''
+    counts = []
+    while n > min_entries:
+        n = -(-n // factor)
+        counts.append(n)
+    return counts
+
+
+def build_pyramid(samples, path, source_meta, factor=PYRAMID_FACTOR):
+    ''' Build a min/max pyramid for samples and store it at path.
+
+        Works chunk by chunk from memory maps, so memory use does not depend
+        on the length of the log.
+    '''
+    counts = pyramid_counts(len(samples), factor)
+    levels = []
+    offset = 0
+    for i, count in enumerate(counts):
+        levels.append({'count': count, 'step': factor ** (i + 1), 'offset': offset})
+        offset += count * 2 * np.dtype(PYRAMID_DTYPE).itemsize
+    meta = {'pyramid': True, 'factor': factor, 'levels': levels,
+            'dtype': PYRAMID_DTYPE, 'source': source_meta}
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        ppklog.write_header(f, meta)
+        data_offset = f.tell()
+        f.truncate(data_offset + offset)
+
+    source = out = samples
+    for level in levels:
+        out = np.memmap(tmp_path, dtype=PYRAMID_DTYPE, mode='r+',
+                        offset=data_offset + level['offset'], shape=(level['count'], 2))
+        chunk = PYRAMID_CHUNK - PYRAMID_CHUNK % factor
+        for start in range(0, len(source), chunk):
+            mins, maxs = minmax_blocks(np.asarray(source[start:start + chunk]), factor)
+            first = start // factor
+            out[first:first + len(mins), 0] = mins
+            out[first:first + len(mins), 1] = maxs
+        out.flush()
+        source = out
+    del source, out
+    os.replace(tmp_path, path)
+
+
+def source_signature(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime': int(st.st_mtime)}
+
+
+def load_pyramid(path):
+    ''' Open a log with its pyramid, building the pyramid cache if missing or stale.
+
+        Returns (meta, levels) where levels is a list of (step, data), step
+        being raw samples per entry. The first level is the raw sample memory
+        map, the others are (n, 2) memory maps of (min, max) pairs.
+    '''
+    meta, samples = ppklog.open_log(path)
+    signature = source_signature(path)
+    cache = path + PYRAMID_SUFFIX
+    pyr_meta = None
+    if os.path.exists(cache):
+        try:
+            with open(cache, 'rb') as f:
+                pyr_meta, data_offset = ppklog.read_header(f)
+            if pyr_meta.get('source') != signature:
+                pyr_meta = None
+        except (ValueError, IOError):
+            pyr_meta = None
+    if pyr_meta is None:
+        build_pyramid(samples, cache, signature)
+        with open(cache, 'rb') as f:
+            pyr_meta, data_offset = ppklog.read_header(f)
+
+    levels = [(1, samples)]
+    for level in pyr_meta['levels']:
+        data = np.memmap(cache, dtype=pyr_meta['dtype'], mode='r',
+                         offset=data_offset + level['offset'], shape=(level['count'], 2))
+        levels.append((level['step'], data))
+    return meta, levels
+
+
+def select_level(levels, first, last, max_points):
+    ''' Pick the finest level showing samples first..last in at most max_points entries '''
+    for step, data in levels:
+        if (last - first) / step <= max_points:
+            return step, data
+    return levels[-1]
+
+
+def envelope_xy(step, data, first, last, interval):
+    ''' x, y arrays for plotting samples first..last of a level.
+
+        Raw samples are returned as they are, min/max levels as a vertical
+        segment per entry so short spikes stay visible.
+    '''
+    i0 = max(first // step, 0)
+    i1 = min(-(-last // step) + 1, len(data))
+    if i1 <= i0:
+        return np.zeros(0), np.zeros(0)
+    if step == 1:
+        x = np.arange(i0, i1) * interval
+        return x, np.asarray(data[i0:i1], dtype=np.float64)
+    block = np.asarray(data[i0:i1], dtype=np.float64)
+    x = (np.arange(i0, i1) * step + step / 2.0) * interval
+    return np.repeat(x, 2), block.ravel()
@@ -0,0 +1,91 @@
+import struct
+import numpy as np
+
+SAMPLE_INTERVAL = 13.0e-6
+ADC_REF = 0.6
+ADC_GAIN = 4.0
+ADC_MAX = 8192.0
+
+MEAS_RANGE_NONE = 0
+MEAS_RANGE_LO = 1
+MEAS_RANGE_MID = 2
+MEAS_RANGE_HI = 3
+MEAS_RANGE_INVALID = 4
+
+MEAS_RANGE_POS = 14
+MEAS_RANGE_MSK = (3 << 14)
+
+MEAS_ADC_POS = 0
+MEAS_ADC_MSK = 0x3FFF
+
+
+def as_buffer(data):
+    ''' Frames may arrive as bytes or as a list of ints, numpy wants a buffer '''
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return data
+    return bytearray(data)
+
+
+def decode_average(data):
+    ''' Average frames are a single little endian float in uA '''
+    return struct.unpack('<f', bytes(as_buffer(data)[:4]))[0]
+
+
+def decode_averages(data):
+    ''' Decode a batch of concatenated average frames to an array of uA values '''
+    data = as_buffer(data)
+    return np.frombuffer(data, dtype='<f4', count=len(data) // 4).astype(np.float64)
+
+
+def range_scales(res_lo, res_mid, res_hi):
+    ''' Ampere per ADC code for each MEAS_RANGE_* value, indexed by range '''
+    k = ADC_REF / (ADC_GAIN * ADC_MAX)
+    return np.array([0.0, k / res_lo, k / res_mid, k / res_hi])
+
+
+def split_trigger_words(data):
+    ''' Split raw trigger words into (range, adc code) arrays.
+        A trailing odd byte is ignored, like the firmware protocol expects.
+    '''
+    data = as_buffer(data)
+    words = np.frombuffer(data, dtype='<u2', count=len(data) // 2)
+    ranges = (words & MEAS_RANGE_MSK) >> MEAS_RANGE_POS
+    adc = (words & MEAS_ADC_MSK) >> MEAS_ADC_POS
+    return ranges, adc
+
+
+def decode_trigger(data, res_lo, res_mid, res_hi, offset=0.0, switch_filter=False, starts=None):
+    ''' Decode a trigger frame (or several concatenated frames) to amperes.
+
+        Returns (samples, ranges). The global offset is only subtracted from
+        samples in the low range. With switch_filter, a sample taken right
+        after an automatic range switch is replaced by the last sample taken
+        without a switch (NaN if there is none in this frame). Concatenated
+        frames are filtered as one unless starts gives the index of the first
+        sample of every frame, then each is filtered as if decoded alone.
+    '''
+    ranges, adc = split_trigger_words(data)
+    samples = adc * range_scales(res_lo, res_mid, res_hi)[ranges]
+    samples[ranges == MEAS_RANGE_LO] -= offset
+
+    if switch_filter and len(samples):
+        prev_ranges = np.empty_like(ranges)
+        prev_ranges[0] = MEAS_RANGE_LO
+        prev_ranges[1:] = ranges[:-1]
+        if starts is not None:
+            prev_ranges[starts] = MEAS_RANGE_LO
+        switched = ranges != prev_ranges
+        if switched.any():
+            # Forward fill every switched sample with the last clean one
+            idx = np.where(switched, -1, np.arange(len(samples)))
+            np.maximum.accumulate(idx, out=idx)
+            if starts is not None and len(starts) > 1:
+                # but not with one from an earlier frame
+                frame_start = np.zeros(len(samples), dtype=idx.dtype)
+                frame_start[starts] = starts
+                np.maximum.accumulate(frame_start, out=frame_start)
+                idx[idx < frame_start] = -1
+            held = np.where(idx >= 0, samples[np.maximum(idx, 0)], np.nan)
+            samples = np.where(switched, held, samples)
+
+    return samples, ranges
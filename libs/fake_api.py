@@ -0,0 +1,316 @@
+''' Simulated PPK behind the parts of the pynrfjprog API that libs.rtt uses.
+
+    After sys_reset the simulated board prints its startup banner on RTT
+    channel 0, then answers the RTT commands sent by write_stuffed. While
+    running it produces average frames and, when the trigger is armed,
+    trigger frames, all stuffed into STX/ETX frames like the firmware does.
+
+    With devices > 1 the debugger lists that many serial numbers, and the
+    board id follows the one connected to.
+
+    speed sets how fast samples are produced: 1.0 is real time, 10.0 is ten
+    times real time, and None fills every rtt_read to the requested length.
+    Select it without code changes by setting PPK_SIMULATE to a speed or to
+    "max", and PPK_SIMULATE_DEVICES to the number of boards, see
+    libs.rtt.make_api.
+'''
+import collections
+import struct
+import time
+import numpy as np
+from libs.decoder import (SAMPLE_INTERVAL, ADC_REF, ADC_GAIN, ADC_MAX, MEAS_RANGE_LO, MEAS_RANGE_MID,
+                          MEAS_RANGE_HI, MEAS_RANGE_POS, MEAS_ADC_MSK)
+from libs.framer import Framer, stuff
+
+FAKE_SNR = 682000000
+VERSION = '1.1.0'
+BOARD_ID = 'SIM0001'
+RESISTORS = (510.0, 28.0, 1.8)
+REFS = (3000, 1242, 1200)
+
+# Same RTT up buffer as the firmware
+UP_BUFFER_SIZE = 4096
+TRIG_FRAME_SAMPLES = 512
+# Frames wait in firmware memory until they fit the up buffer. Room for two
+# of the longest trigger windows, one being sent and one being filled (2048
+# words, twice the bytes if all are escaped), and the averages in between.
+# Frames produced while it is full are lost.
+OUT_QUEUE_SIZE = 2 * 2 * 2 * 2048 + UP_BUFFER_SIZE
+# Produce samples in steps of at most this many seconds of device time
+MAX_STEP = 0.05
+
+# Address the host writes to after a command to wake the firmware up
+NRF_EGU0_TASKS_TRIGGER0 = 0x40014000
+# Where ppk.py looks for a SoftDevice, no SoftDevice on a PPK
+SD_VERSION_ADDR = 0x3010
+
+CMD_TRIGGER_SET = 0x01
+CMD_AVG_NUM_SET = 0x02
+CMD_TRIG_WINDOW_SET = 0x03
+CMD_SINGLE_TRIG = 0x05
+CMD_RUN = 0x06
+CMD_STOP = 0x07
+CMD_RANGE_SET = 0x08
+CMD_TRIG_STOP = 0x0A
+CMD_DUT = 0x0C
+CMD_SETVDD = 0x0D
+CMD_SETVREFLO = 0x0E
+CMD_SETVREFHI = 0x0F
+
+
+def banner(version=VERSION, board_id=BOARD_ID, resistors=RESISTORS, refs=REFS):
+    return ('PPK FW: %s R1:%.3f R2:%.3f R3:%.3f Board ID %s Refs VDD: %d HI: %d LO: %d'
+            % ((version,) + tuple(resistors) + (board_id,) + tuple(refs)))
+
+
+class Waveform(object):
+    ''' DUT current in A: a base current with a periodic pulse and some noise '''
+    def __init__(self, base=50e-6, pulse=8e-3, period=0.1, width=0.002, noise=2e-6, seed=1):
+        self.base = base
+        self.pulse = pulse
+        self.period = period
+        self.width = width
+        self.noise = noise
+        self.random = np.random.RandomState(seed)
+
+    def __call__(self, t):
+        current = np.where(np.mod(t, self.period) < self.width, self.pulse, self.base)
+        return current + self.random.normal(0.0, self.noise, len(t))
+
+
+class API(object):
+    def __init__(self, device_family='NRF52', speed=1.0, waveform=None, version=VERSION,
+                 board_id=BOARD_ID, resistors=RESISTORS, refs=REFS, snr=FAKE_SNR, devices=1):
+        self.device_family = device_family
+        self.speed = speed
+        self.waveform = waveform or Waveform()
+        self.version = version
+        self.board_id = board_id
+        self.resistors = resistors
+        self.refs = refs
+        self.banner = banner(version, board_id, resistors, refs)
+        self.snrs = [snr + i for i in range(devices)]
+        self.snr = snr
+        self.is_open = False
+        self.connected = False
+        self.commands = []          # Every command payload received, oldest first
+        self.lost_bytes = 0         # Dropped because the output queue was full
+        self._memory = {}
+        self._reset_device()
+
+    def _reset_device(self):
+        self.running = False
+        self.dut_on = True
+        self.avg_samples = 10
+        self.trig_window = 512
+        self.trigger_level = None   # uA, None when not armed
+        self.single = False
+        self.range = None
+        self._up = bytearray()
+        self._out = collections.deque()     # Stuffed frames waiting for room in _up
+        self._out_bytes = 0
+        self._down = bytearray()
+        self._framer = Framer()
+        self._sim_time = 0.0
+        self._started = None
+        self._capture = None        # Trigger window being filled
+
+    # Connection
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        self.connected = False
+
+    def enum_emu_snr(self):
+        return list(self.snrs)
+
+    def connect_to_emu_without_snr(self, jlink_speed_khz=None):
+        self.connected = True
+
+    def connect_to_emu_with_snr(self, snr, jlink_speed_khz=None):
+        if snr not in self.snrs:
+            raise Exception("No emulator with serial number %d" % snr)
+        self.snr = snr
+        index = self.snrs.index(snr)
+        if index:
+            board_id = '%s-%d' % (self.board_id, index)
+            self.banner = banner(self.version, board_id, self.resistors, self.refs)
+        self.connected = True
+
+    def sys_reset(self):
+        self._reset_device()
+
+    def go(self):
+        if self._started is None:
+            self._started = time.time()
+            self._up += self.banner.encode('ascii')
+
+    def erase_all(self):
+        self._memory.clear()
+
+    def write(self, address, data, flag=True):
+        for i, byte in enumerate(data):
+            self._memory[address + i] = byte
+
+    def read_u32(self, address):
+        if address == SD_VERSION_ADDR:
+            return 0xFFFFFFFF
+        return self._memory.get(address, 0xFFFFFFFF)
+
+    def write_u32(self, address, value, flag=False):
+        if address == NRF_EGU0_TASKS_TRIGGER0 and value:
+            self._handle_commands()
+        else:
+            self._memory[address] = value
+
+    # RTT
+    def rtt_start(self):
+        pass
+
+    def rtt_stop(self):
+        pass
+
+    def rtt_is_control_block_found(self):
+        return self._started is not None
+
+    def rtt_write(self, channel, msg, encoding='utf-8'):
+        if isinstance(msg, str):
+            msg = msg.encode(encoding or 'latin-1')
+        self._down += bytearray(msg)
+        return len(msg)
+
+    def rtt_read(self, channel, length, encoding='utf-8'):
+        self._produce(length)
+        data = bytes(self._up[:length])
+        del self._up[:length]
+        if encoding is None:
+            return data
+        return data.decode(encoding, 'replace')
+
+    # Firmware
+    def _handle_commands(self):
+        for cmd in self._framer.feed(self._down):
+            self.commands.append(cmd)
+            self._execute(bytearray(cmd))
+        del self._down[:]
+
+    def _execute(self, cmd):
+        if not cmd:
+            return
+        op, args = cmd[0], cmd[1:]
+        if op in (CMD_TRIGGER_SET, CMD_SINGLE_TRIG) and len(args) >= 3:
+            self.trigger_level = (args[0] << 16) | (args[1] << 8) | args[2]
+            self.single = op == CMD_SINGLE_TRIG
+        elif op == CMD_TRIG_WINDOW_SET and len(args) >= 2:
+            self.trig_window = max((args[0] << 8) | args[1], 1)
+        elif op == CMD_AVG_NUM_SET and len(args) >= 2:
+            self.avg_samples = max(((args[0] << 8) | args[1]) * 10, 1)
+        elif op == CMD_RUN:
+            self.running = True
+        elif op == CMD_STOP:
+            self.running = False
+        elif op == CMD_TRIG_STOP:
+            self.trigger_level = None
+            self._capture = None
+        elif op == CMD_DUT and args:
+            self.dut_on = bool(args[0])
+        elif op == CMD_RANGE_SET and args:
+            self.range = args[0]
+
+    def _produce(self, length):
+        ''' Generate the samples for the device time that passed since the last read '''
+        if self._started is None or not (self.running or self.trigger_level is not None):
+            self._sim_time = self._device_time()
+            return
+        if self.speed is None:
+            # As fast as it is read, about enough for this read
+            per_sample = 6.0 / self.avg_samples if self.running else 0.0
+            if self.trigger_level is not None:
+                per_sample += 2.0
+            target = self._sim_time + (length / per_sample) * SAMPLE_INTERVAL
+        else:
+            target = self._device_time()
+        limit = UP_BUFFER_SIZE if self.speed is not None else max(UP_BUFFER_SIZE, length)
+        self._send(limit)
+        while self._sim_time < target and self._out_bytes < OUT_QUEUE_SIZE:
+            step = min(target - self._sim_time, MAX_STEP)
+            n = int(step / SAMPLE_INTERVAL)
+            if self.running:
+                n -= n % self.avg_samples
+            if n <= 0:
+                break
+            t = self._sim_time + np.arange(n) * SAMPLE_INTERVAL
+            current = self.waveform(t) if self.dut_on else np.zeros(n)
+            self._sim_time += n * SAMPLE_INTERVAL
+            frames = []
+            if self.running:
+                averages = current.reshape(-1, self.avg_samples).mean(axis=1) * 1e6
+                frames.extend(stuff(struct.pack('<f', value)) for value in averages)
+            if self.trigger_level is not None:
+                frames.extend(self._trigger(current))
+            for frame in frames:
+                if self._out_bytes + len(frame) > OUT_QUEUE_SIZE:
+                    self.lost_bytes += len(frame)
+                    continue
+                self._out.append(frame)
+                self._out_bytes += len(frame)
+            self._send(limit)
+        if self.speed is not None and self._out_bytes >= OUT_QUEUE_SIZE:
+            # Device time keeps going while the queue is full, those samples are lost
+            self._sim_time = max(self._sim_time, target)
+
+    def _send(self, limit):
+        ''' Move whole frames from the output queue to the up buffer, in order '''
+        while self._out and (len(self._up) + len(self._out[0]) <= limit or not self._up):
+            frame = self._out.popleft()
+            self._out_bytes -= len(frame)
+            self._up += frame
+
+    def _device_time(self):
+        if self._started is None or self.speed is None:
+            return self._sim_time
+        return (time.time() - self._started) * self.speed
+
+    def _trigger(self, current):
+        ''' Trigger windows start where the current rises above the level,
+            returns the stuffed frames of the windows completed
+        '''
+        out = []
+        pos = 0
+        while pos < len(current) and self.trigger_level is not None:
+            if self._capture is None:
+                above = np.flatnonzero(current[pos:] * 1e6 >= self.trigger_level)
+                if not len(above):
+                    break
+                pos += above[0]
+                self._capture = []
+            take = current[pos:pos + self.trig_window - len(self._capture)]
+            self._capture.extend(take)
+            pos += len(take)
+            if len(self._capture) == self.trig_window:
+                # Long windows would not fit the up buffer in one frame
+                words = self.trigger_words(np.array(self._capture))
+                for i in range(0, len(words), 2 * TRIG_FRAME_SAMPLES):
+                    out.append(stuff(words[i:i + 2 * TRIG_FRAME_SAMPLES]))
+                self._capture = None
+                if self.single:
+                    self.trigger_level = None
+        return out
+
+    def trigger_words(self, current):
+        ''' Encode currents as trigger words, in the most sensitive range that fits '''
+        current = np.maximum(current, 0.0)
+        k = ADC_GAIN * ADC_MAX / ADC_REF
+        words = np.zeros(len(current), dtype='<u2')
+        done = np.zeros(len(current), dtype=bool)
+        for meas_range, res in ((MEAS_RANGE_LO, self.resistors[0]),
+                                (MEAS_RANGE_MID, self.resistors[1]),
+                                (MEAS_RANGE_HI, self.resistors[2])):
+            adc = np.round(current * res * k)
+            fits = ~done & ((adc < ADC_MAX) | (meas_range == MEAS_RANGE_HI))
+            adc = np.minimum(adc, MEAS_ADC_MSK).astype(np.uint16)
+            words[fits] = (meas_range << MEAS_RANGE_POS) | adc[fits]
+            done |= fits
+        return words.tobytes()
@@ -0,0 +1,101 @@
+import collections
+import heapq
+import numpy as np
+
+
+class RunningMedian(object):
+    ''' Median of the last k samples, updated as samples arrive.
+
+        The window is split over two heaps, a max heap with the lower half
+        and a min heap with the upper half, so the median is at the top.
+        Samples leaving the window are only counted as deleted and dropped
+        once they reach the top of a heap, which keeps every push O(log k).
+        NaN samples, from the switch filter, are passed through and kept out
+        of the window. Should deleted samples pile up inside the heaps, the
+        heaps are rebuilt from the window.
+    '''
+    def __init__(self, k=1):
+        self.k = max(int(k), 1)
+        self.reset()
+
+    def reset(self):
+        self.window = collections.deque()
+        self.low = []       # Negated, so heapq gives the largest
+        self.high = []
+        self.low_size = 0   # Samples in the heaps that are not deleted
+        self.high_size = 0
+        self.deleted = collections.defaultdict(int)
+
+    def _prune(self, heap, sign):
+        while heap and self.deleted[sign * heap[0]]:
+            self.deleted[sign * heap[0]] -= 1
+            heapq.heappop(heap)
+
+    def _balance(self):
+        if self.low_size > self.high_size + 1:
+            heapq.heappush(self.high, -heapq.heappop(self.low))
+            self.low_size -= 1
+            self.high_size += 1
+            self._prune(self.low, -1)
+        elif self.low_size < self.high_size:
+            heapq.heappush(self.low, -heapq.heappop(self.high))
+            self.low_size += 1
+            self.high_size -= 1
+            self._prune(self.high, 1)
+
+    def _insert(self, value):
+        if not self.low or value <= -self.low[0]:
+            heapq.heappush(self.low, -value)
+            self.low_size += 1
+        else:
+            heapq.heappush(self.high, value)
+            self.high_size += 1
+        self._balance()
+
+    def _remove(self, value):
+        self.deleted[value] += 1
+        if value <= -self.low[0]:
+            self.low_size -= 1
+            if value == -self.low[0]:
+                self._prune(self.low, -1)
+        else:
+            self.high_size -= 1
+            if value == self.high[0]:
+                self._prune(self.high, 1)
+        self._balance()
+
+    def _rebuild(self):
+        values = sorted(self.window)
+        half = (len(values) + 1) // 2
+        self.low = [-v for v in values[:half]]
+        self.high = values[half:]
+        heapq.heapify(self.low)
+        heapq.heapify(self.high)
+        self.low_size = len(self.low)
+        self.high_size = len(self.high)
+        self.deleted.clear()
+
+    def median(self):
+        if self.low_size > self.high_size:
+            return -self.low[0]
+        return (self.high[0] - self.low[0]) / 2.0
+
+    def push(self, value):
+        ''' Add a sample and return the median of the window '''
+        value = float(value)
+        if self.k == 1 or value != value:
+            return value
+        self._insert(value)
+        self.window.append(value)
+        if len(self.window) > self.k:
+            self._remove(self.window.popleft())
+            if len(self.low) + len(self.high) > 4 * self.k:
+                self._rebuild()
+        return self.median()
+
+    def filter(self, values):
+        ''' push() every sample of an array, returns the filtered array '''
+        if self.k == 1:
+            return values
+        push = self.push
+        return np.array([push(v) for v in values.tolist()])
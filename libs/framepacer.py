@@ -0,0 +1,67 @@
+import time
+import numpy as np
+
+DEFAULT_FPS = 30
+MIN_FPS = 1
+MAX_FPS = 120
+# Choices offered in the View menu
+FRAME_RATES = (10, 20, 30, 60)
+# Frame times kept for the statistics
+HISTORY = 256
+
+
+class FramePacer(object):
+    ''' Frame timing for a renderer driven by a periodic timer.
+
+        tick() is called on every timer tick and counts the frames that were
+        skipped because the previous tick came too late. Ticks where nothing
+        was dirty are counted as idle. Draw times are kept in a small ring,
+        stats() summarizes them.
+    '''
+    def __init__(self, fps=DEFAULT_FPS):
+        self.set_fps(fps)
+        self.reset()
+
+    def set_fps(self, fps):
+        self.fps = min(max(int(fps), MIN_FPS), MAX_FPS)
+        self.interval = 1.0 / self.fps
+
+    @property
+    def interval_ms(self):
+        return int(round(self.interval * 1000))
+
+    def reset(self):
+        self.frames = 0         # Ticks that drew something
+        self.idle = 0           # Ticks with nothing to draw
+        self.skipped = 0        # Frame slots missed between ticks
+        self.frame_times = np.zeros(HISTORY)
+        self.last_tick = None
+        self.started = time.perf_counter()
+
+    def tick(self):
+        ''' Call at the start of every timer tick, returns the tick time '''
+        now = time.perf_counter()
+        if self.last_tick is not None:
+            late = int((now - self.last_tick) / self.interval - 0.5)
+            if late > 0:
+                self.skipped += late
+        self.last_tick = now
+        return now
+
+    def idle_tick(self):
+        self.idle += 1
+
+    def frame_done(self, start):
+        ''' Record a drawn frame that started at start, as returned by tick() '''
+        self.frame_times[self.frames % HISTORY] = time.perf_counter() - start
+        self.frames += 1
+
+    def stats(self):
+        times = self.frame_times[:min(self.frames, HISTORY)]
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return {'target_fps': self.fps,
+                'fps': self.frames / elapsed,
+                'frame_ms': float(times.mean() * 1000) if len(times) else 0.0,
+                'frame_ms_max': float(times.max() * 1000) if len(times) else 0.0,
+                'skipped': self.skipped,
+                'idle': self.idle}
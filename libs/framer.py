@@ -0,0 +1,83 @@
+STX = 0x02
+ETX = 0x03
+ESC = 0x1F
+
+_STX = bytes([STX])
+_ETX = bytes([ETX])
+_ESC = bytes([ESC])
+
+
+def stuff(payload):
+    ''' Build a complete frame, escaping bytes that collide with the delimiters '''
+    body = bytes(bytearray(payload))
+    for byte in (ESC, STX, ETX):
+        body = body.replace(bytes([byte]), bytes([ESC, byte ^ 0x20]))
+    return _STX + body + _ETX
+
+
+def unstuff(raw):
+    ''' Undo the escaping of a complete frame body, ESC x becomes x ^ 0x20 '''
+    pos = raw.find(_ESC)
+    if pos < 0:
+        return bytes(raw)
+    out = bytearray(raw[:pos])
+    while pos >= 0 and pos + 1 < len(raw):
+        out.append(raw[pos + 1] ^ 0x20)
+        start = pos + 2
+        pos = raw.find(_ESC, start)
+        out += raw[start:pos if pos >= 0 else len(raw)]
+    return bytes(out)
+
+
+class Framer(object):
+    ''' Incremental STX/ETX frame parser for the RTT byte stream.
+
+        Feed it whatever rtt_read returned, it returns the complete frames
+        found so far. Partial frames are kept until the next feed. Delimiters
+        are located with bytes.find, and escapes are undone once per frame.
+        Bytes outside frames are handed to on_text, if set, e.g. the end of
+        the startup banner.
+    '''
+    def __init__(self):
+        self.on_text = None
+        self.reset()
+
+    def reset(self):
+        self.in_frame = False
+        self.partial = bytearray()
+
+    def feed(self, data):
+        frames = []
+        data = bytes(data)
+        pos = 0
+        length = len(data)
+        while pos < length:
+            if not self.in_frame:
+                # Idle, throw away everything until the next start of frame
+                start = data.find(_STX, pos)
+                if self.on_text is not None and start != pos:
+                    self.on_text(data[pos:start if start >= 0 else length])
+                if start < 0:
+                    break
+                self.in_frame = True
+                del self.partial[:]
+                pos = start + 1
+                continue
+
+            end = data.find(_ETX, pos)
+            if end < 0:
+                end = length
+            # A start byte inside a frame restarts it
+            restart = data.rfind(_STX, pos, end)
+            if restart >= 0:
+                del self.partial[:]
+                pos = restart + 1
+            self.partial += data[pos:end]
+            if end == length:
+                break
+
+            frames.append(unstuff(self.partial))
+            del self.partial[:]
+            self.in_frame = False
+            pos = end + 1
+        return frames
@@ -0,0 +1,202 @@
+''' Continuous capture at full resolution, as long as the disk allows.
+
+    Full resolution samples only come in trigger windows. With the trigger
+    level at 0 uA the firmware starts a new window as soon as the last one is
+    sent, so the windows follow each other with short gaps. HiresWriter
+    stores the raw trigger words (range bits and ADC code, as sent by the
+    firmware) in fixed size chunk files in a directory, from a queue on its
+    own thread, so memory use does not grow with the capture length.
+
+    Trigger frames carry no time stamps. The average samples are used as the
+    clock: a window ends about when its frame arrives, so the device time at
+    the last average sample, less the end of the previous window, is the gap
+    between the two. A gap starts a new segment. index.json holds the
+    calibration needed to decode the words and the list of segments, and
+    HiresStore reads the directory back. With compress the chunk files hold
+    delta-zlib blocks like compressed trigger logs (see libs.ppklog).
+'''
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+from libs.decoder import SAMPLE_INTERVAL, decode_trigger
+from libs.ppklog import BLOCK_SAMPLES, BlockReader, ENCODING_DELTA_ZLIB, ENCODING_RAW, encode_blocks, filter_start
+
+INDEX_FILE = 'index.json'
+CHUNK_NAME = 'chunk-%06d.u16'
+CHUNK_NAME_COMPRESSED = 'chunk-%06d.u16z'
+CHUNK_SAMPLES = 1 << 20
+WORD_DTYPE = '<u2'
+# Largest window the firmware takes, fewer windows means fewer gaps
+WINDOW = 2048
+# Gaps shorter than this many average intervals are clock jitter
+GAP_TOLERANCE = 2.0
+
+
+class HiresWriter(threading.Thread):
+    ''' Stores raw trigger frames in a directory of chunk files.
+
+        add_average() is called for every average sample, add_frame() with
+        every trigger frame. meta needs the MEAS_RES_* values and offset for
+        decoding and the avg_interval of the average samples.
+    '''
+    def __init__(self, directory, meta, compress=False):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.compress = compress
+        self.meta = dict(meta, sample_interval=SAMPLE_INTERVAL, chunk_samples=CHUNK_SAMPLES,
+                         dtype=WORD_DTYPE, created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                         encoding=ENCODING_DELTA_ZLIB if compress else ENCODING_RAW)
+        self.avg_interval = float(meta['avg_interval'])
+        self.queue = queue.Queue()
+        self.avg_count = 0          # Average samples seen, the device clock
+        self.samples = 0            # Trigger samples handed over
+        self.window_end = None      # Device time at the end of the last window
+        self.segments = []          # [first sample, device time, gap before it in s or None]
+        self.gap_pending = False
+        self.gaps = 0
+        self.samples_written = 0
+        self.start()
+
+    def add_average(self, count=1):
+        self.avg_count += count
+
+    def mark_gap(self):
+        ''' Samples were lost, of unknown length, before the next frame '''
+        self.gap_pending = True
+
+    def add_frame(self, data):
+        words = np.frombuffer(bytes(data), dtype=WORD_DTYPE, count=len(data) // 2)
+        if not len(words):
+            return
+        now = self.avg_count * self.avg_interval
+        length = len(words) * SAMPLE_INTERVAL
+        if self.window_end is None:
+            self.segments.append([self.samples, max(now - length, 0.0), None])
+        else:
+            gap = now - length - self.window_end
+            if self.gap_pending or gap > GAP_TOLERANCE * self.avg_interval:
+                self.segments.append([self.samples, now - length,
+                                      None if self.gap_pending else gap])
+                self.gaps += 1
+        self.gap_pending = False
+        # Contiguous windows keep the clock of the segment, not the jitter
+        self.window_end = max(now, (self.window_end or 0.0) + length)
+        self.samples += len(words)
+        self.queue.put(words.copy())
+
+    def close(self):
+        ''' Write out everything queued so far and the index '''
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        self.chunk = None
+        pending = []
+        pending_count = 0
+        while True:
+            words = self.queue.get()
+            if words is not None:
+                pending.append(words)
+                pending_count += len(words)
+            # Compressed chunks are written a whole block at a time
+            if pending and (words is None or not self.compress or pending_count >= BLOCK_SAMPLES):
+                self._write(np.concatenate(pending))
+                pending = []
+                pending_count = 0
+            if words is None:
+                break
+        if self.chunk is not None:
+            self.chunk.close()
+        self._write_index()
+
+    def _write(self, words):
+        while len(words):
+            number, used = divmod(self.samples_written, CHUNK_SAMPLES)
+            if self.chunk is None or used == 0:
+                if self.chunk is not None:
+                    self.chunk.close()
+                    self._write_index()
+                name = CHUNK_NAME_COMPRESSED if self.compress else CHUNK_NAME
+                self.chunk = open(os.path.join(self.directory, name % number), 'ab')
+            take = words[:CHUNK_SAMPLES - used]
+            self.chunk.write(encode_blocks(take) if self.compress else take.tobytes())
+            self.samples_written += len(take)
+            words = words[len(take):]
+
+    def _write_index(self):
+        index = dict(self.meta, samples=self.samples_written,
+                     segments=[s for s in list(self.segments) if s[0] < self.samples_written])
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+
+class HiresStore(object):
+    ''' Reads a directory written by HiresWriter '''
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            self.meta = json.load(f)
+        self.chunk_samples = self.meta['chunk_samples']
+        self.segments = self.meta['segments']
+        self.compressed = self.meta.get('encoding', ENCODING_RAW) == ENCODING_DELTA_ZLIB
+        # Chunks may hold more than the index if the capture was cut short
+        self.count = 0
+        self.readers = []
+        number = 0
+        while os.path.exists(self._chunk_path(number)):
+            if self.compressed:
+                self.readers.append(BlockReader(self._chunk_path(number)))
+                self.count += len(self.readers[-1])
+            else:
+                self.count += os.path.getsize(self._chunk_path(number)) // 2
+            number += 1
+
+    def __len__(self):
+        return self.count
+
+    def _chunk_path(self, number):
+        return os.path.join(self.directory, (CHUNK_NAME_COMPRESSED if self.compressed else CHUNK_NAME) % number)
+
+    def words(self, start=0, stop=None):
+        ''' Raw trigger words of samples start up to stop '''
+        stop = self.count if stop is None else min(stop, self.count)
+        parts = []
+        while start < stop:
+            number, offset = divmod(start, self.chunk_samples)
+            take = min(stop - start, self.chunk_samples - offset)
+            if self.compressed:
+                parts.append(self.readers[number].words(offset, offset + take))
+            else:
+                chunk = np.memmap(self._chunk_path(number), dtype=WORD_DTYPE, mode='r')
+                parts.append(np.array(chunk[offset:offset + take]))
+            start += take
+        if not parts:
+            return np.zeros(0, dtype=WORD_DTYPE)
+        return np.concatenate(parts)
+
+    def read(self, start=0, stop=None, switch_filter=True):
+        ''' Returns (samples in A, ranges) of samples start up to stop. The
+            switch filter treats the store as one frame, a slice gives the
+            same samples as reading everything.
+        '''
+        first = filter_start(self.words, start) if switch_filter and start > 0 else start
+        samples, ranges = decode_trigger(self.words(first, stop).tobytes(),
+                                         self.meta['MEAS_RES_LO'], self.meta['MEAS_RES_MID'],
+                                         self.meta['MEAS_RES_HI'], self.meta.get('offset', 0.0), switch_filter)
+        return samples[start - first:], ranges[start - first:]
+
+    def segment_bounds(self):
+        ''' (first sample, stop, device time) of every gap free segment '''
+        bounds = []
+        for i, (first, start_time, gap) in enumerate(self.segments):
+            stop = self.segments[i + 1][0] if i + 1 < len(self.segments) else self.count
+            bounds.append((first, stop, start_time))
+        return bounds
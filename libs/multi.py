@@ -0,0 +1,210 @@
+''' Record from several PPKs at once, one capture process per J-Link.
+
+    python ppk.py multi --seconds 60 --out-dir lab [--snr N ...] [--trigger]
+
+    Every PPK gets its own libs.capture process, so acquisition and decoding
+    of one board never wait for another. The processes report their status
+    as JSON lines. This process shows the status of every board and the
+    totals once a second, as a table redrawn in place on a terminal or as a
+    summary line otherwise, and appends it to <out-dir>/status.csv. Logs go to <out-dir>/<snr>.ppk, and
+    <out-dir>/session.json lists the boards and their logs.
+'''
+import argparse
+import csv
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import libs.rtt as rtt
+from libs.capture import DEFAULT_AVG_SAMPLES, DEFAULT_TRIGGER_UA
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATUS_FIELDS = ['time', 'snr', 'board_id', 'avg_samples', 'trig_samples', 'bytes_per_second', 'dropped',
+                 'charge', 'energy']
+REPORT_INTERVAL = 1.0
+
+
+class Worker(object):
+    ''' A capture process and the thread reading its output '''
+    def __init__(self, snr, out, args, messages):
+        self.snr = snr
+        self.out = out
+        self.status = None
+        cmd = [sys.executable, '-m', 'libs.capture', '--status-json',
+               '--snr', str(snr), '--seconds', str(args.seconds), '--out', out,
+               '--trigger-level', str(args.trigger_level), '--avg-samples', str(args.avg_samples)]
+        if args.trigger:
+            cmd.append('--trigger')
+        if args.no_offset_calibration:
+            cmd.append('--no-offset-calibration')
+        self.process = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        universal_newlines=True, bufsize=1)
+        self.reader = threading.Thread(target=self.t_read, args=(messages,))
+        self.reader.setDaemon(True)
+        self.reader.start()
+
+    def t_read(self, messages):
+        for line in self.process.stdout:
+            line = line.strip()
+            if line.startswith('{'):
+                try:
+                    messages.put((self, json.loads(line)))
+                    continue
+                except ValueError:
+                    pass
+            if line:
+                messages.put((self, line))
+
+
+TABLE_HEADER = "%-12s %-16s %8s %12s %10s %8s %12s %12s %12s" % (
+    'snr', 'board', 'state', 'avg samples', 'B/s', 'dropped', 'current[A]', 'charge[C]', 'energy[J]')
+TABLE_ROW = "%-12s %-16s %8s %12d %10.0f %8d %12.4g %12.4g %12.4g"
+
+
+def current(status):
+    ''' Mean current since the last status line of a board '''
+    seconds = status.get('interval_seconds') or 0.0
+    return status.get('interval_charge', 0.0) / seconds if seconds else 0.0
+
+
+def table(workers, totals):
+    ''' Lines of the aggregated view, one row per board and the totals '''
+    lines = [TABLE_HEADER]
+    for worker in workers:
+        status = worker.status or {}
+        if worker.process.poll() is not None:
+            state = 'done' if worker.process.returncode == 0 else 'failed'
+        elif status.get('calibrating', True):
+            state = 'starting'
+        else:
+            state = 'running'
+        lines.append(TABLE_ROW % (worker.snr, status.get('board_id') or '-', state,
+                                  status.get('avg_samples', 0), status.get('bytes_per_second', 0.0),
+                                  status.get('dropped', 0), current(status) if status else 0.0,
+                                  status.get('charge', 0.0), status.get('energy', 0.0)))
+    lines.append(TABLE_ROW % ('total', '', '%d/%d' % (totals['running'], len(workers)), totals['avg_samples'],
+                              totals['bytes_per_second'], totals['dropped'], totals['current'],
+                              totals['charge'], totals['energy']))
+    return lines
+
+
+class Report(object):
+    ''' Status of all boards, written to status.csv and shown once a second.
+        On a terminal the table is redrawn in place.
+    '''
+    def __init__(self, status_file, interactive=None):
+        self.status_file = status_file
+        self.interactive = sys.stdout.isatty() if interactive is None else interactive
+        self.drawn = 0
+
+    def __call__(self, workers):
+        now = time.time()
+        totals = {'running': 0, 'avg_samples': 0, 'bytes_per_second': 0.0, 'dropped': 0,
+                  'current': 0.0, 'charge': 0.0, 'energy': 0.0}
+        for worker in workers:
+            if worker.process.poll() is None:
+                totals['running'] += 1
+            status = worker.status
+            if status is None:
+                continue
+            totals['avg_samples'] += status['avg_samples']
+            totals['bytes_per_second'] += status['bytes_per_second']
+            totals['dropped'] += status['dropped']
+            totals['current'] += current(status)
+            totals['charge'] += status.get('charge', 0.0)
+            totals['energy'] += status.get('energy', 0.0)
+            row = dict(status, time='%.1f' % now)
+            self.status_file.writerow([row.get(field) for field in STATUS_FIELDS])
+        if self.interactive:
+            lines = table(workers, totals)
+            if self.drawn:
+                # Back to the top of the last table, board messages in between scroll above it
+                sys.stdout.write('\x1b[%dA\x1b[J' % self.drawn)
+            sys.stdout.write('\n'.join(lines) + '\n')
+            self.drawn = len(lines)
+        else:
+            print("%d/%d running, %d avg samples, %.0f B/s, %d frames dropped, %.4g A, %.4g C, %.4g J"
+                  % (totals['running'], len(workers), totals['avg_samples'], totals['bytes_per_second'],
+                     totals['dropped'], totals['current'], totals['charge'], totals['energy']))
+        sys.stdout.flush()
+
+    def message(self, text):
+        ''' A line from a board, printed above the table '''
+        if self.drawn:
+            sys.stdout.write('\x1b[%dA\x1b[J' % self.drawn)
+            self.drawn = 0
+        print(text)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='ppk.py multi', description='Record from several PPKs in parallel')
+    parser.add_argument('--seconds', type=float, required=True, help='capture length')
+    parser.add_argument('--out-dir', required=True, help='directory for the logs of all boards')
+    parser.add_argument('--snr', type=int, action='append',
+                        help='J-Link serial number, repeat for more boards, default all connected')
+    parser.add_argument('--trigger', action='store_true', help='also log trigger samples')
+    parser.add_argument('--trigger-level', type=int, default=DEFAULT_TRIGGER_UA, help='trigger level in uA')
+    parser.add_argument('--avg-samples', type=int, default=DEFAULT_AVG_SAMPLES,
+                        help='samples per average, multiple of 10')
+    parser.add_argument('--no-offset-calibration', action='store_true',
+                        help='skip measuring the offset with the DUT off')
+    args = parser.parse_args(argv)
+
+    devices = args.snr or rtt.list_devices()
+    if not devices:
+        print("No J-Link debuggers found")
+        return 1
+    out_dir = os.path.abspath(args.out_dir)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    print("Capturing %.1f s from %s" % (args.seconds, ', '.join(str(snr) for snr in devices)))
+
+    messages = queue.Queue()
+    workers = [Worker(snr, os.path.join(out_dir, '%d.ppk' % snr), args, messages) for snr in devices]
+    with open(os.path.join(out_dir, 'status.csv'), 'a') as f:
+        status_file = csv.writer(f)
+        if f.tell() == 0:
+            status_file.writerow(STATUS_FIELDS)
+        report = Report(status_file)
+        next_report = time.time() + REPORT_INTERVAL
+        try:
+            while any(w.process.poll() is None for w in workers) or not messages.empty():
+                try:
+                    worker, message = messages.get(timeout=0.1)
+                    if isinstance(message, dict):
+                        worker.status = message
+                    else:
+                        report.message("[%d] %s" % (worker.snr, message))
+                except queue.Empty:
+                    pass
+                if time.time() >= next_report:
+                    report(workers)
+                    next_report += REPORT_INTERVAL
+        except KeyboardInterrupt:
+            # The capture processes got the interrupt too and close their logs
+            print("Capture interrupted, waiting for the boards to stop")
+            for worker in workers:
+                worker.process.wait()
+        report(workers)
+
+    session = {'seconds': args.seconds, 'boards': []}
+    for worker in workers:
+        session['boards'].append({'snr': worker.snr,
+                                  'log': os.path.basename(worker.out),
+                                  'board_id': worker.status and worker.status['board_id'],
+                                  'avg_samples': worker.status and worker.status['avg_samples'],
+                                  'exit_code': worker.process.returncode})
+    with open(os.path.join(out_dir, 'session.json'), 'w') as f:
+        json.dump(session, f, indent=1)
+    failed = [w.snr for w in workers if w.process.returncode]
+    if failed:
+        print("Capture failed on %s" % ', '.join(str(snr) for snr in failed))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,53 @@
+import time
+
+MIN_READ_SIZE = 128
+MAX_READ_SIZE = 16384
+
+# Sleep between reads when data is trickling in, lets the device buffer fill
+PARTIAL_READ_SLEEP = 0.0005
+# Idle backoff doubles from IDLE_SLEEP_MIN up to IDLE_SLEEP_MAX. Keep the max
+# short enough that the device side RTT buffer does not overflow when data
+# starts flowing again.
+IDLE_SLEEP_MIN = 0.0005
+IDLE_SLEEP_MAX = 0.005
+
+
+class AdaptivePoller(object):
+    ''' Chooses read size and sleep time for polling rtt_read.
+
+        The read size doubles when a read comes back full and halves when it
+        comes back mostly empty. Empty reads back off with growing sleeps.
+        Achieved throughput is averaged over about one second.
+    '''
+    def __init__(self, min_read=MIN_READ_SIZE, max_read=MAX_READ_SIZE):
+        self.min_read = min_read
+        self.max_read = max_read
+        self.read_size = min_read
+        self.sleep = 0.0
+        self.bytes_total = 0
+        self.bytes_per_second = 0.0
+        self._window_start = time.time()
+        self._window_bytes = 0
+
+    def update(self, nbytes):
+        ''' Account for a read that returned nbytes, returns seconds to sleep before the next read '''
+        if nbytes >= self.read_size:
+            self.read_size = min(self.read_size * 2, self.max_read)
+            self.sleep = 0.0
+        elif nbytes == 0:
+            self.sleep = min(max(self.sleep * 2, IDLE_SLEEP_MIN), IDLE_SLEEP_MAX)
+        else:
+            if nbytes < self.read_size // 4:
+                self.read_size = max(self.read_size // 2, self.min_read)
+            self.sleep = PARTIAL_READ_SLEEP
+
+        self.bytes_total += nbytes
+        self._window_bytes += nbytes
+        now = time.time()
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.bytes_per_second = self._window_bytes / elapsed
+            self._window_bytes = 0
+            self._window_start = now
+
+        return self.sleep
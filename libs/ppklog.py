@@ -0,0 +1,343 @@
+''' Binary sample log format.
+
+    A log is an 8 byte magic, a little endian uint32 header length and a JSON
+    header padded to a 64 byte boundary, followed by raw little endian float32
+    samples in ampere at a fixed interval. The header holds the sample
+    interval, calibration and board id. Average samples go to the file itself,
+    trigger samples (when enabled) to a sidecar file with TRIG_SUFFIX appended.
+
+    Trigger logs may instead hold the raw trigger words the firmware sends,
+    range bits and ADC code in a uint16, with unit 'raw' in the header. That
+    is half the size, and the samples are only converted to ampere on read,
+    with the resistors and offset from the header or corrected ones. With
+    encoding 'delta-zlib' the words are stored in blocks, each the
+    differences between words, bytes shuffled and zlib compressed, behind a
+    (samples, bytes) block header. The length of every trigger frame goes
+    to a file with FRAMES_SUFFIX appended, as uint32, so the switch filter
+    can be applied per frame on read, like it is to live samples.
+'''
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+from libs.decoder import MEAS_RANGE_LO, decode_trigger, split_trigger_words
+
+MAGIC = b'PPKLOG01'
+HEADER_ALIGN = 64
+SAMPLE_DTYPE = '<f4'
+TRIG_SUFFIX = '.trig'
+
+RAW_DTYPE = '<u2'
+ENCODING_RAW = 'raw'
+ENCODING_DELTA_ZLIB = 'delta-zlib'
+TRIGGER_FORMATS = ('float', ENCODING_RAW, ENCODING_DELTA_ZLIB)
+BLOCK_SAMPLES = 1 << 16
+FRAMES_SUFFIX = '.frames'
+FRAMES_DTYPE = '<u4'
+# Words read at a time when looking back for a sample the switch filter kept
+FILTER_LOOK_BEHIND = 4096
+BLOCK_HEADER = struct.Struct('<II')     # samples, compressed bytes
+COMPRESS_LEVEL = 6
+
+# Samples are written when this many bytes are pending
+WRITE_CHUNK = 1 << 20
+
+
+def write_header(f, meta):
+    body = json.dumps(meta, sort_keys=True).encode('utf-8')
+    size = len(MAGIC) + 4 + len(body)
+    body += b' ' * (-size % HEADER_ALIGN)
+    f.write(MAGIC)
+    f.write(struct.pack('<I', len(body)))
+    f.write(body)
+
+
+def read_header(f):
+    ''' Returns (meta, data_offset) for an open binary file '''
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("Not a PPK binary log")
+    length = struct.unpack('<I', f.read(4))[0]
+    meta = json.loads(f.read(length).decode('utf-8'))
+    return meta, len(MAGIC) + 4 + length
+
+
+def is_binary_log(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def encode_blocks(words):
+    ''' Compressed blocks of at most BLOCK_SAMPLES raw words '''
+    words = np.asarray(words, dtype=RAW_DTYPE)
+    out = bytearray()
+    for start in range(0, len(words), BLOCK_SAMPLES):
+        block = words[start:start + BLOCK_SAMPLES]
+        # Differences wrap around in uint16, high bytes then low bytes
+        deltas = np.diff(block, prepend=np.zeros(1, dtype=RAW_DTYPE)).astype(RAW_DTYPE)
+        data = zlib.compress(deltas.view(np.uint8).reshape(-1, 2).T.tobytes(), COMPRESS_LEVEL)
+        out += BLOCK_HEADER.pack(len(block), len(data))
+        out += data
+    return bytes(out)
+
+
+def decode_block(data, count):
+    shuffled = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(2, count)
+    deltas = shuffled.T.copy().view(RAW_DTYPE).ravel()
+    return np.cumsum(deltas, dtype=RAW_DTYPE)
+
+
+class BlockReader(object):
+    ''' Random access to raw words stored by encode_blocks() from offset on.
+        The block index is built from the block headers when opened.
+    '''
+    def __init__(self, path, offset=0):
+        self.path = path
+        self.starts = [0]       # First word of every block, and the total at the end
+        self.offsets = []
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while offset + BLOCK_HEADER.size <= size:
+                count, length = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+                if offset + BLOCK_HEADER.size + length > size:
+                    break       # Cut short while writing
+                self.offsets.append((offset + BLOCK_HEADER.size, length))
+                self.starts.append(self.starts[-1] + count)
+                offset += BLOCK_HEADER.size + length
+                f.seek(offset)
+        self.cached = (None, None)
+
+    def __len__(self):
+        return self.starts[-1]
+
+    def _block(self, number):
+        if self.cached[0] != number:
+            position, length = self.offsets[number]
+            with open(self.path, 'rb') as f:
+                f.seek(position)
+                data = f.read(length)
+            self.cached = (number, decode_block(data, self.starts[number + 1] - self.starts[number]))
+        return self.cached[1]
+
+    def words(self, start, stop):
+        start = max(start, 0)
+        stop = min(stop, len(self))
+        parts = []
+        number = int(np.searchsorted(self.starts, start, side='right')) - 1
+        while start < stop:
+            block = self._block(number)
+            first = self.starts[number]
+            take = block[start - first:min(stop, self.starts[number + 1]) - first]
+            parts.append(take)
+            start += len(take)
+            number += 1
+        if not parts:
+            return np.zeros(0, dtype=RAW_DTYPE)
+        return np.concatenate(parts)
+
+
+def filter_start(words, start):
+    ''' First word to decode from so that, with the switch filter, samples
+        from start on come out as if decoded from word 0. That is the word
+        before the last sample up to start that was not taken right after a
+        range switch. words(first, stop) returns raw words.
+    '''
+    end = start + 1
+    while end > 0:
+        first = max(end - FILTER_LOOK_BEHIND, 0)
+        ranges = split_trigger_words(np.asarray(words(max(first - 1, 0), end), dtype=RAW_DTYPE).tobytes())[0]
+        if first == 0:
+            previous = np.concatenate(([MEAS_RANGE_LO], ranges[:-1]))
+        else:
+            previous = ranges[:-1]
+            ranges = ranges[1:]
+        clean = np.flatnonzero(ranges == previous)
+        if len(clean):
+            return max(first + int(clean[-1]) - 1, 0)
+        end = first
+    return 0
+
+
+class RawSamples(object):
+    ''' Raw trigger words that read as samples in A.
+
+        Slicing decodes just the samples asked for, so it can stand in for the
+        sample memory map of a float log. The resistors, offset and switch
+        filter are the logged ones unless given. A slice gives the same
+        samples as the whole log would: decoding starts at the frame the
+        slice starts in, so the switch filter works per frame like it did
+        live. Logs without a frames file are filtered as one frame, looking
+        back as far as needed.
+    '''
+    def __init__(self, path, meta, data_offset, resistors=None, offset=None, switch_filter=None):
+        self.meta = meta
+        if meta.get('encoding', ENCODING_RAW) == ENCODING_DELTA_ZLIB:
+            self.reader = BlockReader(path, data_offset)
+            self.words = self.reader.words
+            self.count = len(self.reader)
+        else:
+            self.count = (os.path.getsize(path) - data_offset) // 2
+            self.raw = np.memmap(path, dtype=RAW_DTYPE, mode='r', offset=data_offset,
+                                 shape=(self.count,)) if self.count else np.zeros(0, dtype=RAW_DTYPE)
+            self.words = lambda start, stop: self.raw[max(start, 0):stop]
+        self.resistors = resistors or (meta['MEAS_RES_LO'], meta['MEAS_RES_MID'], meta['MEAS_RES_HI'])
+        self.offset = meta.get('offset', 0.0) if offset is None else offset
+        self.switch_filter = meta.get('switch_filter', True) if switch_filter is None else switch_filter
+        self.frame_starts = None
+        if os.path.exists(path + FRAMES_SUFFIX):
+            lengths = np.fromfile(path + FRAMES_SUFFIX, dtype=FRAMES_DTYPE)
+            starts = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+            # The frames may be ahead of the words if the log was cut short
+            self.frame_starts = starts[starts < self.count]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop, step = key.indices(self.count)
+        if stop <= start:
+            return np.zeros(0)
+        first = start
+        starts = None
+        if self.frame_starts is not None:
+            frames = self.frame_starts
+            number = int(np.searchsorted(frames, start, side='right')) - 1
+            first = int(frames[number])
+            starts = frames[number:int(np.searchsorted(frames, stop))] - first
+        elif self.switch_filter:
+            first = filter_start(self.words, start)
+        words = np.asarray(self.words(first, stop), dtype=RAW_DTYPE)
+        samples = decode_trigger(words.tobytes(), self.resistors[0], self.resistors[1], self.resistors[2],
+                                 self.offset, self.switch_filter, starts)[0]
+        return samples[start - first::step]
+
+
+def open_log(path, resistors=None, offset=None, switch_filter=None):
+    ''' Returns (meta, samples), samples is a read only memory map, or for raw
+        trigger logs a RawSamples converting them to ampere. resistors
+        (lo, mid, hi), offset and switch_filter override the logged ones.
+    '''
+    with open(path, 'rb') as f:
+        meta, data_offset = read_header(f)
+    if meta.get('unit') == 'raw':
+        return meta, RawSamples(path, meta, data_offset, resistors, offset, switch_filter)
+    dtype = np.dtype(meta.get('dtype', SAMPLE_DTYPE))
+    count = (os.path.getsize(path) - data_offset) // dtype.itemsize
+    if count == 0:
+        return meta, np.zeros(0, dtype=dtype)
+    return meta, np.memmap(path, dtype=dtype, mode='r', offset=data_offset, shape=(count,))
+
+
+class LogWriter(threading.Thread):
+    ''' Writes every sample handed to it, from a queue on its own thread.
+
+        meta is stored in the header of each file, the stream name and the
+        sample interval are added per file. The average interval is the one
+        in use when the log is started.
+
+        trigger_format is 'float' for samples in A, handed to add_trigger(),
+        or 'raw' / 'delta-zlib' for the raw trigger frames, handed to
+        add_trigger_words(). The trigger file is only created when the first
+        trigger samples arrive, so update_meta() can still add the offset.
+    '''
+    def __init__(self, path, meta, log_trigger=False, trigger_format='float'):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        if trigger_format not in TRIGGER_FORMATS:
+            raise ValueError("Trigger log format must be one of %s" % ', '.join(TRIGGER_FORMATS))
+        self.path = path
+        self.meta = dict(meta)
+        self.queue = queue.Queue()
+        self.samples_written = {'average': 0, 'trigger': 0}
+        self.log_trigger = log_trigger
+        self.trigger_format = trigger_format
+        self.frames_file = None
+
+        self.files = {}
+        self.files['average'] = self._open(path, 'average', meta.get('avg_interval'))
+        self.start()
+
+    def _open(self, path, stream, interval, dtype=SAMPLE_DTYPE, unit='A', **extra):
+        meta = dict(self.meta, stream=stream, interval=interval, dtype=dtype, unit=unit,
+                    created=time.strftime('%Y-%m-%dT%H:%M:%S'), **extra)
+        f = open(path, 'wb')
+        write_header(f, meta)
+        return f
+
+    def _open_trigger(self):
+        interval = self.meta.get('trig_interval')
+        if self.trigger_format == 'float':
+            return self._open(self.path + TRIG_SUFFIX, 'trigger', interval)
+        self.frames_file = open(self.path + TRIG_SUFFIX + FRAMES_SUFFIX, 'wb')
+        return self._open(self.path + TRIG_SUFFIX, 'trigger', interval, RAW_DTYPE, 'raw',
+                          encoding=self.trigger_format)
+
+    def update_meta(self, **values):
+        ''' Header values for files not created yet, like the trigger log '''
+        self.meta.update(values)
+
+    def add_average(self, samples):
+        self.queue.put(('average', samples))
+
+    def add_trigger(self, samples):
+        if self.log_trigger and self.trigger_format == 'float':
+            self.queue.put(('trigger', samples))
+
+    def add_trigger_words(self, data):
+        ''' A raw trigger frame, as bytes '''
+        if self.log_trigger and self.trigger_format != 'float':
+            self.queue.put(('trigger', np.frombuffer(bytes(data), dtype=RAW_DTYPE, count=len(data) // 2)))
+
+    def close(self):
+        ''' Write out everything queued so far and close the files '''
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        pending = {'average': [], 'trigger': []}
+        pending_bytes = {'average': 0, 'trigger': 0}
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            stream, samples = item
+            if stream not in self.files:
+                self.files[stream] = self._open_trigger()
+            if stream == 'trigger' and self.trigger_format != 'float':
+                samples = np.asarray(samples, dtype=RAW_DTYPE)
+            else:
+                samples = np.asarray(samples, dtype=SAMPLE_DTYPE).ravel()
+            pending[stream].append(samples)
+            pending_bytes[stream] += samples.nbytes
+            if pending_bytes[stream] >= WRITE_CHUNK:
+                self._flush(stream, pending[stream])
+                pending_bytes[stream] = 0
+
+        if self.log_trigger and 'trigger' not in self.files:
+            self.files['trigger'] = self._open_trigger()
+        for stream in self.files:
+            self._flush(stream, pending[stream])
+            self.files[stream].close()
+        if self.frames_file is not None:
+            self.frames_file.close()
+
+    def _flush(self, stream, chunks):
+        if not chunks:
+            return
+        data = np.concatenate(chunks)
+        if stream == 'trigger' and self.frames_file is not None:
+            # Every raw chunk is one frame
+            np.array([len(chunk) for chunk in chunks], dtype=FRAMES_DTYPE).tofile(self.frames_file)
+        if stream == 'trigger' and self.trigger_format == ENCODING_DELTA_ZLIB:
+            self.files[stream].write(encode_blocks(data))
+        else:
+            self.files[stream].write(data.tobytes())
+        self.samples_written[stream] += len(data)
+        del chunks[:]
@@ -0,0 +1,139 @@
+import math
+import numpy as np
+
+BLOCK = 64
+
+
+class RegionIndex(object):
+    ''' Constant time average, RMS and max for any region of a RingBuffer.
+
+        Prefix sums of the samples and of the squared samples give the sum
+        and sum of squares of a region from two lookups each. The maxima of
+        BLOCK sized blocks are kept in a sparse table, so the max of a region
+        is two table lookups plus at most two partial blocks. NaN samples,
+        which the switch filter can produce, are left out of the statistics.
+
+        The index follows the buffer lazily, sync() adds everything written
+        since the last sync in one vectorized step. Samples are addressed by
+        an absolute position, the sample written as number c since the
+        buffer was cleared has position c - self.base.
+    '''
+    def __init__(self, ring, block=BLOCK):
+        self.ring = ring
+        self.block = block
+        self.rebuild()
+
+    def rebuild(self):
+        count = self.ring.count
+        self.size = len(self.ring)
+        self.generation = self.ring.generation
+        self.synced = count
+        self.base = count - self.size
+        self.n = self.size              # Position of the next sample
+        samples = self.ring.window(count - self.size, count)
+
+        self.psum = np.zeros(self.size + 1)
+        self.psq = np.zeros(self.size + 1)
+        self.pcount = np.zeros(self.size + 1, dtype=np.int64)
+        values, finite = self._finite(samples)
+        np.cumsum(values, out=self.psum[1:])
+        np.cumsum(values * values, out=self.psq[1:])
+        np.cumsum(finite, out=self.pcount[1:])
+        self.since_rebase = 0
+
+        # Enough block slots that every block touching the buffer has its own
+        self.nblocks = self.size // self.block + 2
+        self.levels = int(math.log2(self.nblocks - 1)) + 1
+        self.table = np.full((self.levels, self.nblocks), -np.inf)
+        complete = self.size // self.block
+        if complete:
+            self._add_blocks(0, samples[:complete * self.block])
+
+    def _finite(self, samples):
+        finite = np.isfinite(samples)
+        return np.where(finite, samples, 0.0), finite
+
+    def _add_blocks(self, first, samples):
+        ''' Add complete blocks starting at block number first to the sparse table.
+            table[k][b] holds the max of blocks b - 2**k + 1 up to b.
+        '''
+        blocks = np.arange(first, first + len(samples) // self.block)
+        slots = blocks % self.nblocks
+        self.table[0, slots] = np.fmax.reduce(samples.reshape(-1, self.block), axis=1)
+        for k in range(1, self.levels):
+            prev = (blocks - (1 << (k - 1))) % self.nblocks
+            self.table[k, slots] = np.maximum(self.table[k - 1, slots], self.table[k - 1, prev])
+
+    def sync(self):
+        ''' Bring the index up to date with the buffer '''
+        count = self.ring.count
+        added = count - self.synced
+        if added == 0 and self.ring.generation == self.generation:
+            return
+        if (self.ring.generation != self.generation or added > self.size // 2 or
+                self.size < 4 * self.block):
+            self.rebuild()
+            return
+
+        new = self.ring.window(count - added, count)
+        n0 = self.n
+        n1 = n0 + added
+        cap = self.size + 1
+        slots = np.arange(n0 + 1, n1 + 1) % cap
+        values, finite = self._finite(new)
+        self.psum[slots] = self.psum[n0 % cap] + np.cumsum(values)
+        self.psq[slots] = self.psq[n0 % cap] + np.cumsum(values * values)
+        self.pcount[slots] = self.pcount[n0 % cap] + np.cumsum(finite)
+
+        # Keep prefix sums small, every slot is inside the window so shift them all
+        self.since_rebase += added
+        if self.since_rebase >= self.size:
+            self.psum -= self.psum[(n1 - self.size) % cap]
+            self.psq -= self.psq[(n1 - self.size) % cap]
+            self.pcount -= self.pcount[(n1 - self.size) % cap]
+            self.since_rebase = 0
+
+        b0 = n0 // self.block
+        b1 = n1 // self.block
+        if b1 > b0:
+            start = b0 * self.block + self.base
+            self._add_blocks(b0, self.ring.window(start, start + (b1 - b0) * self.block))
+
+        self.n = n1
+        self.synced = count
+
+    def _max(self, a0, a1):
+        block = self.block
+        if a1 - a0 <= 2 * block or self.size < 4 * block:
+            return np.fmax.reduce(self.ring.window(a0 + self.base, a1 + self.base))
+        bs = -(-a0 // block)
+        be = a1 // block
+        k = (be - bs).bit_length() - 1
+        result = max(self.table[k, (be - 1) % self.nblocks],
+                     self.table[k, (bs + (1 << k) - 1) % self.nblocks])
+        if a0 < bs * block:
+            result = max(result, np.fmax.reduce(self.ring.window(a0 + self.base, bs * block + self.base)))
+        if be * block < a1:
+            result = max(result, np.fmax.reduce(self.ring.window(be * block + self.base, a1 + self.base)))
+        return result
+
+    def region(self, first, last):
+        ''' (average, rms, max) of buffer samples first to last - 1, indexed
+            like RingBuffer.view(). NaN when the region is empty.
+        '''
+        # Numpy integers have no bit_length(), which _max() needs
+        first = int(first)
+        last = int(last)
+        self.sync()
+        start = self.n - self.size
+        a0 = start + min(max(first, 0), self.size)
+        a1 = start + min(max(last, 0), self.size)
+        if a1 <= a0:
+            return float('nan'), float('nan'), float('nan')
+        cap = self.size + 1
+        count = self.pcount[a1 % cap] - self.pcount[a0 % cap]
+        if count == 0:
+            return float('nan'), float('nan'), float('nan')
+        total = self.psum[a1 % cap] - self.psum[a0 % cap]
+        total_sq = self.psq[a1 % cap] - self.psq[a0 % cap]
+        return total / count, math.sqrt(max(total_sq, 0.0) / count), float(self._max(a0, a1))
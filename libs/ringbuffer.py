@@ -0,0 +1,77 @@
+import numpy as np
+
+
+class RingBuffer(object):
+    ''' Fixed size circular sample buffer.
+
+        Every sample is written twice, at the cursor and one buffer length
+        further on, so the samples in time order are always a contiguous
+        slice of the backing array. view() returns that slice without copying,
+        and the cost of adding a sample does not depend on the buffer size.
+    '''
+    def __init__(self, size, dtype=np.float64):
+        self.dtype = dtype
+        self.resize(size)
+
+    def __len__(self):
+        return self.size
+
+    def resize(self, size):
+        ''' Reallocate the buffer, all samples are cleared '''
+        self.size = max(int(size), 1)
+        self._data = np.zeros(2 * self.size, dtype=self.dtype)
+        self._head = 0      # Next write position, also the oldest sample
+        self.count = 0      # Samples written since last clear
+        self.generation = getattr(self, 'generation', 0) + 1    # Bumped on every clear
+
+    def clear(self):
+        self._data[:] = 0
+        self._head = 0
+        self.count = 0
+        self.generation += 1
+
+    def append(self, value):
+        self._data[self._head] = value
+        self._data[self._head + self.size] = value
+        self._head = (self._head + 1) % self.size
+        self.count += 1
+
+    def extend(self, values):
+        ''' Write a block of samples, only the last size samples are kept '''
+        values = np.asarray(values, dtype=self.dtype)
+        total = len(values)
+        if total == 0:
+            return
+        head = self._head
+        if total > self.size:
+            # Skip the cursor past the samples that would be overwritten anyway
+            values = values[-self.size:]
+            head = (head + total - self.size) % self.size
+        n = len(values)
+        first = min(n, self.size - head)
+        rest = n - first
+        self._data[head:head + first] = values[:first]
+        self._data[head + self.size:head + self.size + first] = values[:first]
+        if rest:
+            self._data[:rest] = values[first:]
+            self._data[self.size:self.size + rest] = values[first:]
+        self._head = (head + n) % self.size
+        self.count += total
+
+    def view(self):
+        ''' Zero-copy view of all samples, oldest first '''
+        return self._data[self._head:self._head + self.size]
+
+    def window(self, start, stop):
+        ''' Zero-copy view of the samples written as number start to stop - 1
+            since the last clear. Only the last size samples are available,
+            numbers below zero refer to the initial zeros.
+        '''
+        first = start % self.size
+        return self._data[first:first + (stop - start)]
+
+    def latest(self, n=1):
+        ''' Zero-copy view of the newest n samples, oldest first '''
+        n = min(n, self.size)
+        end = self._head + self.size
+        return self._data[end - n:end]
@@ -1,7 +1,15 @@
 import threading
+import queue
 import time
 import os
-from pynrfjprog import API, Hex
+from concurrent.futures import Future
+try:
+    from pynrfjprog import API, Hex
+except ImportError:
+    # Only the simulated PPK can be used, see make_api
+    API = Hex = None
+from libs.framer import Framer, stuff
+from libs.poller import AdaptivePoller
 
 DEBUG = False
 
@@ -13,14 +21,15 @@ JLINK_SPEED_KHZ = JLINK_PRO_V8
 # Enable this flag to show all errors/warnings
 DEBUG = False
 
-STX = 0x02
-ETX = 0x03
-ESC = 0x1F
 STR = 0xF1
 
-MODE_IDLE = 0
-MODE_RECV = 1
-MODE_ESC_RECV = 2
+# Frames buffered between the read thread and the processing thread
+FRAME_QUEUE_SIZE = 20000
+
+# Upper limits when waiting for the firmware after a reset
+RTT_START_TIMEOUT = 2.0
+BANNER_TIMEOUT = 1.0
+POLL_INTERVAL = 0.005
 
 NRF_EGU0_BASE          = 0x40014000
 TASKS_TRIGGER0_OFFSET  = 0
@@ -61,6 +70,50 @@ class RTT_COMMANDS():
     RTT_CMD_SET_RES_USER        = 0x12
 
 
+# Commands that only set a value, a newer one makes a queued older one pointless
+COALESCE = frozenset([RTT_COMMANDS.RTT_CMD_AVG_NUM_SET,
+                      RTT_COMMANDS.RTT_CMD_TRIG_WINDOW_SET,
+                      RTT_COMMANDS.RTT_CMD_TRIGGER_SET,
+                      RTT_COMMANDS.RTT_CMD_RANGE_SET,
+                      RTT_COMMANDS.RTT_CMD_SETVREFLO,
+                      RTT_COMMANDS.RTT_CMD_SETVREFHI])
+# Pause between commands so the firmware handles one before the next arrives
+COMMAND_GAP = 0.005
+# Commands that need longer, VDD is ramped in steps that must settle
+COMMAND_SETTLE = {RTT_COMMANDS.RTT_CMD_SETVDD: 0.1}
+WRITE_RETRIES = 5
+RETRY_DELAY = 0.01
+
+
+class CommandError(Exception):
+    pass
+
+
+def make_api():
+    ''' A pynrfjprog API instance, or a simulated PPK when PPK_SIMULATE is set
+        to a speed (1 is real time) or to "max".
+    '''
+    simulate = os.environ.get('PPK_SIMULATE')
+    if simulate:
+        from libs import fake_api
+        speed = None if simulate == 'max' else float(simulate)
+        devices = int(os.environ.get('PPK_SIMULATE_DEVICES', 1))
+        return fake_api.API('NRF52', speed=speed, devices=devices)
+    if API is None:
+        raise Exception("pynrfjprog is not installed")
+    return API.API('NRF52')
+
+
+def list_devices(api=make_api):
+    ''' Serial numbers of the connected J-Link debuggers '''
+    nrfjprog = api()
+    nrfjprog.open()
+    try:
+        return list(nrfjprog.enum_emu_snr() or [])
+    finally:
+        nrfjprog.close()
+
+
 def debug_print(line):
     if(DEBUG):
         print(line)
@@ -69,27 +122,150 @@ def debug_print(line):
 
 
 class rtt(object):
-    def __init__(self, callback):
+    def __init__(self, callback, api=make_api, snr=None):
         self.alive = True
-        # Open connection to debugger and rtt
-        self.nrfjprog = API.API('NRF52')
+        # Open connection to debugger and rtt, any debugger unless snr is given
+        self.api = api
+        self.snr = snr
+        self.nrfjprog = self.api()
         self.nrfjprog.open()
-        try:
+        self.connect_emu()
+        self.start_rtt()
+
+        self.callback = callback
+        self.banner_watch = None       # [data, complete, callback] while the banner is being read
+
+        # Read thread only frames data, decoding happens in the process thread
+        self.frames = queue.Queue(FRAME_QUEUE_SIZE)
+        self.dropped_frames = 0
+        self.queue_high_watermark = 0
+        self.poller = AdaptivePoller()
+
+        # Commands are written by their own thread, nrfjprog calls are serialized
+        self.api_lock = threading.Lock()
+        self.command_lock = threading.Condition()
+        self.pending_commands = []     # (cmd, futures) in send order
+        self.last_command = None
+        self.coalesced_commands = 0
+        self.command_errors = 0
+        self.write_thread = threading.Thread(target=self.t_write)
+        self.write_thread.setDaemon(True)
+        self.write_thread.start()
+
+    def connect_emu(self):
+        if self.snr is None:
             self.nrfjprog.connect_to_emu_without_snr(jlink_speed_khz=JLINK_SPEED_KHZ)
-        except:
-            raise
+        else:
+            self.nrfjprog.connect_to_emu_with_snr(self.snr, jlink_speed_khz=JLINK_SPEED_KHZ)
+
+    def start_rtt(self):
+        ''' Reset the PPK and wait until its RTT control block is found,
+            instead of sleeping for a fixed time.
+        '''
         self.nrfjprog.sys_reset()
         self.nrfjprog.go()
         self.nrfjprog.rtt_start()
-        time.sleep(1)
+        end = time.time() + RTT_START_TIMEOUT
+        while not self.nrfjprog.rtt_is_control_block_found():
+            if time.time() > end:
+                raise Exception("RTT control block not found")
+            time.sleep(POLL_INTERVAL)
 
-        self.callback = callback
+    def read_banner(self, complete, timeout=BANNER_TIMEOUT, early=None):
+        ''' Read the startup banner until complete(data) is true and nothing
+            more arrives, until early(data) is true, or until timeout.
+            Returns what was read.
+        '''
+        data = ''
+        end = time.time() + timeout
+        while time.time() < end:
+            chunk = self.nrfjprog.rtt_read(0, 200)
+            if chunk:
+                data += chunk
+                if early is not None and early(data):
+                    break
+            elif data and complete(data):
+                break
+            else:
+                time.sleep(POLL_INTERVAL)
+        return data
+
+    def watch_banner(self, data, complete, callback):
+        ''' read_banner() returned before the banner was complete. The read
+            thread adds the rest to data as it arrives and calls
+            callback(data) once complete(data) is true and nothing more
+            arrives, or at the first frame.
+        '''
+        self.banner_watch = [data, complete, callback]
+
+    def _banner_text(self, text):
+        self.banner_watch[0] += text.decode('ascii', 'replace')
+
+    def _banner_done(self):
+        data, complete, callback = self.banner_watch
+        self.banner_watch = None
+        self.framer.on_text = None
+        try:
+            callback(data)
+        except Exception as e:
+            debug_print(str(e))
+
+    def close(self):
+        ''' Stop reading and release the debugger, e.g. to hand it to another process '''
+        self.alive = False
+        if hasattr(self, 'read_thread'):
+            self.read_thread.join()
+        with self.api_lock:
+            self.nrfjprog.close()
 
     def start(self):
         # Start thread for reading rtt.
         self.read_thread = threading.Thread(target=self.t_read)
         self.read_thread.setDaemon(True)
         self.read_thread.start()
+        # Start thread for handling received frames
+        self.process_thread = threading.Thread(target=self.t_process)
+        self.process_thread.setDaemon(True)
+        self.process_thread.start()
+
+    def join(self):
+        ''' Stop reading and wait until every frame read so far was handled '''
+        self.alive = False
+        if hasattr(self, 'read_thread'):
+            self.read_thread.join()
+            # Drains the frame queue before it returns
+            self.process_thread.join()
+
+    def frame_stats(self):
+        ''' Frame queue and read throughput counters '''
+        return {'depth': self.frames.qsize(),
+                'high_watermark': self.queue_high_watermark,
+                'dropped': self.dropped_frames,
+                'bytes_per_second': self.poller.bytes_per_second,
+                'read_size': self.poller.read_size}
+
+    def enqueue_frame(self, frame):
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            self.dropped_frames += 1
+            debug_print("frame queue full, dropped %d frames" % self.dropped_frames)
+            return
+        depth = self.frames.qsize()
+        if depth > self.queue_high_watermark:
+            self.queue_high_watermark = depth
+
+    def t_process(self):
+        # Runs for as long as the read thread, which survives reconnects
+        while self.read_thread.is_alive() or not self.frames.empty():
+            try:
+                frame = self.frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                self.callback(frame)
+            except Exception as e:
+                debug_print(str(e))
 
     def flash_application(self, hex_file_path):
         try:
@@ -110,36 +286,23 @@ class rtt(object):
 
     def t_read(self):
         try:
-            self.read_mode = MODE_IDLE
-            data_buffer = []
+            self.framer = Framer()
+            if self.banner_watch is not None:
+                self.framer.on_text = self._banner_text
             while self.alive:
                 try:
-                    data = self.nrfjprog.rtt_read(0, 100, encoding=None)
-                    if data != '':
-                        for byte in data:
-                            n = byte
-                            if self.read_mode == MODE_IDLE:
-                                ''' Mode Idle - Not Receiving '''
-                                if n == STX:
-                                    self.read_mode = MODE_RECV
-
-                            elif self.read_mode == MODE_RECV:
-                                ''' Mode Receiving - Receiving data '''
-                                if n == ESC:
-                                    self.read_mode = MODE_ESC_RECV
-                                elif n == ETX:
-                                    self.callback(data_buffer)
-                                    data_buffer[:] = []
-                                    self.read_mode = MODE_IDLE
-                                elif n == STX:
-                                    data_buffer[:] = []
-                                else:
-                                    data_buffer.append(n)
-
-                            elif self.read_mode == MODE_ESC_RECV:
-                                ''' Mode Escape Received - Convert next byte '''
-                                data_buffer.append(n ^ 0x20)
-                                self.read_mode = MODE_RECV
+                    with self.api_lock:
+                        data = self.nrfjprog.rtt_read(0, self.poller.read_size, encoding=None)
+                    frames = self.framer.feed(data) if data else []
+                    if self.banner_watch is not None:
+                        # The banner comes before any frame, then it will not get longer
+                        if frames or (not data and self.banner_watch[1](self.banner_watch[0])):
+                            self._banner_done()
+                    for frame in frames:
+                        self.enqueue_frame(frame)
+                    delay = self.poller.update(len(data) if data else 0)
+                    if delay:
+                        time.sleep(delay)
 
                 except AttributeError as attre:
                     # RTT module reported error upon exit
@@ -156,14 +319,13 @@ class rtt(object):
                         try:
                             print(tries)
                             time.sleep(0.6)
-                            self.nrfjprog.close()
-                            self.nrfjprog = API.API('NRF52')
-                            self.nrfjprog.open()
-                            self.nrfjprog.connect_to_emu_without_snr(jlink_speed_khz=JLINK_SPEED_KHZ)
-                            self.nrfjprog.sys_reset()
-                            self.nrfjprog.go()
-                            self.nrfjprog.rtt_start()
-                            time.sleep(1)
+                            with self.api_lock:
+                                self.nrfjprog.close()
+                                self.nrfjprog = self.api()
+                                self.nrfjprog.open()
+                                self.connect_emu()
+                                self.start_rtt()
+                            self.framer.reset()
                             print ("Reconnected, you may start the graphs again.")
                             connected = True
                             break
@@ -182,43 +344,80 @@ class rtt(object):
             self.alive = False
 
     def write_stuffed(self, cmd):
-        s = ''
-        s = chr(STX)
-        for byte in cmd:
-            if byte == STX or byte == ETX or byte == ESC:
-                s = s + chr(ESC)
-                s = s + chr(byte ^ 0x20)
-            else:
-                s = s + chr(byte)
-        s = s + chr(ETX)
+        ''' Queue a command for the write thread and return at once.
 
-        try:
+            Returns a concurrent.futures.Future that completes when the
+            command was delivered, or fails with CommandError. A command in
+            COALESCE replaces a queued, not yet sent command of the same type.
+        '''
+        cmd = list(cmd)
+        future = Future()
+        with self.command_lock:
+            futures = [future]
+            if cmd[0] in COALESCE:
+                for i, (queued, waiting) in enumerate(self.pending_commands):
+                    if queued[0] == cmd[0]:
+                        # Moved to the end, so it still follows anything queued in between
+                        futures = waiting + futures
+                        del self.pending_commands[i]
+                        self.coalesced_commands += 1
+                        break
+            self.pending_commands.append((cmd, futures))
+            self.last_command = future
+            self.command_lock.notify()
+        return future
+
+    def flush(self, timeout=None):
+        ''' Wait until every command queued so far was handled '''
+        with self.command_lock:
+            last = self.last_command
+        if last is not None:
+            try:
+                last.result(timeout)
+            except CommandError:
+                pass
+
+    def call_api(self, name, *args, **kwargs):
+        ''' Call nrfjprog from the write thread, retrying a bounded number of times '''
+        for attempt in range(WRITE_RETRIES):
             try:
-                debug_print("rtt write initiated")
-                self.nrfjprog.rtt_write(0, s, encoding=None)
-                debug_print("rtt write finished")
+                with self.api_lock:
+                    return getattr(self.nrfjprog, name)(*args, **kwargs)
             except Exception as e:
-                debug_print("write failed, %s") % str(e)
+                debug_print("%s failed, %s" % (name, str(e)))
+                error = e
+                time.sleep(RETRY_DELAY)
+        raise CommandError("%s failed %d times: %s" % (name, WRITE_RETRIES, str(error)))
 
-            while(True):
-                try:
-                    debug_print("write u32 initiated")
-                    self.nrfjprog.write_u32(NRF_EGU0_BASE + TASKS_TRIGGER0_OFFSET, 0x00000001, 0)
-                    debug_print("write u32 finished")
-                    break
-                except Exception as e:
-                    debug_print("write u32 failed")
-                    continue
+    def t_write(self):
+        while True:
+            with self.command_lock:
+                while not self.pending_commands:
+                    self.command_lock.wait()
+                batch = self.pending_commands
+                self.pending_commands = []
 
-            while(True):
+            results = []
+            for i, (cmd, futures) in enumerate(batch):
+                if i:
+                    time.sleep(COMMAND_SETTLE.get(batch[i - 1][0][0], COMMAND_GAP))
                 try:
-                    time.sleep(0.1)
-                    self.nrfjprog.go()
-                    break
-                except Exception as e:
-                    debug_print("go failed, %s" % str(e))
-                    continue
+                    self.call_api('rtt_write', 0, stuff(cmd), encoding=None)
+                    self.call_api('write_u32', NRF_EGU0_BASE + TASKS_TRIGGER0_OFFSET, 0x00000001, 0)
+                    results.append((futures, None))
+                except CommandError as e:
+                    results.append((futures, e))
+            try:
+                self.call_api('go')
+            except CommandError as e:
+                results = [(futures, error or e) for futures, error in results]
 
-        except Exception as e:
-            print(str(e))
-            pass
+            for (cmd, _), (futures, error) in zip(batch, results):
+                if error is not None:
+                    self.command_errors += 1
+                    print("Command 0x%02X failed: %s" % (cmd[0], str(error)))
+                for future in futures:
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
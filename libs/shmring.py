@@ -0,0 +1,113 @@
+import sys
+import numpy as np
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Python < 3.8, only the in-process acquisition is available
+    shared_memory = None
+
+HEADER = np.dtype('<i8')
+# [0] is the number of samples written, [1] the number there will be once
+# the block being written is in, the rest is spare
+HEADER_FIELDS = 8
+
+
+def _attach(name):
+    ''' Open a segment created by another process. Before Python 3.13 that
+        registers it with the resource tracker as if it was created here. The
+        tracker is shared with the creating process, so unregistering would
+        drop its registration as well, registration is skipped instead.
+    '''
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedRing(object):
+    ''' Sample ring in shared memory, one process writes and another reads.
+
+        Laid out like RingBuffer, every sample is written twice so any window
+        is contiguous. The writer announces the count it is writing up to,
+        stores the samples and then publishes the new count. The reader
+        copies a window and then checks the announced count, everything more
+        than a ring length before it may have been overwritten during the
+        copy. There is no locking, a slow reader loses the oldest samples
+        instead of holding up the writer.
+    '''
+    def __init__(self, size, dtype=np.float64, name=None, readonly=False):
+        if shared_memory is None:
+            raise RuntimeError("Shared memory needs Python 3.8 or later")
+        self.size = int(size)
+        self.dtype = np.dtype(dtype)
+        nbytes = HEADER.itemsize * HEADER_FIELDS + 2 * self.size * self.dtype.itemsize
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self.shm = _attach(name)
+        self.name = self.shm.name
+        self._header = np.ndarray((HEADER_FIELDS,), dtype=HEADER, buffer=self.shm.buf)
+        self._data = np.ndarray((2 * self.size,), dtype=self.dtype, buffer=self.shm.buf,
+                                offset=HEADER.itemsize * HEADER_FIELDS)
+        if self.owner:
+            self._header[:] = 0
+        if readonly:
+            self._header.flags.writeable = False
+            self._data.flags.writeable = False
+
+    @property
+    def count(self):
+        ''' Samples written so far '''
+        return int(self._header[0])
+
+    def extend(self, values):
+        ''' Writer side, only the last size samples of a long block are kept '''
+        values = np.asarray(values, dtype=self.dtype)
+        total = len(values)
+        if total == 0:
+            return
+        count = int(self._header[0])
+        self._header[1] = count + total
+        if total > self.size:
+            values = values[-self.size:]
+        start = (count + total - len(values)) % self.size
+        n = len(values)
+        first = min(n, self.size - start)
+        self._data[start:start + first] = values[:first]
+        self._data[start + self.size:start + self.size + first] = values[:first]
+        if n > first:
+            self._data[:n - first] = values[first:]
+            self._data[self.size:self.size + n - first] = values[first:]
+        self._header[0] = count + total
+
+    def append(self, value):
+        self.extend((value,))
+
+    def read(self, start, stop=None):
+        ''' Reader side, copy samples number start up to stop (default all).
+            Returns (samples, stop, lost) where lost counts the samples that
+            were overwritten before they could be read.
+        '''
+        if stop is None:
+            stop = self.count
+        first = max(start, stop - self.size)
+        offset = first % self.size
+        values = self._data[offset:offset + stop - first].copy()
+        # The writer may have lapped the copy, also with a block not published yet
+        overwritten = min(int(self._header[1]) - self.size - first, len(values))
+        if overwritten > 0:
+            values = values[overwritten:]
+            first += overwritten
+        return values, stop, first - start
+
+    def close(self):
+        self._header = None
+        self._data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,142 @@
+''' Host side trigger on a sample stream.
+
+    The firmware trigger captures at most one trigger window. SoftTrigger
+    scans the average (or trigger) samples as they arrive and captures any
+    number of samples before and after the trigger point, without stopping
+    acquisition.
+'''
+import os
+import numpy as np
+from libs.ppklog import SAMPLE_DTYPE, write_header
+from libs.ringbuffer import RingBuffer
+
+RISING = 'rising'
+FALLING = 'falling'
+EDGES = (RISING, FALLING)
+
+
+class SoftTrigger(object):
+    ''' Triggers when the samples cross level and stay past it for duration.
+
+        level is in A, duration, pre and post in seconds, interval is the
+        sample interval of the stream. The trigger point is the first sample
+        past the level, so a capture is pre seconds before it and post
+        seconds from it. A rising trigger with a duration is "above level for
+        duration". Samples are tested a block at a time: the length of the
+        run past the level is carried from one block to the next and the
+        trigger fires where a run reaches the duration. Samples before the
+        current block are kept in a ring for the pre-trigger part.
+
+        on_capture(capture) is called with a dict for every completed
+        capture. With rearm the trigger arms again once the post-trigger part
+        is complete, otherwise arm() has to be called.
+    '''
+    def __init__(self, interval, level, edge=RISING, duration=0.0, pre=0.0, post=0.0,
+                 rearm=True, on_capture=None):
+        if edge not in EDGES:
+            raise ValueError("Trigger edge must be one of %s" % ', '.join(EDGES))
+        self.interval = float(interval)
+        self.level = float(level)
+        self.edge = edge
+        self.hold = max(int(round(duration / self.interval)), 1)
+        self.pre = max(int(round(pre / self.interval)), 0)
+        self.post = max(int(round(post / self.interval)), 1)
+        self.rearm = rearm
+        self.on_capture = on_capture
+        self.history = RingBuffer(self.pre + self.hold)
+        self.captures = 0
+        self.reset()
+        self.armed = True
+
+    def reset(self):
+        ''' Forget the samples seen so far, for example after a gap in the stream '''
+        self.history.clear()
+        self.position = 0       # Samples seen since the reset
+        self.run = 0            # Samples past the level up to the last one seen
+        self.pending = None     # Capture waiting for post-trigger samples
+        self.capture_end = 0
+
+    def arm(self):
+        self.armed = True
+
+    def _fired(self, samples):
+        ''' Positions in the block where a run past the level reaches the duration '''
+        if self.edge == RISING:
+            past = samples > self.level
+        else:
+            past = samples < self.level
+        index = np.arange(len(samples))
+        # Run length at every sample, the run before the block continues into it
+        last_clear = np.maximum.accumulate(np.where(past, -1 - self.run, index))
+        run = np.where(past, index - last_clear, 0)
+        self.run = int(run[-1])
+        return np.flatnonzero(run == self.hold)
+
+    def process(self, samples):
+        ''' Scan a block of samples, returns the number of captures completed '''
+        samples = np.asarray(samples, dtype=np.float64)
+        if len(samples) == 0:
+            return 0
+        start = self.position
+        completed = 0
+        if self.pending is not None:
+            completed += self._collect(samples, start)
+        for fired in self._fired(samples):
+            trigger = start + fired - self.hold + 1
+            # Runs that started inside the last capture do not trigger again
+            if not self.armed or self.pending is not None or trigger < self.capture_end:
+                continue
+            self.armed = False
+            self.pending = {'trigger': trigger,
+                            'first': max(trigger - self.pre, 0),
+                            'stop': trigger + self.post,
+                            'chunks': [self._before(max(trigger - self.pre, 0), start)]}
+            completed += self._collect(samples, start)
+        self.history.extend(samples)
+        self.position += len(samples)
+        return completed
+
+    def _before(self, first, start):
+        ''' Samples from number first up to the start of the current block '''
+        first = max(first, start - min(self.history.count, self.history.size))
+        if first >= start:
+            return np.zeros(0)
+        return self.history.window(first, start).copy()
+
+    def _collect(self, samples, start):
+        ''' Add the part of the block that belongs to the pending capture '''
+        pending = self.pending
+        begin = max(pending['first'], start) - start
+        end = min(pending['stop'] - start, len(samples))
+        if end > begin:
+            pending['chunks'].append(samples[begin:end].copy())
+        if start + len(samples) < pending['stop']:
+            return 0
+        self.pending = None
+        self.capture_end = pending['stop']
+        data = np.concatenate(pending['chunks'])
+        capture = {'number': self.captures,
+                   'index': int(pending['trigger']),
+                   'time': float(pending['trigger'] * self.interval),
+                   'pre': int(pending['trigger'] - pending['first']),
+                   'interval': self.interval,
+                   'samples': data}
+        self.captures += 1
+        if self.rearm:
+            self.armed = True
+        if self.on_capture is not None:
+            self.on_capture(capture)
+        return 1
+
+
+def save_capture(directory, capture, meta):
+    ''' Write a capture as a binary log, open_log and the log viewer read it.
+        Returns the path of the file.
+    '''
+    path = os.path.join(directory, 'trigger-%04d.ppk' % capture['number'])
+    meta = dict(meta, stream='softtrigger', interval=capture['interval'], dtype=SAMPLE_DTYPE, unit='A',
+                trigger_index=capture['index'], trigger_time=capture['time'], pre_samples=capture['pre'])
+    with open(path, 'wb') as f:
+        write_header(f, meta)
+        f.write(np.asarray(capture['samples'], dtype=SAMPLE_DTYPE).tobytes())
+    return path
@@ -0,0 +1,73 @@
+import collections
+import math
+import numpy as np
+
+
+class RunningStats(object):
+    ''' Mean, RMS, min and max over the samples in a RingBuffer, updated per sample.
+
+        Call append() with every new sample and the sample it pushed out of
+        the window. Sums are kept for mean and RMS, and monotonic deques of
+        (index, value) for min and max, so reading a value is O(1) however
+        long the window is. Sums are recomputed from the buffer once per
+        window length to stop rounding errors from building up. Like the
+        buffer, the window starts out filled with zeros.
+    '''
+    def __init__(self, ring):
+        self.ring = ring
+        self.reset()
+
+    def reset(self):
+        ''' Start over from what is in the buffer now '''
+        values = self.ring.view()
+        self.size = len(values)
+        self.total = float(np.sum(values))
+        self.total_sq = float(np.dot(values, values))
+        self.since_resync = 0
+        self.index = self.size
+        # The deques hold the samples that are larger (smaller) than every later one
+        later = np.empty(self.size)
+        later[-1] = -np.inf
+        later[:-1] = np.maximum.accumulate(values[:0:-1])[::-1]
+        keep = np.flatnonzero(values > later)
+        self._maxq = collections.deque(zip(keep.tolist(), values[keep].tolist()))
+        later[-1] = np.inf
+        later[:-1] = np.minimum.accumulate(values[:0:-1])[::-1]
+        keep = np.flatnonzero(values < later)
+        self._minq = collections.deque(zip(keep.tolist(), values[keep].tolist()))
+        self._publish()
+
+    def _push_extremes(self, value):
+        start = self.index - self.size
+        while self._maxq and self._maxq[-1][1] <= value:
+            self._maxq.pop()
+        self._maxq.append((self.index, value))
+        while self._maxq[0][0] <= start:
+            self._maxq.popleft()
+        while self._minq and self._minq[-1][1] >= value:
+            self._minq.pop()
+        self._minq.append((self.index, value))
+        while self._minq[0][0] <= start:
+            self._minq.popleft()
+        self.index += 1
+
+    def _publish(self):
+        # Readers on other threads only see these, never the deques
+        self.max = self._maxq[0][1]
+        self.min = self._minq[0][1]
+        self.mean = self.total / self.size
+        self.rms = math.sqrt(max(self.total_sq, 0.0) / self.size)
+
+    def append(self, value, evicted):
+        value = float(value)
+        evicted = float(evicted)
+        self.total += value - evicted
+        self.total_sq += value * value - evicted * evicted
+        self.since_resync += 1
+        if self.since_resync >= self.size:
+            values = self.ring.view()
+            self.total = float(np.sum(values))
+            self.total_sq = float(np.dot(values, values))
+            self.since_resync = 0
+        self._push_extremes(value)
+        self._publish()
@@ -1,11 +1,33 @@
 import platform
+import sys
 if(platform.architecture()[0] != "32bit" and platform.system() == "Windows"):
     print("Wrong Python architecture, please install 32bit version of Python")
     eval(input("Press any key to exit..."))
     exit()
+
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'capture':
+    # Headless capture, runs without Qt: ppk.py capture --seconds N --out file
+    from libs import capture
+    sys.exit(capture.main(sys.argv[2:]))
+
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'multi':
+    # Headless capture from every connected PPK: ppk.py multi --seconds N --out-dir dir
+    from libs import multi
+    sys.exit(multi.main(sys.argv[2:]))
+
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'analyze':
+    # Statistics of a recorded log, needs only numpy: ppk.py analyze file
+    from libs import analysis
+    sys.exit(analysis.main(sys.argv[2:]))
+
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'convert':
+    # CSV logs from older versions to binary logs: ppk.py convert file.csv
+    from libs import csvconvert
+    sys.exit(csvconvert.main(sys.argv[2:]))
+
 import pynrfjprog
 import libs.rtt as rtt
-import sys
+from libs import calibration
 import PyQt5 as Qt
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui
@@ -14,6 +36,7 @@ from ui.ppk_plotter import ppk_plotter
 import numpy as np
 # from ui.ppk_plotter import PlotData
 import time
+import argparse
 
 
 VERSION = "1.1.0"
@@ -23,11 +46,21 @@ GLOBAL_OFFSET = 0.0e-6
 sd_versions = ['130', '132', '212', '332', '110', '210', '310']
 # Start Qt event loop unless running in interactive mode or using pyside.
 
-app = pg.QtGui.QApplication([])
-
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='ppk.py')
+    parser.add_argument('--snr', type=int, help='J-Link serial number of the PPK, default any')
+    parser.add_argument('--acquisition-process', action='store_true',
+                        help='read and decode RTT data in a separate process')
+    parser.add_argument('--fps', type=int, help='plot frame rate, default 30')
+    args, unknown = parser.parse_known_args()
+
+    # Only in the main process, the acquisition process imports this module again
+    app = pg.QtGui.QApplication([])
+
     print("Power Profiler Kit initializing...")
     plotter = ppk_plotter()
+    if args.fps:
+        plotter.set_fps(args.fps)
 
     ''' Create a temporary qapp for showing post setup error messages '''
     tempapp = QtGui.QApplication(sys.argv)
@@ -43,7 +76,7 @@ if __name__ == '__main__':
     ''' Connect and read all initialization data '''
 
     try:
-        rtt = rtt.rtt(plotter.rtt_handler)
+        rtt = rtt.rtt(plotter.rtt_handler, snr=args.snr)
     except Exception as e:
         print("Unable to connect to the PPK, check debugger connection and make sure the ppk is flashed.")
         print((str(e)))
@@ -57,9 +90,9 @@ if __name__ == '__main__':
         exit()
 
     try:
-        supported_fw = ['1.0.0', 'ED R1', '1.1.0']
-        data = rtt.nrfjprog.rtt_read(0, 200)
-        version = data[8:13]
+        supported_fw = calibration.SUPPORTED_FW
+        data = rtt.read_banner(calibration.banner_complete, early=calibration.board_cached)
+        version = calibration.parse_version(data)
         print(("FW version:\t %s" % version))
         if(version != VERSION):
             print(("Wrong firmware on board, please flash to v%s" % VERSION))
@@ -110,14 +143,8 @@ if __name__ == '__main__':
             else:
                 print ("Ignoring")
 
-        prod_data = data.split("USER SET ")[0]
-        plotter.plotdata.MEAS_RES_LO  = float(prod_data.split("R1:")[1].split(" R2")[0])
-        plotter.plotdata.MEAS_RES_MID = float(prod_data.split("R2:")[1].split(" R3")[0])
-        plotter.plotdata.MEAS_RES_HI = float(prod_data.split("R3:")[1].split("Board ID ")[0])
-        plotter.plotdata.board_id = str(prod_data.split("Board ID ")[1].split("Refs")[0])
-        plotter.plotdata.CAL_MEAS_RES_LO = plotter.plotdata.MEAS_RES_LO
-        plotter.plotdata.CAL_MEAS_RES_MID = plotter.plotdata.MEAS_RES_MID
-        plotter.plotdata.CAL_MEAS_RES_HI = plotter.plotdata.MEAS_RES_HI
+        # Falls back to the values cached for this board if the banner was cut short
+        cal = calibration.from_banner(data)
     except Exception as e:
         sd_version = rtt.nrfjprog.read_u32(int(0x3010))
         if str(sd_version) in sd_versions:
@@ -142,27 +169,25 @@ if __name__ == '__main__':
                                              QtGui.QMessageBox.NoButton)
             exit()
 
-    if('USER SET' in data):
-        user_data = data.split("USER SET ")[1].split("Refs")[0]
-        plotter.plotdata.MEAS_RES_LO  = float(user_data.split("R1:")[1].split(" R2")[0])
-        plotter.plotdata.MEAS_RES_MID = float(user_data.split("R2:")[1].split(" R3")[0])
-        plotter.plotdata.MEAS_RES_HI = float(user_data.split("R3:")[1].split("Board ID ")[0])
-
-    try:
-        refs_data = data.split("Refs ")[1]
-    except:
-        ret = QtGui.QMessageBox.critical(None,
-                                         "Corrupted data",
-                                         "Corrupt data received from PPK. \
-                                         \r\nReflash PPK firmware.",
-                                         QtGui.QMessageBox.Ok,
-                                         QtGui.QMessageBox.Close)
-        print("Corrupted data received from PPK, please reflash the PPK.")
-        print((str(e)))
-        exit()
-    plotter.plotdata.vref_hi = refs_data.split("HI: ")[1].split(" LO")[0]
-    plotter.plotdata.vref_lo = refs_data.split("LO: ")[1]
-    plotter.plotdata.vdd     = refs_data.split("VDD: ")[1].split(" HI")[0]
+    plotter.set_calibration(cal)
+    if not args.acquisition_process:
+        # Reading may have stopped early on cached values, the rest of the
+        # banner is checked before the first frame is handled
+        rtt.watch_banner(data, calibration.banner_complete, plotter.recheck_calibration)
+    elif not calibration.banner_complete(data):
+        # The read thread that would finish the banner is not used, read it here
+        data += rtt.read_banner(lambda rest: calibration.banner_complete(data + rest))
+        plotter.recheck_calibration(data)
+
+    if args.acquisition_process:
+        # Hand the debugger over to the acquisition process
+        try:
+            from libs.acquisition import AcquisitionProcess
+            acquisition = AcquisitionProcess(snr=args.snr)
+            rtt.close()
+            rtt = acquisition
+        except RuntimeError as e:
+            print("%s, reading RTT in this process" % str(e))
 
     tempapp.exit()
     tempapp = None
@@ -170,7 +195,6 @@ if __name__ == '__main__':
     plotter.setup_graphics()
     plotter.set_rtt_instance(rtt)
     plotter.start()
-    #plotter.start_log_thread()
     print("Power Profiler Kit running!")
 
     if (sys.flags.interactive != 1) or not hasattr(QtCore, 'PYQT_VERSION'):
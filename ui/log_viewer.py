@@ -1,12 +1,13 @@
-from matplotlib import pyplot as plt
-from matplotlib import style
 import numpy as np
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtGui, QtCore
+from libs import ppklog
+from libs import decimate
 
 class LogViewer():
     def __init__(self):
-        pass
+        self.levels = None
+        self.interval = 1.0
 
     def open_file(self):
         fname = QtGui.QFileDialog.getOpenFileName()
@@ -14,27 +15,57 @@ class LogViewer():
             return fname[0]
         return None
 
-    def do_log(self,filename):
-        x,y = np.loadtxt(filename,unpack = True, delimiter=',', skiprows=1)
+    def setup_plot(self):
+        self.win = pg.GraphicsWindow(title="PPK Log")
+        self.win.resize(1000,600)
+        self.win.setWindowTitle('PPK Log viewer')
 
-        try:
-            win = pg.GraphicsWindow(title="PPK Log")
-            win.resize(1000,600)
-            win.setWindowTitle('PPK Log viewer')
+        # Enable antialiasing for prettier plots
+        pg.setConfigOptions(antialias=True)
 
-            # Enable antialiasing for prettier plots
-            pg.setConfigOptions(antialias=True)
+        self.p1 = self.win.addPlot(title="Logged data")
 
-            p1 = win.addPlot(title="Logged data")
+        self.p1.setLabel('left', 'Current', 'A')
+        self.p1.setLabel('bottom', 'Time', 's')
+        self.p1.showGrid(x=True, y=True)
+        return self.p1.plot()
+
+    def do_log(self,filename):
+        if ppklog.is_binary_log(filename):
+            self.do_binary_log(filename)
+            return
 
-            p1.setLabel('left', 'Current', 'A')
-            p1.setLabel('bottom', 'Time', 's')
-            p1.showGrid(x=True, y=True)
+        # Legacy CSV logs
+        x,y = np.loadtxt(filename,unpack = True, delimiter=',', skiprows=1)
 
-            avg_curve = p1.plot(x, y)
+        try:
+            self.curve = self.setup_plot()
+            self.curve.setData(x, y)
         except:
             print("Failed to open the log, maybe the format is wrong.")
 
+    def do_binary_log(self, filename):
+        ''' Memory map the log and only render the pyramid level that fits the view '''
+        meta, self.levels = decimate.load_pyramid(filename)
+        self.interval = meta['interval']
+        n = len(self.levels[0][1])
+        duration = max(n * self.interval, self.interval)
+
+        self.curve = self.setup_plot()
+        self.p1.setLimits(xMin=0, xMax=duration)
+        self.p1.sigXRangeChanged.connect(self.update_view)
+        self.p1.setXRange(0, duration, padding=0)
+        self.update_view()
+
+    def update_view(self):
+        x0, x1 = self.p1.viewRange()[0]
+        first = max(int(x0 / self.interval), 0)
+        last = max(int(x1 / self.interval) + 1, first)
+        pixels = max(int(self.p1.vb.width()), 100)
+        step, data = decimate.select_level(self.levels, first, last, pixels)
+        x, y = decimate.envelope_xy(step, data, first, last, self.interval)
+        self.curve.setData(x, y)
+
 if __name__ == '__main__':
     import sys
     lv = LogViewer()
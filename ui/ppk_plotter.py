@@ -1,32 +1,31 @@
+import collections
+import threading
 import PyQt5 as Qt
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui
 import numpy as np
-import struct
 from libs.rtt import RTT_COMMANDS
+from libs.decoder import SAMPLE_INTERVAL, MEAS_RANGE_NONE
+from libs.decoder import decode_average, decode_trigger
+from libs.ringbuffer import RingBuffer
+from libs.stats import RunningStats
+from libs.regionindex import RegionIndex
+from libs.ppklog import ENCODING_DELTA_ZLIB, ENCODING_RAW, LogWriter
+from libs.decimate import minmax_envelope
+from libs.filters import RunningMedian
+from libs.framepacer import FramePacer
+from libs.softtrigger import SoftTrigger, save_capture
+from libs.hires import HiresWriter
+from libs.charge import ChargeCounter
+from libs import calibration
 from ui import ppk_settings
-import csv
-import threading
-
-SAMPLE_INTERVAL = 13.0e-6
-ADC_REF = 0.6
-ADC_GAIN = 4.0
-ADC_MAX = 8192.0
 
-MEAS_RANGE_NONE = 0
-MEAS_RANGE_LO = 1
-MEAS_RANGE_MID = 2
-MEAS_RANGE_HI = 3
-MEAS_RANGE_INVALID = 4
 
-MEAS_RANGE_POS = 14
-MEAS_RANGE_MSK = (3 << 14)
+# How often samples are taken over from the acquisition process
+ACQUISITION_POLL_MS = 10
 
-MEAS_ADC_POS = 0
-MEAS_ADC_MSK = 0x3FFF
 
-
-class PlotData():
+class PlotData(object):
     def __init__(self):
         '''  '''
         self.trigger = 2500
@@ -47,13 +46,19 @@ class PlotData():
         self.trig_interval   = self.sample_interval
         self.trig_timewindow = self.trig_interval * (512 + 0)
 
-        self.avg_bufsize  = int(self.avg_timewindow / self.avg_interval)
-        self.trig_bufsize = int(self.trig_timewindow / self.trig_interval)
-
-        self.avg_x = np.linspace(0.0, self.avg_timewindow, self.avg_bufsize)
-        self.avg_y = np.zeros(self.avg_bufsize, dtype=np.float)
-        self.trig_x = np.linspace(0.0, self.trig_timewindow, self.trig_bufsize)
-        self.trig_y = np.zeros(self.trig_bufsize, dtype=np.float)
+        self.avg_buf = RingBuffer(1)
+        self.trig_buf = RingBuffer(1)
+        # Samples are pushed on the RTT thread, resizes come from the GUI thread
+        self.avg_lock = threading.Lock()
+        self.avg_stats = RunningStats(self.avg_buf)
+        # Cursor region statistics, these follow the buffers on their own
+        self.avg_index = RegionIndex(self.avg_buf)
+        self.trig_index = RegionIndex(self.trig_buf)
+        # Median filters for incoming samples, k = 1 passes samples through
+        self.avg_median = RunningMedian(1)
+        self.trig_median = RunningMedian(1)
+        self.resize_avg()
+        self.resize_trig()
 
         self.trigger_high = self.trigger >> 8
         self.trigger_low = self.trigger & 0xFF
@@ -66,6 +71,58 @@ class PlotData():
         self.vref_lo_init = 0
         self.vdd_init     = 0
 
+    @property
+    def avg_y(self):
+        ''' Average samples in time order, a view into avg_buf '''
+        return self.avg_buf.view()
+
+    @property
+    def trig_y(self):
+        ''' Trigger samples in time order, a view into trig_buf '''
+        return self.trig_buf.view()
+
+    def log_meta(self):
+        ''' Header values stored in binary logs '''
+        return {'board_id': self.board_id,
+                'MEAS_RES_LO': self.MEAS_RES_LO,
+                'MEAS_RES_MID': self.MEAS_RES_MID,
+                'MEAS_RES_HI': self.MEAS_RES_HI,
+                'avg_interval': self.avg_interval,
+                'trig_interval': self.trig_interval,
+                'sample_interval': self.sample_interval,
+                'vdd': self.vdd}
+
+    def resize_avg(self):
+        ''' Reallocate average buffers after a window or interval change '''
+        with self.avg_lock:
+            self.avg_bufsize = int(self.avg_timewindow / self.avg_interval)
+            self.avg_buf.resize(self.avg_bufsize)
+            self.avg_stats.reset()
+            self.avg_x = np.linspace(0.0, self.avg_timewindow, len(self.avg_buf))
+
+    def push_avg(self, sample):
+        ''' Add an average sample to the buffer and the running statistics '''
+        with self.avg_lock:
+            evicted = self.avg_buf.view()[0]
+            self.avg_buf.append(sample)
+            self.avg_stats.append(sample, evicted)
+
+    def clear_avg(self):
+        with self.avg_lock:
+            self.avg_buf.clear()
+            self.avg_stats.reset()
+
+    def set_median(self, k):
+        ''' New filters instead of resetting, the acquisition thread may be using them '''
+        self.avg_median = RunningMedian(k)
+        self.trig_median = RunningMedian(k)
+
+    def resize_trig(self):
+        ''' Reallocate trigger buffers after a window change '''
+        self.trig_bufsize = int(self.trig_timewindow / self.trig_interval)
+        self.trig_buf.resize(self.trig_bufsize)
+        self.trig_x = np.linspace(0.0, self.trig_timewindow, len(self.trig_buf))
+
 
 class ppk_plotter():
     def __init__(self):
@@ -74,12 +131,22 @@ class ppk_plotter():
         self.calibrating = False
         self.calibrating_done = False
         self.global_offset = 0.0
-        self.enable_log = False
         self.alive = True
-        self.logfile_name = 'ppk_avg.csv'
-        self.started_log = False
-        self.log_stopped = False
-        self.update_log = False
+        self.logger = None
+        self.pacer = FramePacer()
+        self.render_timer = None
+        self.soft_settings = None
+        self.soft_trigger = None
+        # Filled on the RTT thread, drained on the GUI thread
+        self.soft_pending = collections.deque()
+        self.soft_captures = 0
+        self.last_soft_capture = None
+        self.hires = None
+        self.hires_dropped = 0
+        # Every average sample since the offset calibration, not just the plot window
+        self.charge = ChargeCounter()
+        self.calibration = None
+        self.calibration_changed = False
 
     def setup_graphics(self):
         self.setup_measurement_regions()
@@ -115,6 +182,8 @@ class ppk_plotter():
 
     def destroyedEvent(self):
         self.rtt.alive = False
+        self.stop_log()
+        self.stop_hires()
         try:
             QtGui.QApplication.quit()
         except:
@@ -149,42 +218,41 @@ class ppk_plotter():
 
     def setup_plot_window(self):
         self.avg_plot = self.gw.addPlot(title='Average', row=0, col=1, rowspan=1, colspan=1)
-        trig_plot = self.gw.addPlot(title='Trigger', row=1, col=1, rowspan=1, colspan=1)
+        self.trig_plot = self.gw.addPlot(title='Trigger', row=1, col=1, rowspan=1, colspan=1)
 
         self.avg_plot.setLabel('left', 'current', 'A')
         self.avg_plot.setLabel('bottom', 'time', 's')
         self.avg_plot.showGrid(x=True, y=True)
 
-        trig_plot.setLabel('left', 'current', 'A')
-        trig_plot.setLabel('bottom', 'time', 's')
-        trig_plot.showGrid(x=True, y=True)
+        self.trig_plot.setLabel('left', 'current', 'A')
+        self.trig_plot.setLabel('bottom', 'time', 's')
+        self.trig_plot.showGrid(x=True, y=True)
 
         # Add the LinearRegionItem to the ViewBox, but tell the ViewBox to exclude this
         # item when doing auto-range calculations.
         self.avg_plot.addItem(self.avg_region, ignoreBounds=True)
-        trig_plot.addItem(self.trig_region, ignoreBounds=True)
+        self.trig_plot.addItem(self.trig_region, ignoreBounds=True)
         # Create the curve for average data (top graph)
         self.avg_curve = self.avg_plot.plot(self.plotdata.avg_x, self.plotdata.avg_y)
         # Create the curve for trigger data (bottom graph)
-        self.trig_curve = trig_plot.plot(self.plotdata.trig_x, self.plotdata.trig_y)
+        self.trig_curve = self.trig_plot.plot(self.plotdata.trig_x, self.plotdata.trig_y)
 
         # Bools for checking if we should update the curve when the update timer triggers
         self.update_trig_curve = False
         self.update_avg_curve = False
+        # Zooming changes the envelope, buffer resizes show up as a new generation
+        self.avg_plot.sigXRangeChanged.connect(self.avg_view_changed)
+        self.trig_plot.sigXRangeChanged.connect(self.trig_view_changed)
+        self.avg_view_dirty = False
+        self.trig_view_dirty = False
+        self.drawn_avg_generation = None
+        self.drawn_trig_generation = None
 
     def start(self, run=True):
         ''' Send trigger value and start to firmware.
             Starts timers for updating graphs and calculations.
         '''
-        self.settings.m_vdd = int(self.plotdata.vdd)
-
-        self.settings.vdd_slider.setSliderPosition(int(self.plotdata.vdd))
-        self.settings.vref_on_slider.setSliderPosition(int(((int(self.plotdata.vref_hi) * 2 / 27000.0) + 1) * (0.41 / 10.98194) * 1000))
-        self.settings.vref_off_slider.setSliderPosition((((int(self.plotdata.vref_lo) * 2 + 30000) / 2000.0 + 1) / 16.3) * 100)
-
-        self.settings.r_high_tb.setText(str(self.plotdata.MEAS_RES_HI))
-        self.settings.r_mid_tb.setText(str(self.plotdata.MEAS_RES_MID))
-        self.settings.r_lo_tb.setText(str(self.plotdata.MEAS_RES_LO))
+        self.show_calibration()
 
         self.rtt.start()
         # Trigger trigger window update, since production firmware uses wrong window value
@@ -194,29 +262,175 @@ class ppk_plotter():
         # Timer to update graphs, continous shot
         self.calibrating = True
 
-        timer = pg.QtCore.QTimer(self.gw)
-        timer.timeout.connect(self.update)
-        timer.start(1)  # 10us
+        # Render timer, curves are redrawn at most once per frame
+        self.render_timer = pg.QtCore.QTimer(self.gw)
+        self.render_timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.render_timer.timeout.connect(self.update)
+        self.render_timer.start(self.pacer.interval_ms)
         # Timer to update rms value
         timer_rms = pg.QtCore.QTimer(self.gw)
         timer_rms.timeout.connect(self.settings.update_status)
         timer_rms.start(200)  # 200ms
+        if hasattr(self.rtt, 'poll'):
+            # Samples come from the acquisition process, not from rtt_handler
+            timer_acq = pg.QtCore.QTimer(self.gw)
+            timer_acq.timeout.connect(self.poll_acquisition)
+            timer_acq.start(ACQUISITION_POLL_MS)
         self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_RUN])
 
+    def set_calibration(self, cal):
+        ''' Values from calibration.from_banner() '''
+        self.calibration = cal
+        self.plotdata.board_id = cal['board_id']
+        self.plotdata.CAL_MEAS_RES_LO = cal['CAL_MEAS_RES_LO']
+        self.plotdata.CAL_MEAS_RES_MID = cal['CAL_MEAS_RES_MID']
+        self.plotdata.CAL_MEAS_RES_HI = cal['CAL_MEAS_RES_HI']
+        self.plotdata.MEAS_RES_LO = cal['MEAS_RES_LO']
+        self.plotdata.MEAS_RES_MID = cal['MEAS_RES_MID']
+        self.plotdata.MEAS_RES_HI = cal['MEAS_RES_HI']
+        self.plotdata.vref_hi = cal['vref_hi']
+        self.plotdata.vref_lo = cal['vref_lo']
+        self.plotdata.vdd     = cal['vdd']
+
+    def recheck_calibration(self, data):
+        ''' The whole banner is in after starting on cached calibration, runs
+            on the RTT thread before the first frame is handled
+        '''
+        cal = calibration.revalidate(self.calibration, data)
+        if cal is None:
+            return
+        print("Calibration of board %s changed, using the values from the banner" % cal['board_id'])
+        self.set_calibration(cal)
+        # Widgets are updated on the GUI thread
+        self.calibration_changed = True
+
+    def show_calibration(self):
+        self.settings.m_vdd = int(self.plotdata.vdd)
+
+        self.settings.vdd_slider.setSliderPosition(int(self.plotdata.vdd))
+        self.settings.vref_on_slider.setSliderPosition(int(((int(self.plotdata.vref_hi) * 2 / 27000.0) + 1) * (0.41 / 10.98194) * 1000))
+        self.settings.vref_off_slider.setSliderPosition((((int(self.plotdata.vref_lo) * 2 + 30000) / 2000.0 + 1) / 16.3) * 100)
+
+        self.settings.r_high_tb.setText(str(self.plotdata.MEAS_RES_HI))
+        self.settings.r_mid_tb.setText(str(self.plotdata.MEAS_RES_MID))
+        self.settings.r_lo_tb.setText(str(self.plotdata.MEAS_RES_LO))
+
     def reject_outliers(self, data, m=2.):
         d = np.abs(data - np.median(data))
         mdev = np.median(d)
         s = d / mdev if mdev else 0.
         return data[s < m]
 
-    def start_log_thread(self):
-        self.log_thread = threading.Thread(target=self.do_logging)
-        self.log_thread.setDaemon(True)
-        self.log_thread.start()
+    def start_log(self, filename, log_trigger=False, compress=False):
+        ''' Start logging every average sample (and trigger sample) to a binary log.
+            Trigger samples are logged as the raw words from the PPK, except
+            with the acquisition process, which only hands over samples in A.
+        '''
+        self.stop_log()
+        if hasattr(self.rtt, 'poll'):
+            trigger_format = 'float'
+        else:
+            trigger_format = ENCODING_DELTA_ZLIB if compress else ENCODING_RAW
+        meta = dict(self.plotdata.log_meta(), offset=self.global_offset,
+                    switch_filter=self.settings.switch_filter_enabled)
+        self.logger = LogWriter(filename, meta, log_trigger, trigger_format)
+
+    def stop_log(self):
+        logger = self.logger
+        self.logger = None
+        if logger is not None:
+            logger.close()
+
+    def start_hires(self, directory, compress=False):
+        ''' Store every trigger frame at full resolution in directory, see libs.hires '''
+        self.stop_hires()
+        self.hires_dropped = self.rtt.dropped_frames
+        meta = dict(self.plotdata.log_meta(), offset=self.global_offset,
+                    switch_filter=self.settings.switch_filter_enabled)
+        self.hires = HiresWriter(directory, meta, compress)
+
+    def stop_hires(self):
+        hires = self.hires
+        self.hires = None
+        if hires is not None:
+            hires.close()
+
+    def set_soft_trigger(self, directory, level, edge, duration, pre, post):
+        ''' Save pre and post trigger average samples to directory every time
+            the software trigger fires, level in A and times in seconds.
+            directory None turns it off.
+        '''
+        self.soft_trigger = None
+        self.soft_pending.clear()
+        if directory is None:
+            self.soft_settings = None
+        else:
+            self.soft_settings = (directory, level, edge, duration, pre, post)
+
+    def soft_trigger_captured(self, capture):
+        path = save_capture(self.soft_settings[0], capture, self.plotdata.log_meta())
+        self.soft_captures += 1
+        self.last_soft_capture = path
+
+    def feed_soft_trigger(self):
+        ''' Hand the average samples received since the last frame to the software trigger '''
+        if self.soft_settings is None or not self.soft_pending:
+            return
+        # Only what is there now, samples added meanwhile wait for the next frame
+        pending = self.soft_pending
+        samples = [pending.popleft() for _ in range(len(pending))]
+        trigger = self.soft_trigger
+        if trigger is None or trigger.interval != self.plotdata.avg_interval:
+            # Captures are numbered on, also when the average interval changed
+            directory, level, edge, duration, pre, post = self.soft_settings
+            trigger = SoftTrigger(self.plotdata.avg_interval, level, edge, duration, pre, post,
+                                  on_capture=self.soft_trigger_captured)
+            trigger.captures = self.soft_captures
+            self.soft_trigger = trigger
+        trigger.process(samples)
 
     def rtt_handler(self, data):
         ''' All measurments arrive here. 4 bytes for avg window, 16 bytes for trigger window '''
-
+        hires = self.hires
+        if (len(data) == 4):
+            # Average data received (in microamp)
+            self.handle_average(decode_average(data) / 1e6)
+            if hires is not None:
+                hires.add_average()
+        else:
+            if hires is not None:
+                if self.rtt.dropped_frames != self.hires_dropped:
+                    self.hires_dropped = self.rtt.dropped_frames
+                    hires.mark_gap()
+                hires.add_frame(data)
+            logger = self.logger
+            if logger is not None:
+                logger.add_trigger_words(data)
+            # Trigger data received as raw adc words, with range flag prepended
+            samples, ranges = decode_trigger(data,
+                                             self.plotdata.MEAS_RES_LO,
+                                             self.plotdata.MEAS_RES_MID,
+                                             self.plotdata.MEAS_RES_HI,
+                                             self.global_offset,
+                                             self.settings.switch_filter_enabled)
+            if (ranges == MEAS_RANGE_NONE).any():
+                print("Range not detected")
+            self.handle_trigger(samples, ranges)
+
+    def poll_acquisition(self):
+        ''' Move the samples decoded by the acquisition process into the plot buffers '''
+        self.rtt.set_decoder(self.plotdata.MEAS_RES_LO,
+                             self.plotdata.MEAS_RES_MID,
+                             self.plotdata.MEAS_RES_HI,
+                             self.global_offset,
+                             self.settings.switch_filter_enabled)
+        averages, (samples, ranges) = self.rtt.poll()
+        for value in averages.tolist():
+            self.handle_average(value)
+        self.handle_trigger(samples, ranges)
+
+    def handle_average(self, value):
+        ''' An average sample in A, before offset calibration '''
         if(not self.calibrating_done):
             if not hasattr(self, "calibration_counter"):
                 self.calibration_counter = 10000  # it doesn't exist yet, so initialize it
@@ -226,15 +440,9 @@ class ppk_plotter():
             if(self.calibrating):
                 if(self.calibration_counter != 0):
                     self.calibration_counter = self.calibration_counter - 1
-                    if (len(data) == 4):
-
-                        s = ''.join([chr(b) for b in data])
-                        f = struct.unpack('f', s)[0]        # Get the uA value
-
-                        self.plotdata.avg_y[:-1] = self.plotdata.avg_y[1:]  # shift data in the array one sample left
-                        self.plotdata.avg_y[-1] = f / 1e6
+                    self.plotdata.push_avg(value)
 
-                        self.update_avg_curve = True
+                    self.update_avg_curve = True
 
                 else:
                     # Got all the samples
@@ -245,120 +453,99 @@ class ppk_plotter():
                 self.global_offset = np.average(self.plotdata.avg_y[1000:8000])
                 self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_DUT, 1])
                 del self.calibration_counter
-                self.plotdata.avg_y = np.zeros(self.plotdata.avg_bufsize, dtype=np.float)
-
-        if (len(data) == 4):
-            # Average data received (in microamp)
-            s = ''.join([chr(b) for b in data])
-            f = struct.unpack('f', s)[0]
-            self.plotdata.avg_y[:-1] = self.plotdata.avg_y[1:]  # shift data in the array one sample left
-            self.plotdata.avg_y[-1] = f / 1e6 - self.global_offset
-
-            self.update_avg_curve = True
-
-            if (self.enable_log):
-                try:
-                    if(not self.started_log):
-                        self.logfile = open(self.logfile_name, 'wb')
-                        fieldnames = ['Time[s]', 'Current[uA]']
-                        self.writer = csv.DictWriter(self.logfile, fieldnames=fieldnames)
-
-                        self.writer.writeheader()
-                        # Start thread for reading logging.
-                        self.started_log = True
-                        self.enable_log = False
-                except Exception as e:
-                    print(str(e))
-            # Just set update log after every sample
-            self.update_log = True
-
-        else:
-            # Trigger data received as raw adc float, with range flag prepended
-            prev_meas_range = MEAS_RANGE_LO
-            prev_data = None
-            for i in range(0, len(data), 2):
-                if (i + 1) < len(data):
-                    tmp = np.uint16((data[i + 1] << 8) + data[i])
-                    self.plotdata.current_meas_range = (tmp & MEAS_RANGE_MSK) >> MEAS_RANGE_POS
-                    adc_val = (tmp & MEAS_ADC_MSK) >> MEAS_ADC_POS
-                    sample_A = 0.0
-
-                    if self.plotdata.current_meas_range == MEAS_RANGE_LO:
-                        sample_A = adc_val * (ADC_REF / (ADC_GAIN * ADC_MAX * self.plotdata.MEAS_RES_LO))
-                        sample_A = sample_A - self.global_offset
-
-                    elif self.plotdata.current_meas_range == MEAS_RANGE_MID:
-                        sample_A = adc_val * (ADC_REF / (ADC_GAIN * ADC_MAX * self.plotdata.MEAS_RES_MID))
-                    elif self.plotdata.current_meas_range == MEAS_RANGE_HI:
-                        sample_A = adc_val * (ADC_REF / (ADC_GAIN * ADC_MAX * self.plotdata.MEAS_RES_HI))
-                    elif self.plotdata.current_meas_range == MEAS_RANGE_INVALID:
-                        print("Range INVALID")
-                    elif self.plotdata.current_meas_range == MEAS_RANGE_NONE:
-                        print("Range not detected")
-
-                    if(self.settings.switch_filter_enabled):
-                        if(self.plotdata.current_meas_range != prev_meas_range):
-                            # If switch, use last sample
-                            sample_A = prev_data
-                            prev_meas_range = self.plotdata.current_meas_range
-                        else:
-                            prev_data = sample_A
-
-                        prev_meas_range = self.plotdata.current_meas_range
-
-                    self.plotdata.trig_y[:-1] = self.plotdata.trig_y[1:]  # shift data in the array one sample left
-                    self.plotdata.trig_y[-1] = sample_A
-
-            # Update the trigger window when we have filled all samples
-            self.update_trig_curve = True
-
-    def do_logging(self):
-        ts = 0
-        while(self.alive):
-            try:
-                if(self.update_log and not self.log_stopped):
-                    ts += self.plotdata.avg_interval
-                    try:
-                        self.writer.writerow({'Time[s]': '{0:f}'.format(ts), 'Current[uA]': '{0:f}'.format(self.plotdata.avg_y[-1])})
-                        self.update_log = False
-                    except:
-                        # Exception happens before logging is started, due to no write instance
-                        pass
-                if(self.log_stopped):
-                    ts = 0
-                    try:
-                        self.logfile.close()
-                    except:
-                        pass
-            except Exception as e:
-                print(str(e))
-
-    def medfilt(self, x, k):
-        """Apply a length-k median filter to a 1D array x.
-        Boundaries are extended by repeating endpoints.
-        """
-        assert k % 2 == 1, "Median filter length must be odd."
-        assert x.ndim == 1, "Input must be one-dimensional."
-        k2 = (k - 1) // 2
-        y = np.zeros((len(x), k), dtype=x.dtype)
-        y[:, k2] = x
-        for i in range(k2):
-            j = k2 - i
-            y[j:, i] = x[:-j]
-            y[:j, i] = x[0]
-            y[:-j, - (i + 1)] = x[j:]
-            y[-j:, - (i + 1)] = x[-1]
-        return np.median(y, axis=1)
-
-    # update plots
+                self.plotdata.clear_avg()
+
+        sample = value - self.global_offset
+        self.plotdata.push_avg(self.plotdata.avg_median.push(sample))
+
+        self.update_avg_curve = True
+
+        # Logs keep the unfiltered samples
+        logger = self.logger
+        if logger is not None:
+            logger.add_average(sample)
+        if self.soft_settings is not None:
+            self.soft_pending.append(sample)
+        if self.calibrating_done:
+            self.charge.add(sample, self.plotdata.avg_interval, self.settings.m_vdd / 1000.0)
+
+    def handle_trigger(self, samples, ranges):
+        ''' Decoded trigger samples in A and their measurement ranges '''
+        if len(samples) == 0:
+            return
+        self.plotdata.current_meas_range = ranges[-1]
+
+        self.plotdata.trig_buf.extend(self.plotdata.trig_median.filter(samples))
+
+        logger = self.logger
+        if logger is not None:
+            logger.add_trigger(samples)
+
+        # Update the trigger window when we have filled all samples
+        self.update_trig_curve = True
+
+    def envelope_bins(self, plot, x):
+        ''' Bins for decimating x so the visible part gets about one bin per pixel '''
+        pixels = max(int(plot.vb.width()), 100)
+        if len(x) < 2:
+            return pixels
+        x0, x1 = plot.viewRange()[0]
+        visible = min(x1, x[-1]) - max(x0, x[0])
+        if visible <= 0:
+            return pixels
+        return int(pixels * (x[-1] - x[0]) / visible)
+
+    def draw_avg(self):
+        x, y = minmax_envelope(self.plotdata.avg_x, self.plotdata.avg_y,
+                               self.envelope_bins(self.avg_plot, self.plotdata.avg_x))
+        self.avg_curve.setData(x, y)
+
+    def draw_trig(self):
+        x, y = minmax_envelope(self.plotdata.trig_x, self.plotdata.trig_y,
+                               self.envelope_bins(self.trig_plot, self.plotdata.trig_x))
+        self.trig_curve.setData(x, y)
+
+    def avg_view_changed(self):
+        self.avg_view_dirty = True
+
+    def trig_view_changed(self):
+        self.trig_view_dirty = True
+
+    def set_fps(self, fps):
+        ''' Target frame rate of the plot window '''
+        self.pacer.set_fps(fps)
+        self.pacer.reset()
+        if self.render_timer is not None:
+            self.render_timer.setInterval(self.pacer.interval_ms)
+
+    # update plots, once per frame
     def update(self):
-        if self.update_trig_curve:
-            self.settings.trigger_single_button.setText("Single")
-            if (not self.settings.external_trig_enabled):
-                self.settings.trigger_start_button.setEnabled(True)
-            self.trig_curve.setData(self.plotdata.trig_x, self.plotdata.trig_y)
+        start = self.pacer.tick()
+        if self.calibration_changed:
+            self.calibration_changed = False
+            self.show_calibration()
+        self.feed_soft_trigger()
+        trig_dirty = (self.update_trig_curve or self.trig_view_dirty or
+                      self.drawn_trig_generation != self.plotdata.trig_buf.generation)
+        avg_dirty = (self.update_avg_curve or self.avg_view_dirty or
+                     self.drawn_avg_generation != self.plotdata.avg_buf.generation)
+        if not (trig_dirty or avg_dirty):
+            self.pacer.idle_tick()
+            return
+
+        if trig_dirty:
+            if self.update_trig_curve:
+                self.settings.trigger_single_button.setText("Single")
+                if (not self.settings.external_trig_enabled):
+                    self.settings.trigger_start_button.setEnabled(True)
             self.update_trig_curve = False
+            self.trig_view_dirty = False
+            self.drawn_trig_generation = self.plotdata.trig_buf.generation
+            self.draw_trig()
 
-        if self.update_avg_curve:
-            self.avg_curve.setData(self.plotdata.avg_x, self.plotdata.avg_y)
+        if avg_dirty:
             self.update_avg_curve = False
+            self.avg_view_dirty = False
+            self.drawn_avg_generation = self.plotdata.avg_buf.generation
+            self.draw_avg()
+        self.pacer.frame_done(start)
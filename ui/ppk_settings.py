@@ -3,12 +3,14 @@ import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui
 from libs.label import EditableLabel
 from libs.rtt import RTT_COMMANDS
+from libs.framepacer import FRAME_RATES
+from libs.softtrigger import EDGES
+from libs import hires
 import sys
 import numpy as np
 import struct
 from ui.ppk_ui import ShowInfoWindow
 from ui.ppk_ui import CloseInfoWindow
-from ui.log_viewer import LogViewer
 import webbrowser
 import warnings
 
@@ -17,14 +19,6 @@ str_uC = u'[\u03bcC]'
 str_delta = u'\u0394'
 
 
-def rms_flat(a):
-    """
-    Return the root mean square of all the elements of *a*, flattened out.
-    https://gist.github.com/endolith/1257010
-    """
-    return np.sqrt(np.mean(np.absolute(a)**2))
-
-
 class SettingsMainWindow(QtGui.QMainWindow):
     ''' Custom class to overrride closevent '''
     def __init__(self, settingsgui):
@@ -130,6 +124,7 @@ class SettingsWindow(QtCore.QObject):
 
     def destroyedEvent(self):
         self.rtt.alive = False
+        self.plot_window.stop_log()
         try:
             QtGui.QApplication.quit()
         except:
@@ -150,6 +145,7 @@ class SettingsWindow(QtCore.QObject):
         self.settings_mainw.fileMenu = self.settings_mainw.menuBar().addMenu("&File")
         self.settings_mainw.helpMenu = self.settings_mainw.menuBar().addMenu("&Help")
         self.settings_mainw.LogMenu = self.settings_mainw.menuBar().addMenu("&Logging")
+        self.settings_mainw.viewMenu = self.settings_mainw.menuBar().addMenu("&View")
         self.settings_mainw.menuBar().setNativeMenuBar(False)
 
         ''' Add items to File menu '''
@@ -178,14 +174,43 @@ class SettingsWindow(QtCore.QObject):
         self.stopLogAction = QtGui.QAction("Stop log", self, shortcut="Ctrl+V",
                                            triggered=self.stopLog)
         self.stopLogAction.setDisabled(True)
+        self.logTriggerAction = QtGui.QAction("Log trigger data", self, checkable=True)
+        self.compressTriggerAction = QtGui.QAction("Compress trigger and full resolution data", self,
+                                                   checkable=True)
         viewLogAction = QtGui.QAction("View log", self, shortcut="Ctrl+V",
                                       triggered=self.viewLog)
 
         self.settings_mainw.LogMenu.addAction(self.loggingAction)
         self.settings_mainw.LogMenu.addAction(self.stopLogAction)
+        self.settings_mainw.LogMenu.addAction(self.logTriggerAction)
+        self.settings_mainw.LogMenu.addAction(self.compressTriggerAction)
         self.settings_mainw.LogMenu.addAction(viewLogAction)
+        self.settings_mainw.LogMenu.addSeparator()
+        resetChargeAction = QtGui.QAction("Reset charge counter", self,
+                                          triggered=self.plot_window.charge.reset)
+        self.settings_mainw.LogMenu.addAction(resetChargeAction)
+        self.hiresAction = QtGui.QAction("Start full resolution capture", self,
+                                         triggered=self.startHires)
+        self.stopHiresAction = QtGui.QAction("Stop full resolution capture", self,
+                                             triggered=self.stopHires)
+        self.stopHiresAction.setDisabled(True)
+        self.settings_mainw.LogMenu.addAction(self.hiresAction)
+        self.settings_mainw.LogMenu.addAction(self.stopHiresAction)
+
+        # Plot frame rate and render statistics in the status bar
+        fpsGroup = QtGui.QActionGroup(self)
+        for fps in FRAME_RATES:
+            fpsAction = QtGui.QAction("%d frames per second" % fps, self, checkable=True)
+            fpsAction.setChecked(fps == self.plot_window.pacer.fps)
+            fpsAction.triggered.connect(lambda checked, fps=fps: self.plot_window.set_fps(fps))
+            fpsGroup.addAction(fpsAction)
+            self.settings_mainw.viewMenu.addAction(fpsAction)
+        self.settings_mainw.viewMenu.addSeparator()
+        self.renderStatsAction = QtGui.QAction("Show render statistics", self, checkable=True)
+        self.settings_mainw.viewMenu.addAction(self.renderStatsAction)
 
     def viewLog(self):
+        from ui.log_viewer import LogViewer     # Only loaded when a log is opened
         lv = LogViewer()
         lfile = lv.open_file()
         if(lfile is not None):
@@ -194,25 +219,29 @@ class SettingsWindow(QtCore.QObject):
             self.trigger_start_button.setText('Start')
             self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_TRIG_STOP])
             lv.do_log(lfile)
+            self.log_viewer = lv    # Keep the viewer alive while its window is open
 
     def stopLog(self):
-        self.plot_window.started_log = False
-        self.plot_window.update_log = False
-        self.plot_window.enable_log = False
-        self.plot_window.log_stopped = True
+        self.plot_window.stop_log()
         self.loggingAction.setDisabled(False)
+        self.logTriggerAction.setDisabled(False)
+        self.compressTriggerAction.setDisabled(False)
         self.stopLogAction.setDisabled(True)
 
     def startLog(self):
         self.stopLog()
         self.stopLogAction.setDisabled(False)
         filename = QtGui.QFileDialog.getSaveFileName(None, 'Dialog Title')
+        if(filename[0] == ''):
+            self.stopLogAction.setDisabled(True)
+            return
         try:
-            self.plot_window.logfile_name = filename[0]
-            self.plot_window.enable_log = True
-            self.plot_window.log_stopped = False
+            self.plot_window.start_log(filename[0], self.logTriggerAction.isChecked(),
+                                       self.compressTriggerAction.isChecked())
             print("Started logging to %s" % filename[0])
             self.loggingAction.setDisabled(True)
+            self.logTriggerAction.setDisabled(True)
+            self.compressTriggerAction.setDisabled(True)
             ret = QtGui.QMessageBox.information(None,
                                                 "Logging started!",
                                                 "Logging average data to %s started" % filename[0],
@@ -229,6 +258,34 @@ class SettingsWindow(QtCore.QObject):
                                                 QtGui.QMessageBox.Ok,
                                                 QtGui.QMessageBox.NoButton)
 
+    def startHires(self):
+        if hasattr(self.rtt, 'poll'):
+            QtGui.QMessageBox.warning(None, "Full resolution capture",
+                                      "Full resolution capture needs the raw trigger frames,\r\n"
+                                      "start without --acquisition-process to use it.",
+                                      QtGui.QMessageBox.Ok, QtGui.QMessageBox.NoButton)
+            return
+        directory = QtGui.QFileDialog.getExistingDirectory(None, 'Folder for the full resolution capture')
+        if directory == '':
+            return
+        self.plot_window.start_hires(directory, self.compressTriggerAction.isChecked())
+        # Longest windows at level 0, so a new window starts as soon as the last one is sent
+        self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_TRIG_WINDOW_SET, hires.WINDOW >> 8, hires.WINDOW & 0xFF])
+        self.set_trigger(0)
+        self.trigger_start_button.setText("Stop")
+        self.hiresAction.setDisabled(True)
+        self.stopHiresAction.setDisabled(False)
+        print("Full resolution capture to %s" % directory)
+
+    def stopHires(self):
+        self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_TRIG_STOP])
+        self.trigger_start_button.setText("Start")
+        self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_TRIG_WINDOW_SET,
+                                self.plotdata.trigger_high, self.plotdata.trigger_low])
+        self.plot_window.stop_hires()
+        self.hiresAction.setDisabled(False)
+        self.stopHiresAction.setDisabled(True)
+
     def menuActionExit(self):
         print("pressed exit")
 
@@ -344,6 +401,7 @@ class SettingsWindow(QtCore.QObject):
         gb_trigger_layout_bottom1   = QtGui.QHBoxLayout()   # next row
         gb_trigger_layout_bottom2   = QtGui.QHBoxLayout()   # next row
         gb_trigger_layout_bottom3   = QtGui.QHBoxLayout()   # next row
+        gb_trigger_layout_bottom4   = QtGui.QHBoxLayout()   # next row
 
         # Create items
         self.triggerlevel_textbox = QtGui.QLineEdit()
@@ -368,6 +426,21 @@ class SettingsWindow(QtCore.QObject):
         self.trig_window_label.valueChanged.connect(self.TriggerWindowValueChanged)
         self.enable_ext_trigg_chkb = QtGui.QCheckBox()
 
+        # Software trigger, runs on the average samples in this program
+        self.soft_trigger_chkb = QtGui.QCheckBox('Software trigger')
+        self.soft_level_textbox = QtGui.QLineEdit('2500')
+        self.soft_edge_combo = QtGui.QComboBox()
+        self.soft_edge_combo.addItems(EDGES)
+        self.soft_duration_textbox = QtGui.QLineEdit('0')
+        self.soft_pre_textbox = QtGui.QLineEdit('10')
+        self.soft_post_textbox = QtGui.QLineEdit('100')
+        self.soft_trigger_chkb.stateChanged.connect(self.soft_trigger_changed)
+        for textbox in (self.soft_level_textbox, self.soft_duration_textbox,
+                        self.soft_pre_textbox, self.soft_post_textbox):
+            textbox.returnPressed.connect(self.soft_trigger_settings_changed)
+        self.soft_edge_combo.currentIndexChanged.connect(self.soft_trigger_settings_changed)
+        self.soft_trigger_dir = None
+
         # Set up groupbox with layouts
         gb_trigger = QtGui.QGroupBox("Trigger")
         gb_trigger_layout_top.addWidget(self.trigger_single_button)
@@ -393,19 +466,57 @@ class SettingsWindow(QtCore.QObject):
         gb_trigger_layout.addLayout(gb_trigger_layout_bottom)
         gb_trigger_layout.addLayout(gb_trigger_layout_bottom1)
         gb_trigger_layout.addLayout(gb_trigger_layout_bottom2)
+        gb_trigger_layout_bottom3.addWidget(self.soft_trigger_chkb)
+        gb_trigger_layout_bottom3.addWidget(self.soft_level_textbox)
+        gb_trigger_layout_bottom3.addWidget(QtGui.QLabel(str_uA))
+        gb_trigger_layout_bottom3.addWidget(self.soft_edge_combo)
+        gb_trigger_layout_bottom4.addWidget(QtGui.QLabel('Hold:'))
+        gb_trigger_layout_bottom4.addWidget(self.soft_duration_textbox)
+        gb_trigger_layout_bottom4.addWidget(QtGui.QLabel('Pre:'))
+        gb_trigger_layout_bottom4.addWidget(self.soft_pre_textbox)
+        gb_trigger_layout_bottom4.addWidget(QtGui.QLabel('Post:'))
+        gb_trigger_layout_bottom4.addWidget(self.soft_post_textbox)
+        gb_trigger_layout_bottom4.addWidget(QtGui.QLabel('[ms]'))
         gb_trigger_layout.addLayout(gb_trigger_layout_bottom3)
+        gb_trigger_layout.addLayout(gb_trigger_layout_bottom4)
 
         gb_trigger.setLayout(gb_trigger_layout)
 
         # Return the groupbox object
         return gb_trigger
 
+    def soft_trigger_changed(self, state):
+        if state and self.soft_trigger_dir is None:
+            directory = QtGui.QFileDialog.getExistingDirectory(None, 'Folder for software trigger captures')
+            if directory == '':
+                self.soft_trigger_chkb.setChecked(False)
+                return
+            self.soft_trigger_dir = directory
+        self.soft_trigger_settings_changed()
+
+    def soft_trigger_settings_changed(self):
+        if not self.soft_trigger_chkb.isChecked():
+            self.plot_window.set_soft_trigger(None, 0, None, 0, 0, 0)
+            return
+        try:
+            level = float(self.soft_level_textbox.text()) / 1e6
+            duration = float(self.soft_duration_textbox.text()) / 1e3
+            pre = float(self.soft_pre_textbox.text()) / 1e3
+            post = float(self.soft_post_textbox.text()) / 1e3
+        except ValueError:
+            print("Software trigger settings must be numbers")
+            return
+        self.plot_window.set_soft_trigger(self.soft_trigger_dir, level, self.soft_edge_combo.currentText(),
+                                          duration, pre, post)
+        print("Software trigger captures go to %s" % self.soft_trigger_dir)
+
     def switch_filter_chk_changed(self, state):
         self.switch_filter_enabled = bool(state)
 
     def MedianFilterChanged(self, val):
         k_val = val + (val + 1)
         self.median_filter_value_label.setText(str(k_val))
+        self.plotdata.set_median(k_val)
 
     def range_settings(self):
         # Create items
@@ -540,6 +651,7 @@ class SettingsWindow(QtCore.QObject):
         vref_off_layout = QtGui.QHBoxLayout()          # Sublayout for vrefs off
         reset_sw_points_layout = QtGui.QHBoxLayout()   # Button for resetting switch points
         switch_filter_layout = QtGui.QHBoxLayout()     # For adding switch filter checkbox
+        median_filter_layout = QtGui.QHBoxLayout()     # Median filter slider and k
         vref_off_sliders_layout = QtGui.QHBoxLayout()  # For slider and label
         vref_off_labels_layout = QtGui.QVBoxLayout()   # For values
         switches_gb = QtGui.QGroupBox("Switching points")
@@ -610,6 +722,19 @@ class SettingsWindow(QtCore.QObject):
         switch_filter_layout.addWidget(QtGui.QLabel('Enable switch filter'))
         switch_filter_layout.addWidget(self.enable_switch_filter_chkb)
 
+        # Median filter over the last k samples, k = 2 * val + 1
+        self.median_filter_slider = QtGui.QSlider(QtCore.Qt.Horizontal)
+        self.median_filter_slider.setMinimum(0)
+        self.median_filter_slider.setMaximum(10)
+        self.median_filter_slider.setValue(0)
+        self.median_filter_slider.valueChanged.connect(self.MedianFilterChanged)
+        self.median_filter_slider.setToolTip("Median filter for incoming samples, 1 turns it off.\r\n"
+                                             "Logged samples are not filtered.")
+        self.median_filter_value_label = QtGui.QLabel('1')
+        median_filter_layout.addWidget(QtGui.QLabel('Median filter'))
+        median_filter_layout.addWidget(self.median_filter_slider)
+        median_filter_layout.addWidget(self.median_filter_value_label)
+
         reset_sw_button = QtGui.QPushButton("Reset switching points")
         reset_sw_button.setToolTip("Resets switching points to what was set at start-up")
         reset_sw_button.clicked.connect(self.reset_vrefs)
@@ -619,6 +744,7 @@ class SettingsWindow(QtCore.QObject):
         switches_layout.addSpacing(10)
         switches_layout.addLayout(vref_off_layout)
         switches_layout.addLayout(switch_filter_layout)
+        switches_layout.addLayout(median_filter_layout)
         switches_layout.addLayout(reset_sw_points_layout)
         vref_slider_layout.addLayout(vdd_layout)
 
@@ -783,9 +909,7 @@ class SettingsWindow(QtCore.QObject):
         self.plotdata.trigger_low = self.trig_window_val & 0xFF
         self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_TRIG_WINDOW_SET, self.plotdata.trigger_high, self.plotdata.trigger_low])
 
-        self.trig_bufsize = int(self.plotdata.trig_timewindow / self.plotdata.trig_interval)
-        self.plotdata.trig_x = np.linspace(0.0, self.plotdata.trig_timewindow, self.trig_bufsize)
-        self.plotdata.trig_y = np.zeros(self.trig_bufsize, dtype=np.float)
+        self.plotdata.resize_trig()
 
         self.trig_window_label.setText('%5.2f ms' % ((self.plotdata.trig_timewindow * 1000)))
         sys.stdout.flush()
@@ -804,9 +928,7 @@ class SettingsWindow(QtCore.QObject):
         self.plotdata.avg_timewindow = (avg_window_val)
         self.avg_window_slider.setValue(avg_window_val * 10)
 
-        self.plotdata.avg_bufsize  = int(self.plotdata.avg_timewindow / (self.plotdata.avg_interval))
-        self.plotdata.avg_x = np.linspace(0.0, self.plotdata.avg_timewindow, self.plotdata.avg_bufsize)
-        self.plotdata.avg_y = np.zeros(self.plotdata.avg_bufsize, dtype=np.float)
+        self.plotdata.resize_avg()
 
         self.avg_window_label.setText('%.2f s' % (self.plotdata.avg_timewindow))
 
@@ -816,14 +938,12 @@ class SettingsWindow(QtCore.QObject):
 
     def AverageIntervalSliderReleased(self):
         avg_samples_val = int(self.avg_sample_num_label.text())
-        samples_high = (avg_samples_val / 10) >> 8
-        samples_low  = (avg_samples_val / 10) & 0xFF
+        samples_high = (avg_samples_val // 10) >> 8
+        samples_low  = (avg_samples_val // 10) & 0xFF
         self.rtt.write_stuffed([RTT_COMMANDS.RTT_CMD_AVG_NUM_SET, samples_high, samples_low])
 
         self.plotdata.avg_interval   = self.plotdata.sample_interval * avg_samples_val
-        self.plotdata.avg_bufsize  = int(self.plotdata.avg_timewindow / self.plotdata.avg_interval)
-        self.plotdata.avg_x = np.linspace(0.0, self.plotdata.avg_timewindow, self.plotdata.avg_bufsize)
-        self.plotdata.avg_y = np.zeros(self.plotdata.avg_bufsize, dtype=np.float)
+        self.plotdata.resize_avg()
 
     def AverageIntervalSliderMoved(self, val):
         self.avg_sample_num_label.setText('%d' % (val * 10))
@@ -1029,10 +1149,15 @@ class SettingsWindow(QtCore.QObject):
 
     def update_status(self):
         try:
-            _max = max(self.plotdata.avg_y)
-            _min = min(self.plotdata.avg_y)
-            _rms = rms_flat(self.plotdata.avg_y)
-            _avg = np.average(self.plotdata.avg_y)
+            # Ordered views into the sample ring buffers, no copies
+            avg_y = self.plotdata.avg_buf.view()
+            trig_y = self.plotdata.trig_buf.view()
+            # Kept up to date as samples arrive, no need to scan the window
+            stats = self.plotdata.avg_stats
+            _max = stats.max
+            _min = stats.min
+            _rms = stats.rms
+            _avg = stats.mean
 
             max_val, max_unit = self.amp_unit_determine(_max)
             min_val, min_unit = self.amp_unit_determine(_min)
@@ -1041,9 +1166,29 @@ class SettingsWindow(QtCore.QObject):
 
             status_font = QtGui.QFont("Arial", 8)
             self.statusbarLabel.setFont(status_font)
-            self.statusbarLabel.setText("max: <b>%.2f</b> %s min: <b>%.2f</b> %s rms: <b>%.2f</b> %s avg: <b>%.2f</b> %s"
-                                        % (max_val, max_unit, min_val, min_unit, rms_val, rms_unit, avg_val, avg_unit))
-            self.plot_window.trig_curve.setData(self.plotdata.trig_x, self.plotdata.trig_y)
+            status = ("max: <b>%.2f</b> %s min: <b>%.2f</b> %s rms: <b>%.2f</b> %s avg: <b>%.2f</b> %s"
+                      % (max_val, max_unit, min_val, min_unit, rms_val, rms_unit, avg_val, avg_unit))
+            if self.rtt.dropped_frames:
+                # Processing could not keep up with the RTT reader
+                status += " dropped: <b>%d</b>" % self.rtt.dropped_frames
+            charge, energy, seconds = self.plot_window.charge.since_reset()
+            charge_val, charge_unit = self.charge_unit_determine(charge)
+            seconds = int(seconds)
+            status += (" charge: <b>%.2f</b> %s energy: <b>%.3f</b> [mJ] in %d:%02d:%02d"
+                       % (charge_val, charge_unit, energy * 1e3,
+                          seconds // 3600, seconds // 60 % 60, seconds % 60))
+            if self.plot_window.soft_settings is not None:
+                status += " soft triggers: <b>%d</b>" % self.plot_window.soft_captures
+            if self.plot_window.hires is not None:
+                status += (" full res: <b>%.1f</b> s gaps: <b>%d</b>"
+                           % (self.plot_window.hires.samples * self.plotdata.sample_interval,
+                              self.plot_window.hires.gaps))
+            if self.renderStatsAction.isChecked():
+                render = self.plot_window.pacer.stats()
+                status += (" fps: <b>%.0f</b>/%d frame: <b>%.1f</b> ms (max %.1f) skipped: <b>%d</b>"
+                           % (render['fps'], render['target_fps'], render['frame_ms'],
+                              render['frame_ms_max'], render['skipped']))
+            self.statusbarLabel.setText(status)
 
             if self.curs_avg_enabled:
                 samples_per_us = len(self.plotdata.avg_x) / self.plotdata.avg_timewindow  # us
@@ -1055,14 +1200,15 @@ class SettingsWindow(QtCore.QObject):
                     if(byte_position_curs1 < 0):
                         self.plot_window.avg_region.setRegion([0, curs2])
 
-                    curs1_y_val, curs1_y_unit = self.amp_unit_determine(self.plotdata.avg_y[byte_position_curs1])
-                    curs2_y_val, curs2_y_unit = self.amp_unit_determine(self.plotdata.avg_y[byte_position_curs2])
+                    curs1_y_val, curs1_y_unit = self.amp_unit_determine(avg_y[byte_position_curs1])
+                    curs2_y_val, curs2_y_unit = self.amp_unit_determine(avg_y[byte_position_curs2])
 
-                    curs_avg_val, curs_avg_unit = self.amp_unit_determine(np.average(self.plotdata.avg_y[byte_position_curs1:byte_position_curs2]))
-                    curs_rms_val, curs_rms_unit = self.amp_unit_determine(rms_flat(self.plotdata.avg_y[byte_position_curs1:byte_position_curs2]))
-                    curs_max_val, curs_max_unit = self.amp_unit_determine(np.max(self.plotdata.avg_y[byte_position_curs1:byte_position_curs2]))
+                    _avg, _rms, _max = self.plotdata.avg_index.region(byte_position_curs1, byte_position_curs2)
+                    curs_avg_val, curs_avg_unit = self.amp_unit_determine(_avg)
+                    curs_rms_val, curs_rms_unit = self.amp_unit_determine(_rms)
+                    curs_max_val, curs_max_unit = self.amp_unit_determine(_max)
 
-                    charge = (np.average(self.plotdata.avg_y[byte_position_curs1:byte_position_curs2]) * (curs2 - curs1))
+                    charge = _avg * (curs2 - curs1)
                     curs_charge_cal, curs_charge_unit = self.charge_unit_determine(charge)
 
                     self.curs_avg_rms_label.setText("RMS: <b>%.2f</b> %s" % (curs_rms_val, curs_rms_unit))
@@ -1087,14 +1233,15 @@ class SettingsWindow(QtCore.QObject):
                     if(byte_position_curs1 < 0):
                         self.plot_window.trig_region.setRegion([0, curs2])
 
-                    curs1_y_val, curs1_y_unit = self.amp_unit_determine(self.plotdata.trig_y[byte_position_curs1])
-                    curs2_y_val, curs2_y_unit = self.amp_unit_determine(self.plotdata.trig_y[byte_position_curs2])
+                    curs1_y_val, curs1_y_unit = self.amp_unit_determine(trig_y[byte_position_curs1])
+                    curs2_y_val, curs2_y_unit = self.amp_unit_determine(trig_y[byte_position_curs2])
 
-                    curs_rms_val, curs_rms_unit = self.amp_unit_determine(rms_flat(self.plotdata.trig_y[byte_position_curs1:byte_position_curs2]))
-                    curs_avg_val, curs_avg_unit = self.amp_unit_determine(np.average(self.plotdata.trig_y[byte_position_curs1:byte_position_curs2]))
-                    curs_max_val, curs_max_unit = self.amp_unit_determine(np.max(self.plotdata.trig_y[byte_position_curs1:byte_position_curs2]))
+                    _avg, _rms, _max = self.plotdata.trig_index.region(byte_position_curs1, byte_position_curs2)
+                    curs_rms_val, curs_rms_unit = self.amp_unit_determine(_rms)
+                    curs_avg_val, curs_avg_unit = self.amp_unit_determine(_avg)
+                    curs_max_val, curs_max_unit = self.amp_unit_determine(_max)
 
-                    charge = (np.average(self.plotdata.trig_y[byte_position_curs1:byte_position_curs2]) * (curs2 - curs1))
+                    charge = _avg * (curs2 - curs1)
                     curs_charge_cal, curs_charge_unit = self.charge_unit_determine(charge)
 
                     self.curs_trig_rms_label.setText("RMS: <b>%.2f</b> %s" % (curs_rms_val, curs_rms_unit))
@@ -1106,6 +1253,5 @@ class SettingsWindow(QtCore.QObject):
                 except IndexError:
                     self.plot_window.trig_region.setRegion([curs1, self.plotdata.trig_timewindow - 1e-9])
 
-            self.plot_window.trig_curve.setData(self.plotdata.trig_x, self.plotdata.trig_y)
         except:
             pass